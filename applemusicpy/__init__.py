@@ -1 +1,9 @@
-from .client import AppleMusic
\ No newline at end of file
+__all__ = ['AppleMusic']
+
+
+def __getattr__(name):
+    # Import the client on first access so `import applemusicpy` stays cheap
+    if name == 'AppleMusic':
+        from .client import AppleMusic
+        return AppleMusic
+    raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
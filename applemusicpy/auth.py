@@ -0,0 +1,30 @@
+ALGORITHM = 'ES256'  # encryption algo that Apple requires
+
+
+def sign_token(secret_key, key_id, team_id, session_length, alg=ALGORITHM):
+    """
+    Sign a developer token
+
+    :param secret_key: Secret Key provided by Apple
+    :param key_id: Key ID provided by Apple
+    :param team_id: Team ID provided by Apple
+    :param session_length: Length the token is valid, in hours
+    :param alg: Signing algorithm
+
+    :return: Tuple of the encoded token and the datetime it expires at
+    """
+    import jwt
+    from datetime import datetime, timedelta
+
+    token_exp_time = datetime.now() + timedelta(hours=session_length)
+    headers = {
+        'alg': alg,
+        'kid': key_id
+    }
+    payload = {
+        'iss': team_id,  # issuer
+        'iat': int(datetime.now().timestamp()),  # issued at
+        'exp': int(token_exp_time.timestamp())  # expiration time
+    }
+    token = jwt.encode(payload, secret_key, algorithm=alg, headers=headers)
+    return (token if type(token) is not bytes else token.decode()), token_exp_time
@@ -0,0 +1,159 @@
+import threading
+import time
+
+from .exceptions import CircuitOpenError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+ENDPOINT_FAMILIES = ('search', 'charts', 'resources', 'relationships', 'other')
+
+
+def endpoint_family(url):
+    """
+    Classify an API URL into the endpoint family its circuit breaker belongs to
+
+    :param url: URL of API endpoint
+
+    :return: One of ENDPOINT_FAMILIES
+    """
+    path = url.split('?', 1)[0]
+    parts = [p for p in path.split('/v1/', 1)[-1].split('/') if p]
+    if len(parts) >= 3 and parts[0] == 'catalog':
+        if parts[2] == 'search':
+            return 'search'
+        if parts[2] == 'charts':
+            return 'charts'
+        return 'relationships' if len(parts) > 4 else 'resources'
+    if parts and parts[0] == 'storefronts':
+        return 'resources'
+    return 'other'
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one endpoint family.
+
+    Closed: requests flow, consecutive failures are counted.
+    Open: requests fail fast until recovery_timeout has passed.
+    Half-open: a limited number of trial requests are let through; a success closes the circuit,
+    a failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, half_open_max_calls=1):
+        """
+        :param failure_threshold: Consecutive failures (429, 5xx or connection errors) that open the circuit
+        :param recovery_timeout: Seconds an open circuit waits before letting trial requests through
+        :param half_open_max_calls: Number of concurrent trial requests allowed while half-open
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+            self._state = HALF_OPEN
+            self._trials = 0
+        return self._state
+
+    def retry_after(self):
+        """
+        :return: Seconds until an open circuit lets a trial request through
+        """
+        with self._lock:
+            if self._current_state() != OPEN:
+                return 0
+            return max(0, self.recovery_timeout - (time.monotonic() - self._opened_at))
+
+    def allow_request(self):
+        """
+        Check whether a request may be sent, reserving a trial slot when half-open
+
+        :return: True if the request may be sent
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._trials < self.half_open_max_calls:
+                self._trials += 1
+                return True
+            return False
+
+    def cancel(self):
+        """
+        Give back a trial slot reserved by allow_request when the request was not sent
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._trials > 0:
+                self._trials -= 1
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trials = 0
+
+    def record_failure(self):
+        with self._lock:
+            state = self._current_state()
+            self._failures += 1
+            if state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trials = 0
+
+
+class CircuitBreakers:
+    """
+    One CircuitBreaker per endpoint family (search, charts, catalog resources, relationships),
+    sharing the same thresholds
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30, half_open_max_calls=1):
+        """
+        :param failure_threshold: Consecutive failures that open a circuit
+        :param recovery_timeout: Seconds an open circuit waits before letting trial requests through
+        :param half_open_max_calls: Number of concurrent trial requests allowed while half-open
+        """
+        self._breakers = {family: CircuitBreaker(failure_threshold, recovery_timeout, half_open_max_calls)
+                          for family in ENDPOINT_FAMILIES}
+
+    def for_url(self, url):
+        """
+        :param url: URL of API endpoint
+
+        :return: Tuple of the endpoint family and its CircuitBreaker
+        """
+        family = endpoint_family(url)
+        return family, self._breakers[family]
+
+    def states(self):
+        """
+        :return: Dictionary of endpoint family to circuit state
+        """
+        return {family: breaker.state for family, breaker in self._breakers.items()}
+
+    def check(self, url):
+        """
+        Raise CircuitOpenError if the circuit for this URL does not allow a request
+
+        :param url: URL of API endpoint
+
+        :return: The CircuitBreaker for the URL
+        """
+        family, breaker = self.for_url(url)
+        if not breaker.allow_request():
+            raise CircuitOpenError(family, breaker.retry_after())
+        return breaker
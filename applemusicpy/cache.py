@@ -0,0 +1,386 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+
+
+def cache_key(url, params):
+    """
+    Build a cache key for a GET request
+
+    :param url: URL of API endpoint
+    :param params: API parameters, None values are ignored like they are by requests
+
+    :return: Hashable cache key
+    """
+    items = tuple(sorted((k, str(v)) for k, v in (params or {}).items() if v is not None))
+    return url, items
+
+
+def response_validators(headers):
+    """
+    :param headers: Response headers
+
+    :return: Dictionary with the ETag and Last-Modified validators the response carries
+    """
+    validators = {}
+    if headers.get('ETag'):
+        validators['etag'] = headers['ETag']
+    if headers.get('Last-Modified'):
+        validators['last_modified'] = headers['Last-Modified']
+    return validators
+
+
+class Revalidation:
+    """
+    Validators of a cached response sent with a conditional GET, and the outcome of the request
+    """
+
+    def __init__(self, validators=None):
+        """
+        :param validators: Dictionary with etag and/or last_modified of the cached response
+        """
+        self.validators = validators or {}
+        self.response_validators = {}
+        self.not_modified = False
+
+    def headers(self):
+        """
+        :return: If-None-Match and If-Modified-Since request headers
+        """
+        headers = {}
+        if 'etag' in self.validators:
+            headers['If-None-Match'] = self.validators['etag']
+        if 'last_modified' in self.validators:
+            headers['If-Modified-Since'] = self.validators['last_modified']
+        return headers
+
+
+class ResponseCache:
+    """
+    Thread-safe in-memory LRU cache of decoded API responses.
+    Entries older than the TTL are not returned as fresh, but are kept so they can be served stale
+    (e.g. while a circuit breaker is open) until they are evicted, and so they can be revalidated with
+    the ETag and Last-Modified validators stored alongside them.
+    """
+
+    def __init__(self, ttl=3600, max_entries=10000):
+        """
+        :param ttl: Number of seconds an entry is considered fresh
+        :param max_entries: Maximum number of entries kept before the least recently used are evicted
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+
+    def get(self, key, allow_stale=False):
+        """
+        Get a cached response
+
+        :param key: Cache key, see cache_key
+        :param allow_stale: Return the entry even if it is older than the TTL
+
+        :return: The cached response, or None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (not allow_stale and time.monotonic() - entry[1] > self.ttl):
+                if not allow_stale:
+                    self.misses += 1
+                return None
+            if not allow_stale:
+                self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def validators(self, key):
+        """
+        :param key: Cache key, see cache_key
+
+        :return: Validators stored with the entry, to revalidate it with. Empty if there is no entry
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry[2]) if entry is not None else {}
+
+    def set(self, key, value, validators=None):
+        """
+        Store a response
+
+        :param key: Cache key, see cache_key
+        :param value: Decoded JSON response
+        :param validators: Dictionary with the response's etag and/or last_modified
+        """
+        with self._lock:
+            self._entries[key] = (value, time.monotonic(), validators or {})
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def refresh(self, key, validators=None):
+        """
+        Mark an entry fresh again after the API answered 304 Not Modified
+
+        :param key: Cache key, see cache_key
+        :param validators: Validators the 304 response carried, replacing the stored ones if given
+
+        :return: The cached response, or None if the entry was evicted in the meantime
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries[key] = (entry[0], time.monotonic(), validators or entry[2])
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def record_revalidation(self, not_modified):
+        """
+        Count a conditional request
+
+        :param not_modified: Whether the API answered 304 Not Modified
+        """
+        with self._lock:
+            self.revalidations += 1
+            self.not_modified += not_modified
+
+    def stats(self):
+        """
+        :return: Dictionary with the number of entries, hits, misses, conditional requests, 304 responses
+            and the share of conditional requests answered with 304
+        """
+        with self._lock:
+            return _stats(len(self._entries), self.hits, self.misses, self.revalidations, self.not_modified)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _stats(entries, hits, misses, revalidations, not_modified):
+    return {'entries': entries, 'hits': hits, 'misses': misses, 'revalidations': revalidations,
+            'not_modified': not_modified,
+            'revalidation_hit_rate': not_modified / revalidations if revalidations else None}
+
+
+class FileCache:
+    """
+    Cache of decoded API responses kept as JSON files in a directory, so it survives between processes and
+    can be shared by several of them. Has the same interface as ResponseCache.
+    Stale entries stay on disk until they are overwritten or the cache is cleared.
+    """
+
+    def __init__(self, directory, ttl=86400):
+        """
+        :param directory: Directory the entries are stored in, created if missing
+        :param ttl: Number of seconds an entry is considered fresh
+        """
+        self.directory = directory
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.not_modified = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _read(self, key):
+        import json
+
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, entry):
+        import json
+
+        path = self._path(key)
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    def _path(self, key):
+        import hashlib
+
+        digest = hashlib.blake2b(repr(key).encode('utf-8'), digest_size=16).hexdigest()
+        return os.path.join(self.directory, digest + '.json')
+
+    def get(self, key, allow_stale=False):
+        """
+        Get a cached response
+
+        :param key: Cache key, see cache_key
+        :param allow_stale: Return the entry even if it is older than the TTL
+
+        :return: The cached response, or None
+        """
+        entry = self._read(key)
+        if entry is None or (not allow_stale and time.time() - entry['stored_at'] > self.ttl):
+            if not allow_stale:
+                with self._lock:
+                    self.misses += 1
+            return None
+        if not allow_stale:
+            with self._lock:
+                self.hits += 1
+        return entry['value']
+
+    def validators(self, key):
+        """
+        :param key: Cache key, see cache_key
+
+        :return: Validators stored with the entry, to revalidate it with. Empty if there is no entry
+        """
+        entry = self._read(key)
+        return entry.get('validators', {}) if entry is not None else {}
+
+    def set(self, key, value, validators=None):
+        """
+        Store a response. The file is written under a temporary name and renamed, so readers never see
+        a partial entry.
+
+        :param key: Cache key, see cache_key
+        :param value: Decoded JSON response
+        :param validators: Dictionary with the response's etag and/or last_modified
+        """
+        self._write(key, {'stored_at': time.time(), 'value': value, 'validators': validators or {}})
+
+    def refresh(self, key, validators=None):
+        """
+        Mark an entry fresh again after the API answered 304 Not Modified
+
+        :param key: Cache key, see cache_key
+        :param validators: Validators the 304 response carried, replacing the stored ones if given
+
+        :return: The cached response, or None if the entry is gone
+        """
+        entry = self._read(key)
+        if entry is None:
+            return None
+        entry['stored_at'] = time.time()
+        if validators:
+            entry['validators'] = validators
+        self._write(key, entry)
+        return entry['value']
+
+    def record_revalidation(self, not_modified):
+        with self._lock:
+            self.revalidations += 1
+            self.not_modified += not_modified
+
+    def stats(self):
+        """
+        :return: Same as ResponseCache.stats, for this process
+        """
+        with self._lock:
+            return _stats(len(self), self.hits, self.misses, self.revalidations, self.not_modified)
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.json'):
+                os.remove(os.path.join(self.directory, name))
+
+    def __len__(self):
+        return sum(1 for name in os.listdir(self.directory) if name.endswith('.json'))
+
+
+class NegativeCache:
+    """
+    Thread-safe cache of lookups known to come back empty: resource IDs that returned 404 or were missing
+    from a multiple resource response, and filter values (e.g. ISRCs) that matched nothing.
+    Entries are kept per storefront and resource type and expire after their own TTL, so content that
+    comes back is picked up again.
+    """
+
+    def __init__(self, ttl=86400, max_entries=100000):
+        """
+        :param ttl: Number of seconds an entry is trusted
+        :param max_entries: Maximum number of entries kept before the oldest are evicted
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+
+    def add(self, storefront, resource_type, value):
+        """
+        Record a missing lookup
+
+        :param storefront: Apple Music storefront
+        :param resource_type: Resource type, or a filter scope such as "songs:isrc"
+        :param value: Resource ID or filter value
+        """
+        key = (storefront, resource_type, str(value))
+        with self._lock:
+            self._entries[key] = time.monotonic()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _is_missing(self, key, now):
+        added = self._entries.get(key)
+        if added is None:
+            return False
+        if now - added > self.ttl:
+            del self._entries[key]
+            return False
+        return True
+
+    def contains(self, storefront, resource_type, value):
+        """
+        :return: True if the lookup is known to be missing
+        """
+        with self._lock:
+            missing = self._is_missing((storefront, resource_type, str(value)), time.monotonic())
+            if missing:
+                self.hits += 1
+            return missing
+
+    def split(self, storefront, resource_type, values):
+        """
+        Separate known-missing values from the rest
+
+        :param storefront: Apple Music storefront
+        :param resource_type: Resource type, or a filter scope such as "songs:isrc"
+        :param values: Resource IDs or filter values
+
+        :return: Tuple of the values still worth requesting and the known-missing values, in input order
+        """
+        keep, missing = [], []
+        with self._lock:
+            now = time.monotonic()
+            for value in values:
+                if self._is_missing((storefront, resource_type, str(value)), now):
+                    missing.append(value)
+                else:
+                    keep.append(value)
+            self.hits += len(missing)
+        return keep, missing
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
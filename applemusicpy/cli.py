@@ -0,0 +1,235 @@
+"""
+Command line tool for bulk lookups, e.g.
+
+    applemusicpy songs --input song_ids.txt --storefront us --storefront gb --output songs.ndjson.gz
+    cat isrcs.txt | applemusicpy isrc --rate-limit 20 --cache-dir ~/.cache/applemusicpy > songs.ndjson
+
+Inputs are read one per line. Every input produces one NDJSON line with its storefront, the input and either
+the result (null for IDs that are not in the catalog) or the error. Credentials are read from --secret-key-file,
+--key-id and --team-id, or the APPLE_MUSIC_SECRET_KEY_FILE, APPLE_MUSIC_KEY_ID and APPLE_MUSIC_TEAM_ID
+environment variables.
+"""
+import argparse
+from collections import deque
+from contextlib import redirect_stdout
+from itertools import islice
+import os
+import sys
+import threading
+import time
+
+from .planner import DEFAULT_MAX_IDS, MAX_IDS
+
+# Command -> (client method, resource type) for the ID lookups
+LOOKUPS = {
+    'songs': ('songs', 'songs'),
+    'albums': ('albums', 'albums'),
+    'artists': ('artists', 'artists'),
+    'music-videos': ('music_videos', 'music-videos'),
+    'playlists': ('playlists', 'playlists'),
+    'stations': ('stations', 'stations'),
+}
+MAX_ISRCS = 25  # filter[isrc] values the API accepts per request
+
+
+class Stats:
+    """
+    Thread-safe counters of a bulk run
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.inputs = 0
+        self.requests = 0
+        self.found = 0
+        self.missing = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, count in counts.items():
+                setattr(self, name, getattr(self, name) + count)
+
+    def line(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return '{} inputs in {:.1f}s ({:.1f}/s), {} requests, {} found, {} missing, {} errors'.format(
+            self.inputs, elapsed, self.inputs / elapsed, self.requests, self.found, self.missing, self.errors)
+
+
+def _read_inputs(stream):
+    for line in stream:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def _batches(items, size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _lookup(am, method, resource_type):
+    call = getattr(am, method)
+
+    def run(storefront, batch):
+        response = call(batch, storefront=storefront)
+        found = {resource['id']: resource for resource in response.get('data', [])
+                 if resource.get('type') == resource_type}
+        return [found.get(resource_id) for resource_id in batch]
+    return run
+
+
+def _isrc_lookup(am):
+    def run(storefront, batch):
+        songs = {}
+        for song in am.songs_by_isrc(batch, storefront=storefront).get('data', []):
+            songs.setdefault(song.get('attributes', {}).get('isrc', '').upper(), []).append(song)
+        return [songs.get(isrc.upper()) or None for isrc in batch]
+    return run
+
+
+def _search(am, types, limit):
+    def run(storefront, batch):
+        results = []
+        for term in batch:
+            response = am.search(term, storefront=storefront, types=types, limit=limit)
+            results.append(response.get('results') or None)
+        return results
+    return run
+
+
+def _progress(stats, stop, stream):
+    while not stop.wait(1):
+        stream.write('\r' + stats.line())
+        stream.flush()
+    stream.write('\r')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='applemusicpy', description='Bulk Apple Music catalog lookups')
+    parser.add_argument('command', choices=sorted(LOOKUPS) + ['isrc', 'search'],
+                        help='Resource type to look up by ID, isrc to look up songs by ISRC, or search')
+    parser.add_argument('-i', '--input', default='-', help='File with one input per line, - for stdin (default)')
+    parser.add_argument('-o', '--output', default='-',
+                        help='NDJSON output file, - for stdout (default). A .gz suffix compresses it')
+    parser.add_argument('-s', '--storefront', action='append', dest='storefronts',
+                        help='Storefront to look up in, may be repeated (default us)')
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help='Requests in flight (default 8)')
+    parser.add_argument('-r', '--rate-limit', type=float, help='Maximum requests per second')
+    parser.add_argument('--cache-dir', help='Directory to cache responses in between runs')
+    parser.add_argument('--cache-ttl', type=float, default=86400, help='Seconds cached responses stay fresh')
+    parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for a response (default 30)')
+    parser.add_argument('--max-retries', type=int, default=10, help='Attempts per request (default 10)')
+    parser.add_argument('--types', help='Comma separated resource types for search (e.g. songs,albums)')
+    parser.add_argument('--limit', type=int, help='Results per type for search')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Do not show live progress')
+    parser.add_argument('--secret-key-file', default=os.environ.get('APPLE_MUSIC_SECRET_KEY_FILE'))
+    parser.add_argument('--key-id', default=os.environ.get('APPLE_MUSIC_KEY_ID'))
+    parser.add_argument('--team-id', default=os.environ.get('APPLE_MUSIC_TEAM_ID'))
+    return parser
+
+
+def build_client(args):
+    from .cache import FileCache
+    from .client import AppleMusic
+
+    with open(args.secret_key_file) as f:
+        secret_key = f.read()
+    return AppleMusic(secret_key=secret_key, key_id=args.key_id, team_id=args.team_id,
+                      max_retries=args.max_retries, requests_timeout=args.timeout, max_workers=args.concurrency,
+                      rate_limit=args.rate_limit,
+                      cache=FileCache(args.cache_dir, ttl=args.cache_ttl) if args.cache_dir else None)
+
+
+def run(am, args, inputs, sink, stats):
+    """
+    Look up all inputs and write a line per input to sink, in input order. At most twice the concurrency
+    of batches are queued at a time, so inputs are read as fast as results are written.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if args.command == 'isrc':
+        lookup, batch_size = _isrc_lookup(am), MAX_ISRCS
+    elif args.command == 'search':
+        types = args.types.split(',') if args.types else None
+        lookup, batch_size = _search(am, types, args.limit), 1
+    else:
+        method, resource_type = LOOKUPS[args.command]
+        lookup, batch_size = _lookup(am, method, resource_type), MAX_IDS.get(resource_type, DEFAULT_MAX_IDS)
+    storefronts = args.storefronts or ['us']
+
+    def work(storefront, batch):
+        try:
+            results = lookup(storefront, batch)
+        except Exception as e:
+            stats.add(inputs=len(batch), requests=len(batch) if args.command == 'search' else 1, errors=len(batch))
+            error = '{}: {}'.format(type(e).__name__, e)
+            return [{'storefront': storefront, 'input': item, 'error': error} for item in batch]
+        found = sum(1 for result in results if result is not None)
+        stats.add(inputs=len(batch), requests=len(batch) if args.command == 'search' else 1, found=found,
+                  missing=len(batch) - found)
+        return [{'storefront': storefront, 'input': item, 'result': result} for item, result in zip(batch, results)]
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for batch in _batches(inputs, batch_size):
+            for storefront in storefronts:
+                pending.append(pool.submit(work, storefront, batch))
+            while len(pending) >= 2 * args.concurrency:
+                sink.write_all(pending.popleft().result())
+        while pending:
+            sink.write_all(pending.popleft().result())
+
+
+def main(argv=None, am=None):
+    """
+    Entry point of the applemusicpy command
+
+    :param argv: Command line arguments, defaults to sys.argv
+    :param am: AppleMusic client to use instead of one built from the credential arguments
+
+    :return: Exit status, 0 if every input was looked up, 1 if any failed
+    """
+    from .export import NDJSONSink
+
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    if am is None:
+        if not (args.secret_key_file and args.key_id and args.team_id):
+            parser.error('--secret-key-file, --key-id and --team-id (or their environment variables) are required')
+        am = build_client(args)
+
+    out = sys.stdout  # the client prints retry messages, which go to stderr instead of the results
+    stream = sys.stdin if args.input == '-' else open(args.input, encoding='utf-8')
+    if args.output == '-':
+        sink = NDJSONSink(out, flush_every=1)
+    else:
+        sink = NDJSONSink(args.output, compress='gzip' if args.output.endswith('.gz') else None)
+    stats = Stats()
+    stop = threading.Event()
+    progress = None
+    if not args.quiet and sys.stderr.isatty():
+        progress = threading.Thread(target=_progress, args=(stats, stop, sys.stderr), daemon=True)
+        progress.start()
+    interrupted = False
+    try:
+        with redirect_stdout(sys.stderr):
+            run(am, args, _read_inputs(stream), sink, stats)
+    except KeyboardInterrupt:
+        interrupted = True
+    finally:
+        stop.set()
+        if progress is not None:
+            progress.join()
+        sink.close()
+        if stream is not sys.stdin:
+            stream.close()
+    sys.stderr.write(('Interrupted after ' if interrupted else 'Done: ') + stats.line() + '\n')
+    return 1 if stats.errors or interrupted else 0
@@ -1,9 +1,86 @@
-from datetime import datetime, timedelta
-import jwt
-import requests
-from requests.exceptions import HTTPError
+from contextlib import contextmanager
+import contextvars
+import os
 import time
 import re
+from urllib.parse import parse_qs, urlsplit
+import weakref
+
+from .auth import ALGORITHM, sign_token
+from .breaker import CircuitBreakers
+from .cache import NegativeCache, ResponseCache, Revalidation, cache_key, response_validators
+from .concurrency import AdaptiveLimiter, concurrent_call
+from .deadlines import check as check_deadline, current_deadline, remaining as deadline_remaining
+from .exceptions import AppleMusicError, CircuitOpenError, DeadlineExceeded
+from .hedging import AttemptPool, HedgePolicy
+from .keypool import KeyPool
+from .planner import DEFAULT_MAX_IDS, MAX_IDS, QueryPlanner
+from .scheduling import PriorityScheduler, current_priority
+from .transport import RawResponse, raw_mode, read_raw
+
+
+# Catalog resource types that accept sparse fieldsets (fields[type]=)
+RESOURCE_TYPES = ('activities', 'albums', 'apple-curators', 'artists', 'curators', 'genres', 'music-videos',
+                  'playlists', 'record-labels', 'songs', 'stations', 'storefronts')
+
+_ATTRIBUTE_NAME = re.compile(r'^[A-Za-z][A-Za-z0-9_-]*$')
+
+WRITE_CHUNK_SIZE = 100  # items sent per library write request
+
+_clients = weakref.WeakSet()  # live clients, reset in the child process after a fork
+
+
+def _after_fork():
+    for client in list(_clients):
+        client._reset_after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _page(data, limit, offset):
+    """
+    Page of a locally held list, shaped like the API's paginated responses
+    """
+    start = int(offset or 0)
+    end = start + int(limit) if limit is not None else len(data)
+    page = {'data': data[start:end]}
+    if end < len(data):
+        page['next'] = '?offset={}'.format(end)
+    return page
+
+
+def _chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def _track_data(tracks):
+    """
+    Resource identifiers for tracks given as IDs, library IDs (i.xxx) or dictionaries with id and type
+    """
+    data = []
+    for track in tracks:
+        if isinstance(track, dict):
+            data.append({'id': str(track['id']), 'type': track['type']})
+        else:
+            track = str(track)
+            data.append({'id': track, 'type': 'library-songs' if track.startswith('i.') else 'songs'})
+    return data
+
+
+def _not_found(url):
+    """
+    404 error for a lookup the negative cache knows is missing, shaped like the one requests raises
+    """
+    from requests.exceptions import HTTPError
+    from requests.models import Response
+
+    response = Response()
+    response.status_code = 404
+    response.reason = 'Not Found'
+    response.url = url
+    return HTTPError('404 Client Error: Not Found (negative cache) for url: {}'.format(url), response=response)
 
 
 class AppleMusic:
@@ -11,8 +88,12 @@ class AppleMusic:
     This class is used to connect to the Apple Music API and make requests for catalog resources
     """
 
-    def __init__(self, secret_key, key_id, team_id, proxies=None,
-                 requests_session=True, max_retries=10, requests_timeout=None, session_length=12):
+    def __init__(self, secret_key=None, key_id=None, team_id=None, proxies=None,
+                 requests_session=True, max_retries=10, requests_timeout=None, session_length=12,
+                 default_fields=None, default_extend=None, http2=False, http2_max_connections=4,
+                 circuit_breaker=None, cache=None, rate_limit=None, priority_weights=None, key_pool=None,
+                 max_workers=8, hedging=None, adaptive_concurrency=None, negative_cache=None,
+                 reference_data=None, user_token=None):
         """
         :param proxies: A dictionary of proxies, if needed
         :param secret_key: Secret Key provided by Apple
@@ -22,27 +103,271 @@ class AppleMusic:
         :param max_retries: Maximum amount of times to retry an API call before stopping
         :param requests_timeout: Number of seconds requests should wait before timing out
         :param session_length: Length Apple Music token is valid, in hours
-        """
+        :param default_fields: Sparse fieldsets applied to every resource request unless overridden,
+            a dictionary mapping resource types to the attributes to return (e.g. {'songs': ['name', 'isrc']})
+        :param default_extend: Additional attributes to request on every resource request unless overridden
+        :param http2: Send requests over HTTP/2 with httpx, multiplexing concurrent calls over a few connections.
+            Requires the http2 extra (pip install apple-music-python[http2]). Takes precedence over requests_session
+        :param http2_max_connections: Maximum number of HTTP/2 connections to keep open
+        :param circuit_breaker: Fail fast while an endpoint family (search, charts, resources, relationships)
+            keeps failing. True for default thresholds, or a CircuitBreakers instance
+        :param cache: Cache GET responses. True for a default in-memory ResponseCache, or a cache instance.
+            While a circuit is open, stale cached responses are served instead of failing. Expired responses are
+            revalidated with their ETag/Last-Modified, and kept without re-downloading them on a 304
+        :param rate_limit: Maximum requests per second, shared between priority classes by weighted fair queuing.
+            A number, or a PriorityScheduler (or SharedRateLimiter) instance to share one budget between clients
+        :param priority_weights: Dictionary of priority class to weight, defaults to {'interactive': 10, 'bulk': 1}
+        :param key_pool: Spread requests across several developer keys instead of secret_key/key_id/team_id.
+            A list of dictionaries with secret_key, key_id and team_id, a KeyPool instance, or a dictionary of
+            KeyPool arguments such as the one KeyPool.config returns
+        :param max_workers: Maximum number of requests sent concurrently by methods that fetch many pages
+        :param hedging: Send a duplicate of a slow GET request and use whichever answers first.
+            True for the default HedgePolicy, or a HedgePolicy instance
+        :param adaptive_concurrency: Adjust how many requests the concurrent methods (fetch_all, fetch_graph, ...)
+            keep in flight, raising the limit while responses are fast and backing off on 429s, 5xx responses
+            or rising latency. True for the default AdaptiveLimiter, or an AdaptiveLimiter instance
+        :param negative_cache: Remember resource IDs that returned 404 or were missing from a multiple resource
+            response, and ISRCs that matched nothing, so they are not requested again. True for a default
+            NegativeCache, or a NegativeCache instance
+        :param reference_data: Answer genre and storefront lookups from an in-memory copy that is refreshed in
+            the background. The path of a snapshot file to load it from and save it to, True to keep it in memory
+            only, or a ReferenceData instance
+        :param user_token: Music User Token of the user whose library the library methods act on
+        """
+        if key_pool is None and not (secret_key and key_id and team_id):
+            raise ValueError('secret_key, key_id and team_id are required unless a key_pool is given')
 
         self.proxies = proxies
         self._secret_key = secret_key
         self._key_id = key_id
         self._team_id = team_id
-        self._alg = 'ES256'  # encryption algo that Apple requires
+        self._alg = ALGORITHM
         self.token_str = ""  # encrypted api token
         self.session_length = session_length
-        self.token_valid_until = None
-        self.generate_token(session_length)
+        self.token_valid_until = None  # the token is signed on the first request
         self.root = 'https://api.music.apple.com/v1/'
         self.max_retries = max_retries
+        self.user_token = user_token
         self.requests_timeout = requests_timeout
-        if requests_session:
-            self._session = requests.Session()
+        self.max_workers = max_workers
+        self.hedging = HedgePolicy() if hedging is True else hedging
+        self._attempt_pool = AttemptPool() if self.hedging is not None else None  # threads start on first use
+        self.concurrency = AdaptiveLimiter() if adaptive_concurrency is True else adaptive_concurrency
+        self.default_fields = self._validate_fields(default_fields)
+        self.default_extend = self._validate_extend(default_extend)
+        self._http2 = http2
+        self._http2_max_connections = http2_max_connections
+        self._requests_session = requests_session
+        self._http_session = None  # created on first use, so importing requests is deferred
+        self._pid = os.getpid()
+        self.circuit_breakers = CircuitBreakers() if circuit_breaker is True else circuit_breaker
+        self.cache = ResponseCache() if cache is True else cache
+        self.negative_cache = NegativeCache() if negative_cache is True else negative_cache
+        if reference_data is None or hasattr(reference_data, 'genre'):
+            self.reference_data = reference_data
         else:
-            self._session = requests.api  # individual calls, slower
+            from .reference import ReferenceData
+            self.reference_data = ReferenceData(self, path=None if reference_data is True else reference_data)
+            self.reference_data.start()
+        if rate_limit is None or hasattr(rate_limit, 'acquire'):
+            self.scheduler = rate_limit
+        else:
+            self.scheduler = PriorityScheduler(rate_limit, weights=priority_weights)
+        if key_pool is None or isinstance(key_pool, KeyPool):
+            self.key_pool = key_pool
+        elif isinstance(key_pool, dict):
+            self.key_pool = KeyPool(**dict({'session_length': session_length}, **key_pool))
+        else:
+            self.key_pool = KeyPool(key_pool, session_length=session_length)
+        _clients.add(self)
+
+    def _reset_after_fork(self):
+        """
+        Drop the state a forked child must not share with its parent: the HTTP session, whose connections
+        the parent keeps using, and the hedging attempt pool, whose threads did not survive the fork.
+        Signed tokens are kept, so the child does not sign its own.
+        """
+        self._pid = os.getpid()
+        self._http_session = None
+        self._attempt_pool = AttemptPool() if self.hedging is not None else None
+        if self.reference_data is not None and self.reference_data._thread is not None:
+            self.reference_data._thread = None
+            self.reference_data.start()
+
+    @property
+    def _session(self):
+        """
+        HTTP session used for API calls, created on first use and again in a forked child process
+        """
+        if self._pid != os.getpid():
+            self._reset_after_fork()  # forked without os.fork, so the fork hook did not run
+        if self._http_session is None:
+            if self._http2:
+                from .transport import HTTP2Session
+                self._http_session = HTTP2Session(proxies=self.proxies, max_connections=self._http2_max_connections)
+            elif self._requests_session:
+                import requests
+                self._http_session = requests.Session()
+            else:
+                import requests
+                self._http_session = requests.api  # individual calls, slower
+        return self._http_session
+
+    def config(self):
+        """
+        Picklable configuration of this client, used to rebuild it in another process with from_config.
+        Tokens are signed first if needed, so clients rebuilt from the config reuse them instead of re-signing.
+        In-memory state such as cached responses, circuit states and latency history is not carried over:
+        the rebuilt client gets default instances of the circuit breaker, in-memory caches, hedging and adaptive
+        concurrency features this client uses. A FileCache is shared.
+
+        :return: Dictionary of constructor arguments and the current tokens
+        """
+        key_pool = key_tokens = None
+        if self.key_pool is not None:
+            key_pool = self.key_pool.config()
+            for k in self.key_pool.keys:
+                k.auth_headers()
+            key_tokens = [(k.token_str, k.token_valid_until) for k in self.key_pool.keys]
+        elif not self.token_is_valid():
+            self.generate_token(self.session_length)
+        if isinstance(self.scheduler, PriorityScheduler):
+            rate_limit, priority_weights = self.scheduler.rate, self.scheduler.weights
+        else:
+            rate_limit, priority_weights = self.scheduler, None  # e.g. a SharedRateLimiter the processes share
+        reference_data = None
+        if self.reference_data is not None and self.reference_data.path is not None:
+            reference_data = self.reference_data.path
+        return {
+            'secret_key': self._secret_key,
+            'key_id': self._key_id,
+            'team_id': self._team_id,
+            'proxies': self.proxies,
+            'requests_session': self._requests_session,
+            'max_retries': self.max_retries,
+            'requests_timeout': self.requests_timeout,
+            'session_length': self.session_length,
+            'default_fields': self.default_fields,
+            'default_extend': self.default_extend,
+            'http2': self._http2,
+            'http2_max_connections': self._http2_max_connections,
+            'circuit_breaker': self.circuit_breakers is not None or None,
+            'cache': True if isinstance(self.cache, ResponseCache) else self.cache,
+            'negative_cache': self.negative_cache is not None or None,
+            'rate_limit': rate_limit,
+            'priority_weights': priority_weights,
+            'max_workers': self.max_workers,
+            'key_pool': key_pool,
+            'hedging': self.hedging is not None or None,
+            'adaptive_concurrency': self.concurrency is not None or None,
+            'reference_data': reference_data,
+            'user_token': self.user_token,
+            'token': (self.token_str, self.token_valid_until),
+            'key_tokens': key_tokens,
+        }
+
+    @classmethod
+    def from_config(cls, config, **kwargs):
+        """
+        Build a client from a configuration returned by config()
+
+        :param config: Configuration dictionary
+        :param kwargs: Constructor arguments that override or extend the configuration
+
+        :return: AppleMusic client
+        """
+        config = dict(config)
+        config.update(kwargs)
+        am = cls.__new__(cls)
+        am.__setstate__(config)
+        return am
+
+    def __getstate__(self):
+        # Pickle the configuration, not sessions, locks or threads
+        return self.config()
+
+    def __setstate__(self, state):
+        state = dict(state)
+        token_str, token_valid_until = state.pop('token', ('', None))
+        key_tokens = state.pop('key_tokens', None)
+        self.__init__(**state)
+        if token_str:
+            self.token_str, self.token_valid_until = token_str, token_valid_until
+        if key_tokens and self.key_pool is not None:
+            for key, (key_token, key_valid_until) in zip(self.key_pool.keys, key_tokens):
+                key.token_str, key.token_valid_until = key_token, key_valid_until
+
+    @contextmanager
+    def priority(self, priority):
+        """
+        Send the API calls made inside the block with the given priority class, e.g.
+
+            with am.priority('bulk'):
+                am.songs(song_ids)
+
+        :param priority: Priority class (by default 'interactive' or 'bulk')
+        """
+        if self.scheduler is not None:
+            self.scheduler.validate(priority)
+        token = current_priority.set(priority)
+        try:
+            yield self
+        finally:
+            current_priority.reset(token)
+
+    @contextmanager
+    def deadline(self, seconds):
+        """
+        Give the API calls made inside the block an end-to-end deadline, covering retries, backoff sleeps,
+        rate limit waits and pagination. Calls that cannot finish in time raise DeadlineExceeded, e.g.
+
+            with am.deadline(2):
+                am.song(song_id)
+
+        Nested deadlines never extend an outer one.
+
+        :param seconds: Seconds from now the calls must finish in
+        """
+        deadline = time.monotonic() + seconds
+        outer = current_deadline.get()
+        if outer is not None:
+            deadline = min(deadline, outer)
+        token = current_deadline.set(deadline)
+        try:
+            yield self
+        finally:
+            current_deadline.reset(token)
+
+    @contextmanager
+    def raw(self, stream_to=None, chunk_size=65536):
+        """
+        Return the responses of the GET calls made inside the block undecoded, as RawResponse objects with the
+        status, headers and body bytes, e.g. to forward them without a decode and re-encode:
+
+            with am.raw():
+                response = am.album(album_id)
+            forward(response.content, response.headers)
+
+        With stream_to the body is written to it in chunks as it arrives instead of being kept in memory.
+        Streamed calls are not hedged, and a call that fails part way through raises StreamInterrupted
+        instead of being retried. Raw responses are not cached. Methods that combine several responses
+        (fetch_all, fetch_graph, iter_resources, iter_relationship, their streams and artist_discography)
+        raise ValueError in raw mode.
+
+        :param stream_to: Writable (e.g. a file or socket wrapper) to stream the bodies to, or None
+        :param chunk_size: Bytes per chunk written to stream_to
+        """
+        token = raw_mode.set((stream_to, chunk_size))
+        try:
+            yield self
+        finally:
+            raw_mode.reset(token)
 
     def token_is_valid(self):
-        return datetime.now() <= self.token_valid_until if self.token_valid_until is not None else False
+        if self.token_valid_until is None:
+            return False
+        from datetime import datetime
+        return datetime.now() <= self.token_valid_until
 
     def generate_token(self, session_length):
         """
@@ -51,20 +376,8 @@ class AppleMusic:
 
         :param session_length: Length Apple Music token is valid, in hours
         """
-        token_exp_time = datetime.now() + timedelta(hours=session_length)
-        headers = {
-            'alg': self._alg,
-            'kid': self._key_id
-        }
-        payload = {
-            'iss': self._team_id,  # issuer
-            'iat': int(datetime.now().timestamp()),  # issued at
-            'exp': int(token_exp_time.timestamp())  # expiration time
-        }
-        self.token_valid_until = token_exp_time
-        token = jwt.encode(payload, self._secret_key, algorithm=self._alg, headers=headers)
-        self.token_str = token if type(token) is not bytes else token.decode()
-
+        self.token_str, self.token_valid_until = sign_token(self._secret_key, self._key_id, self._team_id,
+                                                            session_length, alg=self._alg)
 
     def _auth_headers(self):
         """
@@ -77,31 +390,88 @@ class AppleMusic:
         else:
             return {}
 
-    def _call(self, method, url, params):
+    def _call(self, method, url, params, body=None, user_token=False, revalidation=None):
         """
         Make a call to the API
 
         :param method: 'GET', 'POST', 'DELETE', or 'PUT'
         :param url: URL of API endpoint
         :param params: API paramaters
+        :param body: JSON request body
+        :param user_token: Send the Music-User-Token header, for requests on a user's library
+        :param revalidation: Revalidation of a cached response, whose validators are sent as conditional
+            headers and which records whether the API answered 304 Not Modified
 
-        :return: JSON data from the API
+        :return: JSON data from the API, None if the response has no body or is a 304
         """
         if not url.startswith('http'):
             url = self.root + url
 
-        if not self.token_is_valid():
-            self.generate_token(self.session_length)
-
-        headers = self._auth_headers()
-        headers['Content-Type'] = 'application/json'
-
-        r = self._session.request(method, url,
-                                  headers=headers,
-                                  proxies=self.proxies,
-                                  params=params,
-                                  timeout=self.requests_timeout)
+        if user_token:
+            self._require_user_token()
+        if body is not None:
+            kwargs = {'json': body}
+        else:
+            kwargs = {}
+        raw = raw_mode.get() if method == 'GET' else None
+        if raw is not None and raw[0] is not None:
+            kwargs['stream'] = True
+
+        retry_on_other_key = self.key_pool is not None
+        while True:
+            check_deadline()
+            if self.scheduler is not None:
+                self.scheduler.acquire(current_priority.get())
+
+            key = None
+            if self.key_pool is not None:
+                key = self.key_pool.acquire()
+                headers = key.auth_headers()
+            else:
+                if not self.token_is_valid():
+                    self.generate_token(self.session_length)
+                headers = self._auth_headers()
+            headers['Content-Type'] = 'application/json'
+            if user_token:
+                headers['Music-User-Token'] = self.user_token
+            if revalidation is not None:
+                headers.update(revalidation.headers())
+
+            timeout = self.requests_timeout
+            left = deadline_remaining()
+            if left is not None:
+                timeout = left if timeout is None else min(timeout, left)
+
+            status = None
+            try:
+                r = self._session.request(method, url,
+                                          headers=headers,
+                                          proxies=self.proxies,
+                                          params=params,
+                                          timeout=timeout,
+                                          **kwargs)
+                status = r.status_code
+            finally:
+                if key is not None:
+                    self.key_pool.release(key, status)
+            # A rejected key has just left rotation; send the request once more on another key
+            if retry_on_other_key and status in (401, 403) and self.key_pool.available():
+                retry_on_other_key = False
+                r.close()
+                continue
+            break
+        if kwargs.get('stream') and r.status_code >= 400:
+            r.close()  # release the connection before raising, the error body is not read
         r.raise_for_status()  # Check for error
+        if revalidation is not None:
+            revalidation.response_validators = response_validators(r.headers)
+            if r.status_code == 304:
+                revalidation.not_modified = True
+                return None
+        if raw is not None:
+            return read_raw(r, *raw)
+        if not r.content:  # 201, 202 and 204 responses to library writes may have no body
+            return None
         return r.json()
 
     def _get(self, url, **kwargs):
@@ -112,56 +482,433 @@ class AppleMusic:
 
         :return: JSON data from the API
         """
+        from requests.exceptions import HTTPError
+
+        key = cache_key(url, kwargs) if self.cache is not None and raw_mode.get() is None else None
+        revalidation = None
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            revalidation = Revalidation(self.cache.validators(key))
+
         retries = self.max_retries
         delay = 1
         while retries > 0:
+            breaker = None
+            if self.circuit_breakers is not None:
+                try:
+                    breaker = self.circuit_breakers.check(url)
+                except CircuitOpenError:
+                    stale = self.cache.get(key, allow_stale=True) if key is not None else None
+                    if stale is not None:
+                        return stale
+                    raise
             try:
-                return self._call('GET', url, kwargs)
+                check_deadline()
+                result = self._send_get(url, kwargs, revalidation)
+            except AppleMusicError:  # deadline or rate limit wait, not a failure of the endpoint
+                if breaker is not None:
+                    breaker.cancel()
+                raise
             except HTTPError as e:  # Retry for some known issues
                 retries -= 1
                 status = e.response.status_code
                 if status == 429 or (500 <= status < 600):
-                    if retries < 0:
+                    if breaker is not None:
+                        breaker.record_failure()
+                    if self.concurrency is not None:
+                        self.concurrency.on_throttle()
+                    if retries <= 0:
                         raise
                     else:
+                        check_deadline(delay + 1)
                         print('retrying ...' + str(delay) + ' secs')
                         time.sleep(delay + 1)
                         delay += 1
                 else:
+                    if breaker is not None:
+                        breaker.record_success()  # the endpoint answered, the request itself was bad
                     raise
             except Exception as e:
+                if breaker is not None:
+                    breaker.record_failure()
+                if self.concurrency is not None:
+                    self.concurrency.on_throttle()  # timeouts and dropped connections are overload signals too
                 print('exception', str(e))
                 retries -= 1
-                if retries >= 0:
+                if retries > 0:
+                    check_deadline(delay + 1)
                     print('retrying ...' + str(delay) + 'secs')
                     time.sleep(delay + 1)
                     delay += 1
                 else:
                     raise
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                if key is not None:
+                    if revalidation.validators:
+                        self.cache.record_revalidation(revalidation.not_modified)
+                    if revalidation.not_modified:
+                        result = self.cache.refresh(key, revalidation.response_validators)
+                        if result is None:  # evicted while revalidating, fetch it again unconditionally
+                            revalidation = Revalidation()
+                            continue
+                        return result
+                    self.cache.set(key, result, revalidation.response_validators)
+                return result
+
+    def _send_get(self, url, params, revalidation=None):
+        """
+        Send one GET attempt, hedged if hedging is enabled. Inside the client's concurrent paths the attempt
+        waits for a slot from the adaptive concurrency limiter, and its latency is fed back to it.
+
+        :param url: URL of API endpoint
+        :param params: API paramaters
+        :param revalidation: Revalidation of a cached response, see _call
+
+        :return: JSON data from the API
+        """
+        limiter = self.concurrency
+        gated = limiter is not None and concurrent_call.get()
+        if gated:
+            limiter.acquire()
+        try:
+            start = time.monotonic()
+            raw = raw_mode.get()
+            if self.hedging is not None and (raw is None or raw[0] is None):  # never two writers on one stream
+                result = self._hedged_call(url, params, revalidation)
+            else:
+                result = self._call('GET', url, params, revalidation=revalidation)
+            if limiter is not None:
+                limiter.on_success(time.monotonic() - start)
+            return result
+        finally:
+            if gated:
+                limiter.release()
+
+    def _hedged_call(self, url, params, revalidation=None):
+        """
+        GET request that sends a duplicate when the first attempt is slower than the hedging policy's delay.
+        The first successful answer wins. The other attempt is cancelled if it has not started yet,
+        otherwise its answer is discarded.
+
+        Both attempts run on the client's AttemptPool, which reuses idle threads and never caps how many
+        requests the client has in flight. Every successful attempt's latency is recorded, the first
+        attempt's too when the hedge wins, so the hedge delay follows the latency of single requests. Each
+        attempt revalidates with its own Revalidation, and the winner's outcome is copied to the one given.
+
+        :param url: URL of API endpoint
+        :param params: API paramaters
+        :param revalidation: Revalidation of a cached response, see _call
+
+        :return: JSON data from the API
+        """
+        from concurrent.futures import FIRST_COMPLETED, Future, wait
+
+        def attempt(future, attempt_revalidation):
+            if not future.set_running_or_notify_cancel():
+                return
+            start = time.monotonic()
+            try:
+                result = self._call('GET', url, params, revalidation=attempt_revalidation)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                policy.record_latency(time.monotonic() - start)
+                future.set_result(result)
+
+        def revalidation_copy():
+            return Revalidation(revalidation.validators) if revalidation is not None else None
+
+        policy = self.hedging
+        policy.record_request()
+        primary = Future()
+        revalidations = {primary: revalidation_copy()}
+        self._attempt_pool.submit(contextvars.copy_context().run, attempt, primary, revalidations[primary])
+        done, _ = wait([primary], timeout=policy.delay())
+        pending = {primary}
+        if not done and policy.try_hedge():
+            hedge = Future()
+            revalidations[hedge] = revalidation_copy()
+            self._attempt_pool.submit(contextvars.copy_context().run, attempt, hedge, revalidations[hedge])
+            pending.add(hedge)
+
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is not primary:
+                        policy.record_hedge_win()
+                    if revalidation is not None:
+                        revalidation.response_validators = revalidations[future].response_validators
+                        revalidation.not_modified = revalidations[future].not_modified
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _post(self, url, body=None, idempotent=False, **kwargs):
+        return self._write('POST', url, kwargs, body, idempotent)
+
+    def _delete(self, url, body=None, idempotent=True, **kwargs):
+        return self._write('DELETE', url, kwargs, body, idempotent)
+
+    def _put(self, url, body=None, idempotent=True, **kwargs):
+        return self._write('PUT', url, kwargs, body, idempotent)
+
+    def _write(self, method, url, params, body, idempotent):
+        """
+        Send a write request on the user's library, retrying only when it is safe to.
+        A 429 response or a connection that could not be opened means the request was not processed, so
+        those are always retried. A 5xx response or a dropped connection may come after the write happened,
+        so those are only retried if repeating the request has the same effect as sending it once.
+
+        :param method: 'POST', 'DELETE', or 'PUT'
+        :param url: URL of API endpoint
+        :param params: API parameters
+        :param body: JSON request body
+        :param idempotent: Repeating the request has the same effect as sending it once
+
+        :return: JSON data from the API, None if the response has no body
+        """
+        from requests.exceptions import ConnectTimeout, HTTPError
+
+        retries = self.max_retries
+        delay = 1
+        while True:
+            try:
+                check_deadline()
+                return self._call(method, url, params, body=body, user_token=True)
+            except HTTPError as e:
+                status = e.response.status_code
+                if not (status == 429 or (idempotent and 500 <= status < 600)):
+                    raise
+                retries -= 1
+                if retries < 0:
+                    raise
+            except ConnectTimeout:
+                retries -= 1
+                if retries < 0:
+                    raise
+            except (AppleMusicError, ValueError):
+                raise
+            except Exception:
+                retries -= 1
+                if not idempotent or retries < 0:
+                    raise
+            check_deadline(delay + 1)
+            print('retrying ...' + str(delay) + ' secs')
+            time.sleep(delay + 1)
+            delay += 1
+
+    def _require_user_token(self):
+        """
+        Raise ValueError if the client has no Music User Token, before any library request is sent
+        """
+        if not self.user_token:
+            raise ValueError('A user_token is required for library requests')
+
+    @staticmethod
+    def _require_decoded(method):
+        """
+        Raise ValueError in raw mode, for methods that decode responses to combine them or follow their pages
+        """
+        if raw_mode.get() is not None:
+            raise ValueError('{} combines decoded responses, raw mode is not supported'.format(method))
+
+    def _write_chunks(self, write, chunks, max_workers=None):
+        """
+        Send independent write requests concurrently and report on each
+
+        :param write: Function sending the write request for one chunk
+        :param chunks: List of chunks
+
+        :return: List of dictionaries, one per chunk in order, with the chunk's items, whether it succeeded,
+            the error if it didn't and the response
+        """
+        def run(chunk):
+            try:
+                return {'items': chunk, 'ok': True, 'error': None, 'response': write(chunk)}
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                return {'items': chunk, 'ok': False, 'error': '{}: {}'.format(type(e).__name__, e), 'response': None}
+
+        results, incomplete = self._map_concurrent(run, chunks, max_workers=max_workers, partial=True)
+        return [result if result is not None else
+                {'items': chunk, 'ok': False, 'error': 'DeadlineExceeded', 'response': None}
+                for chunk, result in zip(chunks, results)]
+
+    def _map_concurrent(self, fn, items, max_workers=None, partial=False):
+        """
+        Call a function for every item using a thread pool. Each call runs in a copy of the caller's context,
+        so settings such as the priority class and deadline carry over to the worker threads.
+
+        :param fn: Function taking one item
+        :param items: List of items
+        :param max_workers: Maximum number of concurrent calls, defaults to the client's max_workers, or the
+            adaptive limiter's max_limit when adaptive concurrency is enabled
+        :param partial: Collect the items whose call ran out of deadline instead of raising DeadlineExceeded
+
+        :return: List of results, in the order of items. With partial, a tuple of that list (holding None for
+            the items that did not complete) and the list of items that did not complete
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def run(item):
+            concurrent_call.set(True)  # runs in a copied context, so this stays local to the call
+            try:
+                return fn(item)
+            except DeadlineExceeded:
+                if not partial:
+                    raise
+                incomplete.append(item)
+                return None
+
+        items = list(items)
+        incomplete = []
+        if max_workers is None:
+            max_workers = self.concurrency.max_limit if self.concurrency is not None else self.max_workers
+        if len(items) <= 1:
+            results = [contextvars.copy_context().run(run, item) for item in items]
+        else:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+                futures = [pool.submit(contextvars.copy_context().run, run, item) for item in items]
+                results = [future.result() for future in futures]
+        if partial:
+            return results, [item for item in items if item in incomplete]
+        return results
 
-    def _post(self, url, **kwargs):
-        return self._call('POST', url, kwargs)
+    @property
+    def concurrency_limit(self):
+        """
+        Current adaptive concurrency limit, or None if adaptive concurrency is disabled
+        """
+        return self.concurrency.limit if self.concurrency is not None else None
 
-    def _delete(self, url, **kwargs):
-        return self._call('DELETE', url, kwargs)
+    def _deadline_scope(self, seconds):
+        """
+        :param seconds: Deadline in seconds, or None
 
-    def _put(self, url, **kwargs):
-        return self._call('PUT', url, kwargs)
+        :return: The deadline context manager, or a no-op one if seconds is None
+        """
+        from contextlib import nullcontext
 
-    def _get_resource(self, resource_id, resource_type, storefront='us', **kwargs):
+        return nullcontext(self) if seconds is None else self.deadline(seconds)
+
+    @staticmethod
+    def _validate_fields(fields):
+        """
+        Validate sparse fieldsets and normalize them to a dictionary of resource type to attribute list
+
+        :param fields: A dictionary mapping resource types to an attribute name or list of attribute names
+
+        :return: Normalized sparse fieldsets
+        """
+        if fields is None:
+            return {}
+        if not isinstance(fields, dict):
+            raise TypeError('fields must be a dictionary mapping resource types to attribute names')
+        normalized = {}
+        for resource_type, attributes in fields.items():
+            if resource_type not in RESOURCE_TYPES:
+                raise ValueError('Unknown resource type for fields: {}'.format(resource_type))
+            if attributes is None:  # explicitly disables a default fieldset
+                normalized[resource_type] = None
+                continue
+            if isinstance(attributes, str):
+                attributes = [attributes]
+            attributes = list(attributes)
+            if not attributes:
+                raise ValueError('fields[{}] must name at least one attribute'.format(resource_type))
+            for attribute in attributes:
+                if not isinstance(attribute, str) or not _ATTRIBUTE_NAME.match(attribute):
+                    raise ValueError('Invalid attribute name for fields[{}]: {!r}'.format(resource_type, attribute))
+            normalized[resource_type] = attributes
+        return normalized
+
+    @staticmethod
+    def _validate_extend(extend):
+        """
+        Validate extend attributes and normalize them to a list
+
+        :param extend: An attribute name or list of attribute names
+
+        :return: Normalized list of extend attributes
+        """
+        if extend is None:
+            return []
+        if isinstance(extend, str):
+            extend = [extend]
+        extend = list(extend)
+        for attribute in extend:
+            if not isinstance(attribute, str) or not _ATTRIBUTE_NAME.match(attribute):
+                raise ValueError('Invalid attribute name for extend: {!r}'.format(attribute))
+        return extend
+
+    def _sparse_params(self, fields=None, extend=None):
+        """
+        Build the fields[type] and extend API parameters, merged over the client defaults
+
+        :param fields: Sparse fieldsets for this request, these override the defaults per resource type
+        :param extend: Extend attributes for this request, these replace the defaults
+
+        :return: Dictionary of API parameters
+        """
+        merged = dict(self.default_fields)
+        merged.update(self._validate_fields(fields))
+        params = {}
+        for resource_type, attributes in merged.items():
+            if attributes:
+                params['fields[{}]'.format(resource_type)] = ','.join(attributes)
+        extend = self._validate_extend(extend) if extend is not None else self.default_extend
+        if extend:
+            params['extend'] = ','.join(extend)
+        return params
+
+    def _local_reference(self, l, fields, extend):
+        """
+        Reference data to answer a genre or storefront lookup from, if it is loaded and the lookup asks for
+        nothing the copy doesn't have (a localization or sparse fields)
+        """
+        if self.reference_data is None or not self.reference_data.loaded or raw_mode.get() is not None:
+            return None
+        if l is not None or self._sparse_params(fields, extend):
+            return None
+        return self.reference_data
+
+    def _get_resource(self, resource_id, resource_type, storefront='us', fields=None, extend=None, **kwargs):
         """
         Get an Apple Music catalog resource (song, artist, album, etc.)
 
         :param resource_id: ID of resource, from API
         :param resource_type: Resource type, (e.g. "songs")
         :param storefront: Apple Music Storefront
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch
 
         :return: JSON data from API
         """
         url = self.root + 'catalog/{0}/{1}/{2}'.format(storefront, resource_type, str(resource_id))
-        return self._get(url, **kwargs)
-
-    def _get_resource_relationship(self, resource_id, resource_type, relationship, storefront='us', **kwargs):
+        kwargs.update(self._sparse_params(fields, extend))
+        if self.negative_cache is None:
+            return self._get(url, **kwargs)
+        if self.negative_cache.contains(storefront, resource_type, resource_id):
+            raise _not_found(url)
+        from requests.exceptions import HTTPError
+        try:
+            return self._get(url, **kwargs)
+        except HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                self.negative_cache.add(storefront, resource_type, resource_id)
+            raise
+
+    def _get_resource_relationship(self, resource_id, resource_type, relationship, storefront='us', fields=None,
+                                   extend=None, **kwargs):
         """
         Get an Apple Music catalog resource relationship (e.g. a song's artist)
 
@@ -169,14 +916,18 @@ class AppleMusic:
         :param resource_type: Resource type (e.g. "songs")
         :param relationship: Relationship type (e.g. "artists")
         :param storefront: Apple Music Storefont
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch
 
         :return: JSON data from API
         """
         url = self.root + 'catalog/{0}/{1}/{2}/{3}'.format(storefront, resource_type, str(resource_id),
                                                            relationship)
+        kwargs.update(self._sparse_params(fields, extend))
         return self._get(url, **kwargs)
 
-    def _get_resource_relationship_view(self, resource_id, resource_type, relationship_view, storefront='us', **kwargs):
+    def _get_resource_relationship_view(self, resource_id, resource_type, relationship_view, storefront='us',
+                                        fields=None, extend=None, **kwargs):
         """
         Get an Apple Music catalog resource relationship view (e.g. a song's artist)
 
@@ -184,29 +935,56 @@ class AppleMusic:
         :param resource_type: Resource type (e.g. "songs")
         :param relationship_view: Relationship view type (e.g. "related-albums")
         :param storefront: Apple Music Storefont
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch
 
         :return: JSON data from API
         """
         url = self.root + 'catalog/{0}/{1}/{2}/view/{3}'.format(storefront, resource_type, str(resource_id),
                                                                 relationship_view)
+        kwargs.update(self._sparse_params(fields, extend))
         return self._get(url, **kwargs)
 
-    def _get_multiple_resources(self, resource_ids, resource_type, storefront='us', **kwargs):
+    def _get_multiple_resources(self, resource_ids, resource_type, storefront='us', fields=None, extend=None,
+                                **kwargs):
         """
         Get multiple Apple Music catalog resources
 
         :param resource_ids: List of resource IDs
         :param resource_type: Resource type
         :param storefront: Apple Music storefront
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch
 
         :return: JSON data from API
         """
         url = self.root + 'catalog/{0}/{1}'.format(storefront, resource_type)
+        if self.negative_cache is not None:
+            resource_ids, _ = self.negative_cache.split(storefront, resource_type, resource_ids)
+            if not resource_ids:
+                return self._local_result({'data': []})
         id_string = ','.join(resource_ids)  # API format is a string with IDs seperated by commas
-        return self._get(url, ids=id_string, **kwargs)
+        kwargs.update(self._sparse_params(fields, extend))
+        if self.negative_cache is None:
+            return self._get(url, ids=id_string, **kwargs)
+        from requests.exceptions import HTTPError
+        try:
+            results = self._get(url, ids=id_string, **kwargs)
+        except HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                for resource_id in resource_ids:
+                    self.negative_cache.add(storefront, resource_type, resource_id)
+            raise
+        if isinstance(results, RawResponse):
+            return results
+        found = {str(resource['id']) for resource in results.get('data', []) if 'id' in resource}
+        for resource_id in resource_ids:
+            if str(resource_id) not in found:
+                self.negative_cache.add(storefront, resource_type, resource_id)
+        return results
 
     def _get_resource_by_filter(self, filter_type, filter_list, resource_type, resource_ids=None,
-                                storefront='us', **kwargs):
+                                storefront='us', fields=None, extend=None, **kwargs):
         """
         Get mutiple catalog resources using filters
 
@@ -215,6 +993,8 @@ class AppleMusic:
         :param resource_type: Resource type
         :param resource_ids: List of resource IDs to use in conjunction for additional filtering
         :param storefront: Apple Music storefront
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch
 
         :return: JSON data from API
         """
@@ -223,15 +1003,69 @@ class AppleMusic:
             id_string = ','.join(resource_ids)
         else:
             id_string = None
+        # Only plain ISRC lookups are negative cached, a miss combined with IDs says nothing about the ISRC
+        negative_scope = None
+        if self.negative_cache is not None and filter_type == 'isrc' and not resource_ids:
+            negative_scope = '{}:isrc'.format(resource_type)
+            filter_list = [isrc.upper() for isrc in filter_list]  # ISRCs are case-insensitive, cache one form
+            filter_list, _ = self.negative_cache.split(storefront, negative_scope, filter_list)
+            if not filter_list:
+                return self._local_result({'data': []})
         filter_string = ','.join(filter_list)
         filter_param = 'filter[{}]'.format(filter_type)
         filter_arg = {filter_param: filter_string}
         kwargs.update(filter_arg)
+        kwargs.update(self._sparse_params(fields, extend))
         results = self._get(url, ids=id_string, **kwargs)
+        if negative_scope is not None and not isinstance(results, RawResponse):
+            self._record_missing_isrcs(storefront, negative_scope, filter_list, results)
         return results
 
+    @staticmethod
+    def _local_result(result):
+        """
+        Result answered without calling the API, encoded like a response in raw mode
+        """
+        raw = raw_mode.get()
+        if raw is None:
+            return result
+        import json
+
+        content = json.dumps(result).encode('utf-8')
+        headers = {'Content-Type': 'application/json'}
+        stream_to, _ = raw
+        if stream_to is None:
+            return RawResponse(200, headers, content)
+        stream_to.write(content)
+        return RawResponse(200, headers, None, len(content))
+
+    def _record_missing_isrcs(self, storefront, scope, isrcs, results):
+        """
+        Negative cache the ISRCs an ISRC filter response did not match. Matches are read from meta.filters,
+        or else from the isrc attribute of the returned resources. Nothing is recorded if a resource lacks
+        the attribute (e.g. a sparse fieldset left it out), since matches can't be told apart then.
+
+        :param storefront: Apple Music storefront
+        :param scope: Negative cache scope, e.g. "songs:isrc"
+        :param isrcs: Upper-cased ISRCs that were requested
+        :param results: JSON data of the ISRC filter response
+        """
+        by_isrc = results.get('meta', {}).get('filters', {}).get('isrc')
+        if isinstance(by_isrc, dict):
+            matched = {isrc.upper() for isrc, resources in by_isrc.items() if resources}
+        else:
+            matched = set()
+            for resource in results.get('data', []):
+                isrc = resource.get('attributes', {}).get('isrc')
+                if isrc is None:
+                    return
+                matched.add(isrc.upper())
+        for isrc in isrcs:
+            if isrc not in matched:
+                self.negative_cache.add(storefront, scope, isrc)
+
     # Resources
-    def album(self, album_id, storefront='us', l=None, include=None):
+    def album(self, album_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Album by ID
 
@@ -239,12 +1073,16 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Album data in JSON format
         """
-        return self._get_resource(album_id, 'albums', storefront=storefront, l=l, include=include)
+        return self._get_resource(album_id, 'albums', storefront=storefront, l=l, include=include,
+                                  fields=fields, extend=extend)
 
-    def album_relationship(self, album_id, relationship, storefront='us', l=None, limit=None, offset=None):
+    def album_relationship(self, album_id, relationship, storefront='us', l=None, limit=None, offset=None,
+                           fields=None, extend=None):
         """
         Get an Album's relationship (e.g. list of tracks, or list of artists)
 
@@ -254,13 +1092,16 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship(album_id, 'albums', relationship, storefront=storefront, l=l,
-                                               limit=limit, offset=offset)
+                                               limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def album_relationship_view(self, album_id, relationship_view, storefront='us', l=None, limit=None, offset=None):
+    def album_relationship_view(self, album_id, relationship_view, storefront='us', l=None, limit=None, offset=None,
+                                fields=None, extend=None):
         """
         Get an Album's relationship (e.g. list of tracks, or list of artists)
 
@@ -270,13 +1111,15 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship view data in JSON format
         """
         return self._get_resource_relationship_view(album_id, 'albums', relationship_view, storefront=storefront, l=l,
-                                                    limit=limit, offset=offset)
+                                                    limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def albums(self, album_ids, storefront='us', l=None, include=None):
+    def albums(self, album_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog album data associated with the IDs provided
 
@@ -284,12 +1127,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog album data in JSON format
         """
-        return self._get_multiple_resources(album_ids, 'albums', storefront=storefront, l=l, include=include)
+        return self._get_multiple_resources(album_ids, 'albums', storefront=storefront, l=l, include=include,
+                                            fields=fields, extend=extend)
 
-    def music_video(self, music_video_id, storefront='us', l=None, include=None):
+    def music_video(self, music_video_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Music Video by ID
 
@@ -297,12 +1143,16 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Music Video data in JSON format
         """
-        return self._get_resource(music_video_id, 'music-videos', storefront=storefront, l=l, include=include)
+        return self._get_resource(music_video_id, 'music-videos', storefront=storefront, l=l, include=include,
+                                  fields=fields, extend=extend)
 
-    def music_video_relationship(self, music_video_id, relationship, storefront='us', l=None, limit=None, offset=None):
+    def music_video_relationship(self, music_video_id, relationship, storefront='us', l=None, limit=None, offset=None,
+                                 fields=None, extend=None):
         """
         Get a Music Videos's relationship (e.g. list of artists)
 
@@ -312,14 +1162,17 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship(music_video_id, 'music-videos', relationship,
-                                               storefront=storefront, l=l, limit=limit, offset=offset)
+                                               storefront=storefront, l=l, limit=limit, offset=offset,
+                                               fields=fields, extend=extend)
 
     def music_video_relationship_view(self, music_video_id, relationship_view,
-                                      storefront='us', l=None, limit=None, offset=None):
+                                      storefront='us', l=None, limit=None, offset=None, fields=None, extend=None):
         """
         Get a Music Videos's relationship view(e.g. list of artists)
 
@@ -329,13 +1182,16 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship view data in JSON format
         """
         return self._get_resource_relationship_view(music_video_id, 'music-videos', relationship_view,
-                                                    storefront=storefront, l=l, limit=limit, offset=offset)
+                                                    storefront=storefront, l=l, limit=limit, offset=offset,
+                                                    fields=fields, extend=extend)
 
-    def music_videos(self, music_video_ids, storefront='us', l=None, include=None):
+    def music_videos(self, music_video_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog music video data associated with the IDs provided
 
@@ -343,13 +1199,16 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog music video data in JSON format
         """
         return self._get_multiple_resources(music_video_ids, 'music-videos', storefront=storefront, l=l,
-                                            include=include)
+                                            include=include, fields=fields, extend=extend)
 
-    def music_videos_by_isrc(self, isrcs, music_video_ids=None, storefront='us', l=None, include=None):
+    def music_videos_by_isrc(self, isrcs, music_video_ids=None, storefront='us', l=None, include=None,
+                             fields=None, extend=None):
         """
         Get all catalog music videos associated with the ISRCs provided
 
@@ -358,13 +1217,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog music video data in JSON format
         """
         return self._get_resource_by_filter('isrc', isrcs, 'music-videos', resource_ids=music_video_ids,
-                                            storefront=storefront, l=l, include=include)
+                                            storefront=storefront, l=l, include=include, fields=fields, extend=extend)
 
-    def playlist(self, playlist_id, storefront='us', l=None, include=None):
+    def playlist(self, playlist_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Playlist by ID
 
@@ -372,12 +1233,16 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Playlist data in JSON format
         """
-        return self._get_resource(playlist_id, 'playlists', storefront=storefront, l=l, include=include)
+        return self._get_resource(playlist_id, 'playlists', storefront=storefront, l=l, include=include,
+                                  fields=fields, extend=extend)
 
-    def playlist_relationship(self, playlist_id, relationship, storefront='us', l=None, limit=None, offset=None):
+    def playlist_relationship(self, playlist_id, relationship, storefront='us', l=None, limit=None, offset=None,
+                              fields=None, extend=None):
         """
         Get a Playlists's relationship (e.g. list of tracks)
 
@@ -387,13 +1252,16 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship(playlist_id, 'playlists', relationship, storefront=storefront,
-                                               l=l, limit=limit, offset=offset)
+                                               l=l, limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def playlist_relationship_view(self, playlist_id, relationship_view, storefront='us', l=None, limit=None, offset=None):
+    def playlist_relationship_view(self, playlist_id, relationship_view, storefront='us', l=None, limit=None,
+                                   offset=None, fields=None, extend=None):
         """
         Get a Playlists's relationship view(e.g. list of tracks)
 
@@ -403,13 +1271,15 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship view data in JSON format
         """
         return self._get_resource_relationship_view(playlist_id, 'playlists', relationship_view, storefront=storefront,
-                                                    l=l, limit=limit, offset=offset)
+                                                    l=l, limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def playlists(self, playlist_ids, storefront='us', l=None, include=None):
+    def playlists(self, playlist_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog album data associated with the IDs provided
 
@@ -417,13 +1287,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog playlist data in JSON format
         """
         return self._get_multiple_resources(playlist_ids, 'playlists', storefront=storefront, l=l,
-                                            include=include)
+                                            include=include, fields=fields, extend=extend)
 
-    def song(self, song_id, storefront='us', l=None, include=None):
+    def song(self, song_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Song by ID
 
@@ -431,12 +1303,16 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Song data in JSON format
         """
-        return self._get_resource(song_id, 'songs', storefront=storefront, l=l, include=include)
+        return self._get_resource(song_id, 'songs', storefront=storefront, l=l, include=include,
+                                  fields=fields, extend=extend)
 
-    def song_relationship(self, song_id, relationship, storefront='us', l=None, limit=None, offset=None):
+    def song_relationship(self, song_id, relationship, storefront='us', l=None, limit=None, offset=None,
+                          fields=None, extend=None):
         """
         Get a Song's relationship (e.g. artist)
 
@@ -446,13 +1322,15 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship(song_id, 'songs', relationship, storefront=storefront, l=l,
-                                               limit=limit, offset=offset)
+                                               limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def songs(self, song_ids, storefront='us', l=None, include=None):
+    def songs(self, song_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog song data associated with the IDs provided
 
@@ -460,12 +1338,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog song data in JSON format
         """
-        return self._get_multiple_resources(song_ids, 'songs', storefront=storefront, l=l, include=include)
+        return self._get_multiple_resources(song_ids, 'songs', storefront=storefront, l=l, include=include,
+                                            fields=fields, extend=extend)
 
-    def songs_by_isrc(self, isrcs, song_ids=None, storefront='us', l=None, include=None):
+    def songs_by_isrc(self, isrcs, song_ids=None, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog songs associated with the ISRCs provided
 
@@ -474,13 +1355,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog song data in JSON format
         """
         return self._get_resource_by_filter('isrc', isrcs, 'songs', resource_ids=song_ids,
-                                            storefront=storefront, l=l, include=include)
+                                            storefront=storefront, l=l, include=include, fields=fields, extend=extend)
 
-    def artist(self, artist_id, storefront='us', l=None, include=None):
+    def artist(self, artist_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Artist by ID
 
@@ -488,12 +1371,16 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Artist data in JSON format
         """
-        return self._get_resource(artist_id, 'artists', storefront=storefront, l=l, include=include)
+        return self._get_resource(artist_id, 'artists', storefront=storefront, l=l, include=include,
+                                  fields=fields, extend=extend)
 
-    def artist_relationship(self, artist_id, relationship, storefront='us', l=None, limit=None, offset=None):
+    def artist_relationship(self, artist_id, relationship, storefront='us', l=None, limit=None, offset=None,
+                            fields=None, extend=None):
         """
         Get a Artist's relationship (e.g. song)
 
@@ -503,13 +1390,16 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship(artist_id, 'artists', relationship, storefront=storefront,
-                                               l=l, limit=limit, offset=offset)
+                                               l=l, limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def artist_relationship_view(self, artist_id, relationship_view, storefront='us', l=None, limit=None, offset=None):
+    def artist_relationship_view(self, artist_id, relationship_view, storefront='us', l=None, limit=None, offset=None,
+                                 fields=None, extend=None):
         """
         Get a Artist's relationship (e.g. song)
 
@@ -519,13 +1409,15 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship_view(artist_id, 'artists', relationship_view, storefront=storefront,
-                                                    l=l, limit=limit, offset=offset)
+                                                    l=l, limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def artists(self, artist_ids, storefront='us', l=None, include=None):
+    def artists(self, artist_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog artist data associated with the IDs provided
 
@@ -533,12 +1425,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog artist data in JSON format
         """
-        return self._get_multiple_resources(artist_ids, 'artists', storefront=storefront, l=l, include=include)
+        return self._get_multiple_resources(artist_ids, 'artists', storefront=storefront, l=l, include=include,
+                                            fields=fields, extend=extend)
 
-    def station(self, station_id, storefront='us', l=None, include=None):
+    def station(self, station_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Station by ID
 
@@ -546,12 +1441,15 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Station data in JSON format
         """
-        return self._get_resource(station_id, 'stations', storefront=storefront, l=l, include=include)
+        return self._get_resource(station_id, 'stations', storefront=storefront, l=l, include=include,
+                                  fields=fields, extend=extend)
 
-    def stations(self, station_ids, storefront='us', l=None, include=None):
+    def stations(self, station_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog station data associated with the IDs provided
 
@@ -559,13 +1457,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog station data in JSON format
         """
         return self._get_multiple_resources(station_ids, 'stations', storefront=storefront,
-                                            l=l, include=include)
+                                            l=l, include=include, fields=fields, extend=extend)
 
-    def curator(self, curator_id, storefront='us', l=None, include=None):
+    def curator(self, curator_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Curator by ID
 
@@ -573,12 +1473,16 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Curator data in JSON format
         """
-        return self._get_resource(curator_id, 'curators', storefront=storefront, l=l, include=include)
+        return self._get_resource(curator_id, 'curators', storefront=storefront, l=l, include=include,
+                                  fields=fields, extend=extend)
 
-    def curator_relationship(self, curator_id, relationship, storefront='us', l=None, limit=None, offset=None):
+    def curator_relationship(self, curator_id, relationship, storefront='us', l=None, limit=None, offset=None,
+                             fields=None, extend=None):
         """
         Get a Curator's relationship (e.g. playlists)
 
@@ -588,13 +1492,15 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship(curator_id, 'curators', relationship, storefront=storefront,
-                                               l=l, limit=limit, offset=offset)
+                                               l=l, limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def curators(self, curator_ids, storefront='us', l=None, include=None):
+    def curators(self, curator_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all curator album data associated with the IDs provided
 
@@ -602,13 +1508,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog curator data in JSON format
         """
         return self._get_multiple_resources(curator_ids, 'curators', storefront=storefront, l=l,
-                                            include=include)
+                                            include=include, fields=fields, extend=extend)
 
-    def activity(self, activity_id, storefront='us', l=None, include=None):
+    def activity(self, activity_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Activity by ID
 
@@ -616,12 +1524,16 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Activity data in JSON format
         """
-        return self._get_resource(activity_id, 'activities', storefront=storefront, l=l, include=include)
+        return self._get_resource(activity_id, 'activities', storefront=storefront, l=l, include=include,
+                                  fields=fields, extend=extend)
 
-    def activity_relationship(self, activity_id, relationship, storefront='us', limit=None, offset=None):
+    def activity_relationship(self, activity_id, relationship, storefront='us', limit=None, offset=None,
+                              fields=None, extend=None):
         """
         Get an Activity's relationship (e.g. playlists)
 
@@ -630,13 +1542,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship(activity_id, 'activities', relationship, storefront=storefront,
-                                               limit=limit, offset=offset)
+                                               limit=limit, offset=offset, fields=fields, extend=extend)
 
-    def activities(self, activity_ids, storefront='us', l=None, include=None):
+    def activities(self, activity_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog activity data associated with the IDs provided
 
@@ -644,13 +1558,15 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog activity data in JSON format
         """
         return self._get_multiple_resources(activity_ids, 'activities', storefront=storefront, l=l,
-                                            include=include)
+                                            include=include, fields=fields, extend=extend)
 
-    def apple_curator(self, apple_curator_id, storefront='us', l=None, include=None):
+    def apple_curator(self, apple_curator_id, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get a catalog Apple Curator by ID
 
@@ -658,14 +1574,16 @@ class AppleMusic:
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Apple Curator data in JSON format
         """
         return self._get_resource(apple_curator_id, 'apple-curators', storefront=storefront, l=l,
-                                  include=include)
+                                  include=include, fields=fields, extend=extend)
 
     def apple_curator_relationship(self, apple_curator_id, relationship, storefront='us', l=None, limit=None,
-                                   offset=None):
+                                   offset=None, fields=None, extend=None):
         """
         Get an Apple Curator's relationship (e.g. playlists)
 
@@ -675,13 +1593,16 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A List of relationship data in JSON format
         """
         return self._get_resource_relationship(apple_curator_id, 'apple-curators', relationship,
-                                               storefront=storefront, l=l, limit=limit, offset=offset)
+                                               storefront=storefront, l=l, limit=limit, offset=offset,
+                                               fields=fields, extend=extend)
 
-    def apple_curators(self, apple_curator_ids, storefront='us', l=None, include=None):
+    def apple_curators(self, apple_curator_ids, storefront='us', l=None, include=None, fields=None, extend=None):
         """
         Get all catalog apple curator data associated with the IDs provided
 
@@ -689,42 +1610,58 @@ class AppleMusic:
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog apple curator data in JSON format
         """
         return self._get_multiple_resources(apple_curator_ids, 'apple-curators', storefront=storefront, l=l,
-                                            include=include)
+                                            include=include, fields=fields, extend=extend)
 
-    def genre(self, genre_id, storefront='us', l=None):
+    def genre(self, genre_id, storefront='us', l=None, fields=None, extend=None):
         """
         Get a catalog Genre by ID
 
         :param genre_id: Genre ID
         :param storefront: Apple Music Storefront
         :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Genre data in JSON format
         """
-        return self._get_resource(genre_id, 'genres', storefront=storefront, l=l)
+        reference = self._local_reference(l, fields, extend)
+        genre = reference.genre(genre_id, storefront) if reference is not None else None
+        if genre is not None:
+            return {'data': [genre]}
+        return self._get_resource(genre_id, 'genres', storefront=storefront, l=l, fields=fields, extend=extend)
 
     # THIS IS LISTED IN APPLE API, BUT DOESN'T SEEM TO WORK
     # def genre_relationship(self, genre_id, relationship, storefront='us', l=None, limit=None, offset=None):
     #     return self._get_resource_relationship(genre_id, 'genres', relationship, storefront=storefront,
     #                                            l=l, limit=limit, offset=offset)
 
-    def genres(self, genre_ids, storefront='us', l=None):
+    def genres(self, genre_ids, storefront='us', l=None, fields=None, extend=None):
         """
         Get all catalog genre data associated with the IDs provided
 
         :param genre_ids: a list of genre IDs
         :param storefront: Apple Music store front
         :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of catalog genre data in JSON format
         """
-        return self._get_multiple_resources(genre_ids, 'genres', storefront=storefront, l=l)
+        reference = self._local_reference(l, fields, extend)
+        if reference is not None:
+            genres = [reference.genre(genre_id, storefront) for genre_id in genre_ids]
+            if None not in genres:
+                return {'data': genres}
+        return self._get_multiple_resources(genre_ids, 'genres', storefront=storefront, l=l,
+                                            fields=fields, extend=extend)
 
-    def genres_all(self, storefront='us', l=None, limit=None, offset=None):
+    def genres_all(self, storefront='us', l=None, limit=None, offset=None, fields=None, extend=None):
         """
         Get all genres
 
@@ -732,50 +1669,74 @@ class AppleMusic:
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of genre data in JSON format
         """
+        reference = self._local_reference(l, fields, extend)
+        genres = reference.genres(storefront) if reference is not None else None
+        if genres is not None:
+            return _page(genres, limit, offset)
         url = self.root + 'catalog/{}/genres'.format(storefront)
-        return self._get(url, l=l, limit=limit, offset=offset)
+        return self._get(url, l=l, limit=limit, offset=offset, **self._sparse_params(fields, extend))
 
     # Storefronts
-    def storefront(self, storefront_id, l=None):
+    def storefront(self, storefront_id, l=None, fields=None, extend=None):
         """
         Get a Storefront by ID
 
         :param storefront_id: Storefont ID
         :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: Storefront data in JSON format
         """
+        reference = self._local_reference(l, fields, extend)
+        found = reference.storefront(storefront_id) if reference is not None else None
+        if found is not None:
+            return {'data': [found]}
         url = self.root + 'storefronts/{}'.format(storefront_id)
-        return self._get(url, l=l)
+        return self._get(url, l=l, **self._sparse_params(fields, extend))
 
-    def storefronts(self, storefront_ids, l=None):
+    def storefronts(self, storefront_ids, l=None, fields=None, extend=None):
         """
         Get all storefront data associated with the IDs provided
 
         :param storefront_ids: a list of storefront IDs
         :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of storefront data in JSON format
         """
+        reference = self._local_reference(l, fields, extend)
+        if reference is not None:
+            found = [reference.storefront(storefront_id) for storefront_id in storefront_ids]
+            if None not in found:
+                return {'data': found}
         url = self.root + 'storefronts'
         id_string = ','.join(storefront_ids)
-        return self._get(url, ids=id_string, l=l)
+        return self._get(url, ids=id_string, l=l, **self._sparse_params(fields, extend))
 
-    def storefronts_all(self, l=None, limit=None, offset=None):
+    def storefronts_all(self, l=None, limit=None, offset=None, fields=None, extend=None):
         """
         Get all storefronts
 
         :param l: The localization to use, specified by a language tag. Check API documentation.
         :param limit: The maximum amount of items to return
         :param offset: The index of the first item returned
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
 
         :return: A list of storefront data in JSON format
         """
+        reference = self._local_reference(l, fields, extend)
+        if reference is not None:
+            return _page(reference.storefronts(), limit, offset)
         url = self.root + 'storefronts'
-        return self._get(url, l=l, limit=limit, offset=offset)
+        return self._get(url, l=l, limit=limit, offset=offset, **self._sparse_params(fields, extend))
 
     # Search
     def search(self, term, storefront='us', l=None, limit=None, offset=None, types=None, hints=False, os='linux'):
@@ -848,3 +1809,350 @@ class AppleMusic:
         else:
             type_str = None
         return self._get(url, types=type_str, chart=chart, l=l, genre=genre, limit=limit, offset=offset)
+
+    # Library
+    def add_to_library(self, ids, chunk_size=WRITE_CHUNK_SIZE, max_workers=None):
+        """
+        Add catalog resources to the user's library. Large inputs are split into chunks that are sent
+        concurrently. Adding an item that is already in the library changes nothing, so chunks are retried
+        on server errors.
+
+        :param ids: Dictionary of resource type to IDs (e.g. {'songs': [...], 'albums': [...]}), or a list of song IDs
+        :param chunk_size: Number of IDs per request
+        :param max_workers: Maximum number of requests sent concurrently, defaults to the client's max_workers
+
+        :return: List of chunk results, dictionaries with items (resource type and IDs), ok, error and response
+        """
+        self._require_user_token()
+        if not isinstance(ids, dict):
+            ids = {'songs': ids}
+        chunks = [(resource_type, chunk) for resource_type, resource_ids in ids.items()
+                  for chunk in _chunks([str(i) for i in resource_ids], chunk_size)]
+
+        def write(chunk):
+            resource_type, chunk_ids = chunk
+            return self._post(self.root + 'me/library', idempotent=True,
+                              **{'ids[{}]'.format(resource_type): ','.join(chunk_ids)})
+
+        return self._write_chunks(write, chunks, max_workers=max_workers)
+
+    def add_tracks_to_library_playlist(self, playlist_id, tracks, chunk_size=WRITE_CHUNK_SIZE):
+        """
+        Append tracks to a library playlist. Chunks are sent one after another to keep the track order, and
+        appending is not idempotent, so a chunk is not retried after a server error. After a failed chunk the
+        rest are skipped and reported as not ok, so the playlist holds a prefix of the tracks.
+
+        :param playlist_id: Library playlist ID
+        :param tracks: Track IDs (catalog song IDs or library song IDs), or dictionaries with id and type
+        :param chunk_size: Number of tracks per request
+
+        :return: List of chunk results, dictionaries with items (track identifiers), ok, error and response
+        """
+        self._require_user_token()
+        url = self.root + 'me/library/playlists/{}/tracks'.format(playlist_id)
+        results = []
+        failed = False
+        for chunk in _chunks(_track_data(tracks), chunk_size):
+            if failed:
+                results.append({'items': chunk, 'ok': False, 'error': 'Skipped after an earlier chunk failed',
+                                'response': None})
+                continue
+            try:
+                response = self._post(url, body={'data': chunk})
+                results.append({'items': chunk, 'ok': True, 'error': None, 'response': response})
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                failed = True
+                results.append({'items': chunk, 'ok': False, 'error': '{}: {}'.format(type(e).__name__, e),
+                                'response': None})
+        return results
+
+    def create_library_playlist(self, name, description=None, tracks=None, chunk_size=WRITE_CHUNK_SIZE):
+        """
+        Create a playlist in the user's library. The first chunk of tracks is sent with the playlist and the
+        rest are appended with add_tracks_to_library_playlist. Creating is not idempotent, so it is not
+        retried after a server error.
+
+        :param name: Playlist name
+        :param description: Playlist description
+        :param tracks: Track IDs (catalog song IDs or library song IDs), or dictionaries with id and type
+        :param chunk_size: Number of tracks per request
+
+        :return: Dictionary with the created playlist in data and the results of the appended chunks in chunks
+        """
+        self._require_user_token()
+        attributes = {'name': name}
+        if description is not None:
+            attributes['description'] = description
+        body = {'attributes': attributes}
+        track_data = _track_data(tracks or [])
+        if track_data:
+            body['relationships'] = {'tracks': {'data': track_data[:chunk_size]}}
+        response = self._post(self.root + 'me/library/playlists', body=body)
+        data = (response or {}).get('data') or []
+        chunks = []
+        if len(track_data) > chunk_size:
+            if not data or 'id' not in data[0]:
+                raise AppleMusicError('Created playlist {!r} but the response has no playlist ID to append the '
+                                      'remaining {} tracks to'.format(name, len(track_data) - chunk_size))
+            chunks = self.add_tracks_to_library_playlist(data[0]['id'], track_data[chunk_size:], chunk_size)
+        return {'data': data, 'chunks': chunks}
+
+    def create_library_playlists(self, playlists, chunk_size=WRITE_CHUNK_SIZE, max_workers=None):
+        """
+        Create many library playlists concurrently, each filled in order by create_library_playlist
+
+        :param playlists: List of dictionaries with name and optionally description and tracks
+        :param chunk_size: Number of tracks per request
+        :param max_workers: Maximum number of playlists created concurrently, defaults to the client's max_workers
+
+        :return: List of results, one per playlist in order, with items (the playlist given), ok, error and
+            response (the create_library_playlist result). ok is False if any chunk of tracks failed
+        """
+        self._require_user_token()
+
+        def write(playlist):
+            return self.create_library_playlist(playlist['name'], description=playlist.get('description'),
+                                                tracks=playlist.get('tracks'), chunk_size=chunk_size)
+
+        results = self._write_chunks(write, playlists, max_workers=max_workers)
+        for result in results:
+            failed = [chunk for chunk in (result['response'] or {}).get('chunks', []) if not chunk['ok']]
+            if failed:
+                result['ok'], result['error'] = False, failed[0]['error']
+        return results
+
+    # Pagination
+    def fetch_all(self, resource_type, resource_id, relationship, storefront='us', l=None, page_size=100,
+                  view=False, max_workers=None, deadline=None, fields=None, extend=None):
+        """
+        Get every item of a resource relationship (e.g. all tracks of a playlist) in as few round trips as possible.
+        If the first page reports a total, the remaining pages are fetched concurrently by offset and put back
+        in order. Otherwise the next links are followed one page at a time.
+
+        :param resource_type: Resource type (e.g. "playlists")
+        :param resource_id: ID of resource
+        :param relationship: Relationship type (e.g. "tracks"), or relationship view type if view is True
+        :param storefront: Apple Music store front
+        :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param page_size: Number of items requested per page
+        :param view: Fetch a relationship view (e.g. "top-songs") instead of a relationship
+        :param max_workers: Maximum number of pages fetched concurrently, defaults to the client's max_workers
+        :param deadline: Seconds the whole fetch may take. Pages that do not complete in time are left out and
+            reported in meta as incomplete_offsets (or next, when following next links)
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
+
+        :return: All relationship data in JSON format, with the total in meta
+        """
+        self._require_decoded('fetch_all')
+        path = 'catalog/{0}/{1}/{2}/view/{3}' if view else 'catalog/{0}/{1}/{2}/{3}'
+        url = self.root + path.format(storefront, resource_type, str(resource_id), relationship)
+        params = dict(self._sparse_params(fields, extend), l=l)
+        meta = {}
+
+        with self._deadline_scope(deadline):
+            first = self._get(url, limit=page_size, **params)
+            data = list(first.get('data', []))
+            total = first.get('meta', {}).get('total')
+            if total is not None and data:
+                step = len(data)  # the API may cap the page size below what was asked for
+                pages, incomplete = self._map_concurrent(
+                    lambda offset: self._get(url, limit=step, offset=offset, **params),
+                    range(step, total, step), max_workers=max_workers, partial=True)
+                for page in pages:
+                    if page is not None:
+                        data.extend(page.get('data', []))
+                if incomplete:
+                    meta['incomplete_offsets'] = incomplete
+            else:
+                next_page = first.get('next')
+                while next_page:
+                    offset = parse_qs(urlsplit(next_page).query).get('offset')
+                    try:
+                        if offset:
+                            page = self._get(url, limit=page_size, offset=offset[0], **params)
+                        else:
+                            page = self._get(self.root + next_page.split('/v1/', 1)[-1])
+                    except DeadlineExceeded:
+                        meta['next'] = next_page
+                        break
+                    data.extend(page.get('data', []))
+                    next_page = page.get('next')
+        meta['total'] = total if total is not None else len(data)
+        return {'data': data, 'meta': meta}
+
+    def iter_relationship(self, resource_type, resource_id, relationship, storefront='us', l=None, page_size=100,
+                          view=False, fields=None, extend=None):
+        """
+        Iterate over every item of a resource relationship, fetching one page at a time as the items are consumed
+
+        :param resource_type: Resource type (e.g. "playlists")
+        :param resource_id: ID of resource
+        :param relationship: Relationship type (e.g. "tracks"), or relationship view type if view is True
+        :param storefront: Apple Music store front
+        :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param page_size: Number of items requested per page
+        :param view: Iterate over a relationship view (e.g. "top-songs") instead of a relationship
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
+
+        :return: Generator of relationship items in JSON format
+        """
+        self._require_decoded('iter_relationship')
+        path = 'catalog/{0}/{1}/{2}/view/{3}' if view else 'catalog/{0}/{1}/{2}/{3}'
+        url = self.root + path.format(storefront, resource_type, str(resource_id), relationship)
+        params = dict(self._sparse_params(fields, extend), l=l)
+        page = self._get(url, limit=page_size, **params)
+        while True:
+            yield from page.get('data', [])
+            next_page = page.get('next')
+            if not next_page:
+                return
+            offset = parse_qs(urlsplit(next_page).query).get('offset')
+            if offset:
+                page = self._get(url, limit=page_size, offset=offset[0], **params)
+            else:
+                page = self._get(self.root + next_page.split('/v1/', 1)[-1])
+
+    def iter_resources(self, resource_type, ids, storefront='us', l=None, include=None, fields=None, extend=None,
+                       max_workers=None):
+        """
+        Iterate over catalog resources by ID. IDs are read lazily and requested in batches of the API maximum,
+        max_workers batches at a time, so only that many batches are held in memory however many IDs there are.
+        Resources missing from the catalog are skipped.
+
+        :param resource_type: Resource type (e.g. "songs")
+        :param ids: Iterable of resource IDs, may be a generator
+        :param storefront: Apple Music store front
+        :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param include: Additional relationships to include in the fetch. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+        :param extend: Additional attributes to include in the fetch. Check API documentation.
+        :param max_workers: Maximum number of batches fetched concurrently, defaults to the client's max_workers
+
+        :return: Generator of resources in JSON format, in the order of ids
+        """
+        from itertools import islice
+
+        self._require_decoded('iter_resources')
+        ids = iter(ids)
+        batch_size = MAX_IDS.get(resource_type, DEFAULT_MAX_IDS)
+        window = max_workers or self.max_workers
+
+        def fetch(chunk):
+            return self._get_multiple_resources(chunk, resource_type, storefront=storefront, l=l, include=include,
+                                                fields=fields, extend=extend)
+
+        while True:
+            chunks = []
+            for _ in range(window):
+                chunk = [str(i) for i in islice(ids, batch_size)]
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            if not chunks:
+                return
+            for chunk, result in zip(chunks, self._map_concurrent(fetch, chunks, max_workers=window)):
+                found = {resource['id']: resource for resource in result.get('data', [])}
+                for resource_id in chunk:
+                    if resource_id in found:
+                        yield found[resource_id]
+
+    def stream_resources(self, resource_type, ids, storefront='us', l=None, include=None, fields=None, extend=None,
+                         max_workers=None, maxsize=1000):
+        """
+        iter_resources as a bounded ResultStream, iterable with for or async for. Batches are fetched in the
+        background, and fetching pauses while maxsize resources are waiting for the consumer.
+
+        :param maxsize: Maximum number of resources buffered ahead of the consumer, the other parameters are those of
+            iter_resources
+
+        :return: ResultStream of resources in JSON format, in the order of ids
+        """
+        from .streams import ResultStream
+
+        self._require_decoded('stream_resources')
+        return ResultStream(self.iter_resources(resource_type, ids, storefront=storefront, l=l, include=include,
+                                                fields=fields, extend=extend, max_workers=max_workers),
+                            maxsize=maxsize)
+
+    def stream_relationship(self, resource_type, resource_id, relationship, storefront='us', l=None,
+                            page_size=100, view=False, fields=None, extend=None, maxsize=1000):
+        """
+        iter_relationship as a bounded ResultStream, iterable with for or async for. Pages are fetched in the
+        background, and fetching pauses while maxsize items are waiting for the consumer.
+
+        :param maxsize: Maximum number of items buffered ahead of the consumer, the other parameters are those of
+            iter_relationship
+
+        :return: ResultStream of relationship items in JSON format
+        """
+        from .streams import ResultStream
+
+        self._require_decoded('stream_relationship')
+        return ResultStream(self.iter_relationship(resource_type, resource_id, relationship, storefront=storefront,
+                                                   l=l, page_size=page_size, view=view, fields=fields,
+                                                   extend=extend),
+                            maxsize=maxsize)
+
+    def fetch_graph(self, resource_type, ids, shape, storefront='us', l=None, deadline=None, fields=None):
+        """
+        Get resources together with nested relationships in as few requests as possible, e.g.
+
+            am.fetch_graph('albums', album_ids, 'tracks.artists')
+
+        fetches the albums with their tracks in batched include= requests, then the artists of all tracks in one
+        more round of batched requests, instead of one album_relationship and artist_relationship call each.
+
+        :param resource_type: Resource type of the root resources (e.g. "albums")
+        :param ids: IDs of the root resources
+        :param shape: Relationships to fetch, as a dotted path (e.g. "tracks.artists"), a list of dotted paths,
+            or nested dictionaries (e.g. {'tracks': {'artists': {}}})
+        :param storefront: Apple Music store front
+        :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param deadline: Seconds the whole fetch may take. Resources that do not complete in time are left out
+            and listed in meta as incomplete
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+
+        :return: The root resources in data, with relationship data replaced by the fetched resources
+        """
+        self._require_decoded('fetch_graph')
+        with self._deadline_scope(deadline):
+            return QueryPlanner(self).fetch(resource_type, ids, shape, storefront=storefront, l=l, fields=fields)
+
+    def artist_discography(self, artist_id, storefront='us', l=None, min_overlap=0.5, deadline=None):
+        """
+        Get an artist's releases with their editions (deluxe, clean/explicit, remasters...) grouped together.
+        The artist's albums are paged concurrently, then fetched with their tracks in batched include= requests,
+        and grouped in one pass by kind of release (album, single, EP or compilation), then by normalized title
+        or by the overlap of their track ISRCs.
+
+        :param artist_id: ID of artist
+        :param storefront: Apple Music store front
+        :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param min_overlap: Share of the larger album's ISRCs two albums must have more than in common to be
+            editions of one release
+        :param deadline: Seconds the whole fetch may take. Albums that do not complete in time are left out and
+            listed in meta as incomplete
+
+        :return: Releases in data, oldest first, each with the canonical edition's id, name, kind, release_date
+            and tracks, the tracks only other editions have as bonus_tracks, and a summary of every edition
+        """
+        from .discography import canonical_release, group_editions
+
+        self._require_decoded('artist_discography')
+        with self._deadline_scope(deadline):
+            albums = self.fetch_all('artists', artist_id, 'albums', storefront=storefront, l=l)
+            album_ids = list(dict.fromkeys(album['id'] for album in albums['data']))
+            graph = QueryPlanner(self).fetch('albums', album_ids, 'tracks', storefront=storefront, l=l)
+        releases = [canonical_release(editions) for editions in group_editions(graph['data'], min_overlap)]
+        releases.sort(key=lambda release: (release['release_date'] or '9999', release['id']))
+        meta = {'albums': len(graph['data']), 'releases': len(releases)}
+        incomplete = graph.get('meta', {}).get('incomplete', [])
+        if 'incomplete_offsets' in albums['meta'] or 'next' in albums['meta']:
+            incomplete = [{'id': str(artist_id), 'type': 'artists', 'relationship': 'albums'}] + incomplete
+        if incomplete:
+            meta['incomplete'] = incomplete
+        return {'data': releases, 'meta': meta}
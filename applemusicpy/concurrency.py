@@ -0,0 +1,102 @@
+from collections import deque
+from contextvars import ContextVar
+import threading
+import time
+
+from .deadlines import check, remaining
+
+# True inside the worker threads of the client's concurrent paths, whose requests the limiter gates
+concurrent_call = ContextVar('applemusicpy_concurrent_call', default=False)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD limit on the number of requests the client's concurrent paths keep in flight.
+
+    Every healthy response (latency within latency_tolerance times the recent baseline) raises the limit
+    by 1/limit, so about one more request per round trip. A 429 or 5xx response, or latency rising above
+    the tolerance, multiplies the limit by backoff, at most once per baseline round trip so a burst of
+    errors from the same window only counts once.
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=64, backoff=0.5, latency_tolerance=2.0, window=100):
+        """
+        :param initial: Starting limit
+        :param min_limit: Lowest the limit goes
+        :param max_limit: Highest the limit goes
+        :param backoff: Factor the limit is multiplied by on throttling or rising latency
+        :param latency_tolerance: How many times the baseline latency a response may take and still count
+            as healthy
+        :param window: Number of recent latencies the baseline (their minimum) is taken over
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._latencies = deque(maxlen=window)
+        self._last_decrease = 0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        """
+        Current number of requests allowed in flight
+        """
+        with self._cond:
+            return int(self._limit)
+
+    def acquire(self):
+        """
+        Block until a request may be sent. Raises DeadlineExceeded if the current deadline passes first.
+        """
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                check()
+                self._cond.wait(remaining())
+            self._in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def _baseline(self):
+        return min(self._latencies) if self._latencies else None
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < (self._baseline() or 0):
+            return
+        self._last_decrease = now
+        self._limit = max(self.min_limit, self._limit * self.backoff)
+
+    def on_success(self, latency):
+        """
+        Feed a successful response
+
+        :param latency: Seconds the request took
+        """
+        with self._cond:
+            baseline = self._baseline()
+            self._latencies.append(latency)
+            if baseline is not None and latency > baseline * self.latency_tolerance:
+                self._decrease()
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        """
+        Feed a 429 or 5xx response
+        """
+        with self._cond:
+            self._decrease()
+
+    def stats(self):
+        """
+        :return: Dictionary with the current limit, requests in flight and baseline latency
+        """
+        with self._cond:
+            return {'limit': int(self._limit), 'in_flight': self._in_flight, 'baseline_latency': self._baseline()}
@@ -0,0 +1,36 @@
+from contextvars import ContextVar
+import time
+
+from .exceptions import DeadlineExceeded
+
+# time.monotonic() value by which the API calls made in the current context must finish, see AppleMusic.deadline
+current_deadline = ContextVar('applemusicpy_deadline', default=None)
+
+
+def remaining():
+    """
+    :return: Seconds left before the current deadline, or None if there is no deadline
+    """
+    deadline = current_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def check(needed=0):
+    """
+    Raise DeadlineExceeded if the current deadline has passed, or will pass within the time needed
+
+    :param needed: Seconds the next step would take (e.g. a backoff sleep)
+    """
+    left = remaining()
+    if left is not None and left <= needed:
+        raise DeadlineExceeded('Deadline exceeded' if left <= 0 else
+                               'Deadline would be exceeded, {:.2f} secs left but {:.2f} needed'.format(left, needed))
+
+
+def wait_allowed(wait):
+    """
+    Raise DeadlineExceeded if a rate limit wait would not end before the current deadline
+
+    :param wait: Seconds the caller is about to wait
+    """
+    check(wait)
@@ -0,0 +1,167 @@
+from collections import Counter
+import re
+import unicodedata
+
+# Words that mark a bracketed or dashed part of a title as an edition of the same release,
+# e.g. "Album (Deluxe Edition)", "Album [Remastered 2011]" or "Album - 20th Anniversary Edition".
+# Matched as whole words, so titles such as "Monologues" or "The Specials" are left alone
+EDITION_WORDS = ('deluxe', 'remaster', 'remastered', 'expanded', 'anniversary', 'edition', 'explicit', 'clean',
+                 'bonus', 'reissue', 'reissued', 'special', 'collector', 'collectors', "collector's", 'legacy',
+                 'mono', 'stereo')
+_EDITION = re.compile(r'\b(?:{})\b'.format('|'.join(EDITION_WORDS)), re.IGNORECASE)
+_BRACKETED = re.compile(r'\s*[(\[]([^)\]]*)[)\]]')
+_DASHED = re.compile(r'\s+-\s+([^-]*)$')
+_KIND_SUFFIX = re.compile(r'\s+-\s+(single|ep)$', re.IGNORECASE)
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_title(title):
+    """
+    Title with edition markers, the " - Single" / " - EP" suffix, accents, punctuation and case removed, so
+    editions of one release (or versions of one track) normalize to the same string
+
+    :param title: Album or track name
+
+    :return: Normalized title
+    """
+    title = _KIND_SUFFIX.sub('', title or '')
+    title = _BRACKETED.sub(lambda m: '' if _EDITION.search(m.group(1)) else m.group(0), title)
+    title = _DASHED.sub(lambda m: '' if _EDITION.search(m.group(1)) else m.group(0), title)
+    title = ''.join(c for c in unicodedata.normalize('NFKD', title) if not unicodedata.combining(c))
+    return ' '.join(_NON_WORD.sub(' ', title.casefold()).split())
+
+
+def release_kind(album):
+    """
+    :return: 'single', 'ep', 'compilation' or 'album'
+    """
+    attributes = album.get('attributes', {})
+    name = attributes.get('name') or ''
+    if attributes.get('isSingle') or name.lower().endswith(' - single'):
+        return 'single'
+    if name.lower().endswith(' - ep'):
+        return 'ep'
+    if attributes.get('isCompilation'):
+        return 'compilation'
+    return 'album'
+
+
+def _tracks(album):
+    return [track for track in album.get('relationships', {}).get('tracks', {}).get('data', [])
+            if 'attributes' in track]
+
+
+def _canonical_order(album):
+    # Explicit before clean, plain titles before marked editions, then the original release
+    attributes = album.get('attributes', {})
+    return (attributes.get('contentRating') == 'clean',
+            bool(_EDITION.search(attributes.get('name') or '')),
+            attributes.get('releaseDate') or '9999',
+            album['id'])
+
+
+def _compact_track(track, album_id=None):
+    attributes = track.get('attributes', {})
+    compact = {'id': track['id'], 'name': attributes.get('name'), 'isrc': attributes.get('isrc'),
+               'duration_ms': attributes.get('durationInMillis'), 'disc_number': attributes.get('discNumber'),
+               'track_number': attributes.get('trackNumber')}
+    if album_id is not None:
+        compact['album_id'] = album_id
+    return compact
+
+
+def group_editions(albums, min_overlap=0.5):
+    """
+    Group the editions of each release (deluxe, clean/explicit, remasters...) in one pass over the albums.
+    Two albums are editions of one release if they are the same kind of release and either have the same
+    normalized title or the ISRCs of their tracks overlap by more than min_overlap of the larger track list.
+    A compilation reusing an album's recordings is not an edition of it.
+
+    :param albums: Album resources, with their tracks in relationships for the ISRC overlap
+    :param min_overlap: Share of the larger album's ISRCs two albums must have more than in common
+
+    :return: List of groups, each a list of albums with the canonical edition first
+    """
+    parent = list(range(len(albums)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        parent[find(i)] = find(j)
+
+    by_title = {}
+    by_isrc = {}
+    kinds = []
+    isrcs = []
+    for i, album in enumerate(albums):
+        kinds.append(release_kind(album))
+        key = (kinds[i], normalize_title(album.get('attributes', {}).get('name')))
+        if key in by_title:
+            union(i, by_title[key])
+        else:
+            by_title[key] = i
+        isrcs.append({track['attributes']['isrc'].upper() for track in _tracks(album)
+                      if track['attributes'].get('isrc')})
+        shared = Counter()
+        for isrc in isrcs[i]:
+            for j in by_isrc.setdefault(isrc, []):
+                shared[j] += 1
+            by_isrc[isrc].append(i)
+        for j, count in shared.items():
+            if kinds[i] == kinds[j] and count > min_overlap * max(len(isrcs[i]), len(isrcs[j])):
+                union(i, j)
+
+    groups = {}
+    for i, album in enumerate(albums):
+        groups.setdefault(find(i), []).append(album)
+    return [sorted(group, key=_canonical_order) for group in groups.values()]
+
+
+def canonical_release(editions):
+    """
+    Compact view of one release: the canonical edition's details and tracks, the tracks only other editions
+    have (matched by ISRC or normalized name) as bonus tracks, and a summary of every edition
+
+    :param editions: Albums of one release, canonical edition first, see group_editions
+
+    :return: Dictionary with id, name, title, kind, artist_name, release_date, content_rating, editions,
+        tracks and bonus_tracks
+    """
+    canonical = editions[0]
+    attributes = canonical.get('attributes', {})
+    seen_isrcs = set()
+    seen_names = set()
+    tracks = []
+    bonus_tracks = []
+    for album in editions:
+        for track in _tracks(album):
+            isrc = (track['attributes'].get('isrc') or '').upper()
+            name = normalize_title(track['attributes'].get('name'))
+            if album is not canonical and (isrc in seen_isrcs or name in seen_names):
+                continue
+            if isrc:
+                seen_isrcs.add(isrc)
+            seen_names.add(name)
+            if album is canonical:
+                tracks.append(_compact_track(track))
+            else:
+                bonus_tracks.append(_compact_track(track, album['id']))
+    return {
+        'id': canonical['id'],
+        'name': attributes.get('name'),
+        'title': normalize_title(attributes.get('name')),
+        'kind': release_kind(canonical),
+        'artist_name': attributes.get('artistName'),
+        'release_date': attributes.get('releaseDate'),
+        'content_rating': attributes.get('contentRating'),
+        'editions': [{'id': album['id'], 'name': album.get('attributes', {}).get('name'),
+                      'release_date': album.get('attributes', {}).get('releaseDate'),
+                      'content_rating': album.get('attributes', {}).get('contentRating'),
+                      'track_count': album.get('attributes', {}).get('trackCount')} for album in editions],
+        'tracks': tracks,
+        'bonus_tracks': bonus_tracks,
+    }
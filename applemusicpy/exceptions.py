@@ -0,0 +1,40 @@
+class AppleMusicError(Exception):
+    """
+    Base class for errors raised by applemusicpy itself, rather than by the HTTP library
+    """
+
+
+class CircuitOpenError(AppleMusicError):
+    """
+    Raised instead of calling the API while the circuit breaker for an endpoint family is open
+    """
+
+    def __init__(self, family, retry_after):
+        """
+        :param family: Endpoint family whose circuit is open (e.g. "search")
+        :param retry_after: Seconds until the circuit lets a trial request through
+        """
+        self.family = family
+        self.retry_after = retry_after
+        super().__init__('Circuit for {} endpoints is open, retry in {:.1f} secs'.format(family, retry_after))
+
+
+class DeadlineExceeded(AppleMusicError):
+    """
+    Raised when the end-to-end deadline of a call is spent, including retries, backoff and rate limit waits
+    """
+
+
+class StreamInterrupted(AppleMusicError):
+    """
+    Raised when streaming a raw response fails after part of it was written. Not retried, since the bytes
+    already written can't be taken back
+    """
+
+    def __init__(self, bytes_written, error):
+        """
+        :param bytes_written: Number of bytes written before the failure
+        :param error: The underlying exception
+        """
+        self.bytes_written = bytes_written
+        super().__init__('Streaming the response failed after {} bytes: {}'.format(bytes_written, error))
@@ -0,0 +1,202 @@
+import json
+
+# Columns written for each resource type: (column, type, attribute path). Types are mapped to Arrow types
+# when a ParquetSink is opened, so the schema of a type stays the same whatever the API returns
+SCHEMAS = {
+    'songs': [
+        ('name', 'string', 'name'),
+        ('artist_name', 'string', 'artistName'),
+        ('album_name', 'string', 'albumName'),
+        ('composer_name', 'string', 'composerName'),
+        ('isrc', 'string', 'isrc'),
+        ('duration_ms', 'int64', 'durationInMillis'),
+        ('release_date', 'string', 'releaseDate'),
+        ('track_number', 'int64', 'trackNumber'),
+        ('disc_number', 'int64', 'discNumber'),
+        ('genre_names', 'list<string>', 'genreNames'),
+        ('content_rating', 'string', 'contentRating'),
+        ('has_lyrics', 'bool', 'hasLyrics'),
+        ('url', 'string', 'url'),
+    ],
+    'albums': [
+        ('name', 'string', 'name'),
+        ('artist_name', 'string', 'artistName'),
+        ('upc', 'string', 'upc'),
+        ('release_date', 'string', 'releaseDate'),
+        ('track_count', 'int64', 'trackCount'),
+        ('record_label', 'string', 'recordLabel'),
+        ('copyright', 'string', 'copyright'),
+        ('genre_names', 'list<string>', 'genreNames'),
+        ('content_rating', 'string', 'contentRating'),
+        ('is_single', 'bool', 'isSingle'),
+        ('is_complete', 'bool', 'isComplete'),
+        ('is_compilation', 'bool', 'isCompilation'),
+        ('url', 'string', 'url'),
+    ],
+    'artists': [
+        ('name', 'string', 'name'),
+        ('genre_names', 'list<string>', 'genreNames'),
+        ('url', 'string', 'url'),
+    ],
+    'playlists': [
+        ('name', 'string', 'name'),
+        ('curator_name', 'string', 'curatorName'),
+        ('playlist_type', 'string', 'playlistType'),
+        ('last_modified_date', 'string', 'lastModifiedDate'),
+        ('description', 'string', 'description.standard'),
+        ('url', 'string', 'url'),
+    ],
+}
+
+
+def _lookup(attributes, path):
+    value = attributes
+    for name in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(name)
+    return value
+
+
+def _open(path, compress):
+    if compress is None:
+        return open(path, 'w', encoding='utf-8')
+    if compress == 'gzip':
+        import gzip
+        return gzip.open(path, 'wt', encoding='utf-8')
+    if compress == 'bz2':
+        import bz2
+        return bz2.open(path, 'wt', encoding='utf-8')
+    if compress == 'xz':
+        import lzma
+        return lzma.open(path, 'wt', encoding='utf-8')
+    raise ValueError('Unknown compression: {}. Expected gzip, bz2 or xz'.format(compress))
+
+
+class NDJSONSink:
+    """
+    Writes resources as newline delimited JSON, one resource per line, as they arrive. Use as a context manager:
+
+        with NDJSONSink('songs.ndjson.gz', compress='gzip') as sink:
+            sink.write_all(am.iter_resources('songs', song_ids))
+    """
+
+    def __init__(self, path, compress=None, flush_every=1000):
+        """
+        :param path: File path, or a text file object to write to
+        :param compress: None, 'gzip', 'bz2' or 'xz'. Ignored when path is a file object
+        :param flush_every: Number of rows written between flushes to disk
+        """
+        if hasattr(path, 'write'):
+            self._file, self._owned = path, False
+        else:
+            self._file, self._owned = _open(path, compress), True
+        self.flush_every = flush_every
+        self.rows = 0
+
+    def write(self, resource):
+        self._file.write(json.dumps(resource, ensure_ascii=False, separators=(',', ':')))
+        self._file.write('\n')
+        self.rows += 1
+        if self.rows % self.flush_every == 0:
+            self._file.flush()
+
+    def write_all(self, resources):
+        """
+        :param resources: Iterable of resources, consumed one at a time
+
+        :return: Number of rows written
+        """
+        start = self.rows
+        for resource in resources:
+            self.write(resource)
+        return self.rows - start
+
+    def close(self):
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ParquetSink:
+    """
+    Writes resources of one type to a Parquet file with the fixed schema in SCHEMAS: id, then one column per
+    attribute, with missing attributes as nulls. Rows are buffered and written as a row group every batch_size
+    rows, so memory stays bounded by the batch size. Requires pyarrow. Use as a context manager:
+
+        with ParquetSink('songs.parquet', 'songs') as sink:
+            sink.write_all(am.iter_resources('songs', song_ids))
+    """
+
+    def __init__(self, path, resource_type, batch_size=10000, compression='snappy'):
+        """
+        :param path: File path, or a binary file object to write to
+        :param resource_type: One of the types in SCHEMAS (songs, albums, artists or playlists)
+        :param batch_size: Number of rows per row group
+        :param compression: Parquet compression codec
+        """
+        if resource_type not in SCHEMAS:
+            raise ValueError('No export schema for {}. Expected one of {}'.format(
+                resource_type, ', '.join(sorted(SCHEMAS))))
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError('ParquetSink requires pyarrow (pip install apple-music-python[parquet])')
+        self._pa = pyarrow
+        self._columns = [('id', 'string', None)] + SCHEMAS[resource_type]
+        types = {'string': pyarrow.string(), 'int64': pyarrow.int64(), 'bool': pyarrow.bool_(),
+                 'list<string>': pyarrow.list_(pyarrow.string())}
+        self.schema = pyarrow.schema([(column, types[kind]) for column, kind, _ in self._columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression=compression)
+        self.resource_type = resource_type
+        self.batch_size = batch_size
+        self._buffer = [[] for _ in self._columns]
+        self.rows = 0
+
+    def write(self, resource):
+        attributes = resource.get('attributes', {})
+        values = [str(resource['id'])] + [_lookup(attributes, path) for _, _, path in self._columns[1:]]
+        for column, value in zip(self._buffer, values):
+            column.append(value)
+        self.rows += 1
+        if len(self._buffer[0]) >= self.batch_size:
+            self.flush()
+
+    def write_all(self, resources):
+        """
+        :param resources: Iterable of resources, consumed one at a time
+
+        :return: Number of rows written
+        """
+        start = self.rows
+        for resource in resources:
+            self.write(resource)
+        return self.rows - start
+
+    def flush(self):
+        """
+        Write the buffered rows as a row group
+        """
+        if not self._buffer[0]:
+            return
+        arrays = [self._pa.array(column, type=field.type) for column, field in zip(self._buffer, self.schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self.schema))
+        self._buffer = [[] for _ in self._columns]
+
+    def close(self):
+        self.flush()
+        self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
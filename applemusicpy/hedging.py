@@ -0,0 +1,125 @@
+from collections import deque
+import queue
+import threading
+
+
+class HedgePolicy:
+    """
+    Decides when a GET request is hedged.
+
+    If a request has not answered within the given percentile of recent latencies, a duplicate is sent
+    and whichever answers first wins. Hedges are only sent while they stay within max_extra of all requests,
+    so hedging never adds more than that fraction of extra traffic.
+    """
+
+    def __init__(self, percentile=95, max_extra=0.05, initial_delay=1.0, min_delay=0.05, window=500,
+                 min_samples=20):
+        """
+        :param percentile: Latency percentile after which a hedge is sent
+        :param max_extra: Maximum number of hedges as a fraction of all requests
+        :param initial_delay: Hedge delay in seconds until min_samples latencies have been recorded
+        :param min_delay: Lower bound of the hedge delay in seconds
+        :param window: Number of recent latencies the percentile is computed over
+        :param min_samples: Number of latencies needed before the percentile is used
+        """
+        if not 0 < percentile < 100:
+            raise ValueError('percentile must be between 0 and 100')
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def delay(self):
+        """
+        :return: Seconds to wait for the first attempt before hedging
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+        return max(self.min_delay, ordered[index])
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def try_hedge(self):
+        """
+        Reserve a hedge if the budget allows one
+
+        :return: True if a hedge may be sent
+        """
+        with self._lock:
+            if self.hedged + 1 > self.max_extra * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def record_hedge_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self):
+        """
+        :return: Dictionary with the request, hedge and hedge win counts
+        """
+        with self._lock:
+            return {'requests': self.requests, 'hedged': self.hedged, 'hedge_wins': self.hedge_wins}
+
+
+class AttemptPool:
+    """
+    Threads that run hedged request attempts, first attempts and hedges alike. Idle threads are reused, and a
+    new one is started whenever none is idle, so the pool never caps how many requests are in flight.
+    Threads that stay idle for idle_timeout seconds exit.
+    """
+
+    def __init__(self, idle_timeout=60):
+        """
+        :param idle_timeout: Seconds an idle thread waits for another attempt before exiting
+        """
+        self.idle_timeout = idle_timeout
+        self.threads = 0
+        self._tasks = queue.Queue()
+        self._idle = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args):
+        """
+        Run fn(*args) on an idle thread, or on a new one if none is idle
+        """
+        with self._lock:
+            start = self._idle == 0
+            if start:
+                self.threads += 1
+            else:
+                self._idle -= 1  # reserved for this task
+        self._tasks.put((fn, args))
+        if start:
+            threading.Thread(target=self._work, name='applemusicpy-request', daemon=True).start()
+
+    def _work(self):
+        while True:
+            try:
+                fn, args = self._tasks.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                with self._lock:
+                    if self._idle > 0:  # otherwise a task was just handed to the idle threads, wait for it
+                        self._idle -= 1
+                        self.threads -= 1
+                        return
+                continue
+            fn(*args)
+            with self._lock:
+                self._idle += 1
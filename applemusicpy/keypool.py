@@ -0,0 +1,160 @@
+import threading
+import time
+
+from .auth import sign_token
+from .deadlines import wait_allowed
+from .scheduling import TokenBucket
+
+
+class DeveloperKey:
+    """
+    One developer key in a KeyPool, with its own signed token, rate budget and health state
+    """
+
+    def __init__(self, secret_key, key_id, team_id, rate=None, session_length=12):
+        """
+        :param secret_key: Secret Key provided by Apple
+        :param key_id: Key ID provided by Apple
+        :param team_id: Team ID provided by Apple
+        :param rate: Requests per second this key may send, or None for no limit
+        :param session_length: Length the token is valid, in hours
+        """
+        self._secret_key = secret_key
+        self.key_id = key_id
+        self.team_id = team_id
+        self.session_length = session_length
+        self.token_str = ''
+        self.token_valid_until = None
+        self.bucket = TokenBucket(rate) if rate else None
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.consecutive_throttles = 0
+        self.cooldown_until = 0
+        self._token_lock = threading.Lock()
+
+    def auth_headers(self):
+        """
+        :return: Authorization header for this key, signing a new token if the current one expired
+        """
+        from datetime import datetime
+
+        with self._token_lock:
+            if self.token_valid_until is None or datetime.now() > self.token_valid_until:
+                self.token_str, self.token_valid_until = sign_token(self._secret_key, self.key_id, self.team_id,
+                                                                    self.session_length)
+        return {'Authorization': 'Bearer {}'.format(self.token_str)}
+
+    def headroom(self):
+        """
+        :return: How much more traffic this key can take right now, higher is better: keys that can send
+            without waiting for their budget to refill rank first, then keys with fewer requests in flight
+        """
+        ready = self.bucket is None or self.bucket.available() >= 1
+        return ready, -self.in_flight
+
+
+class KeyPool:
+    """
+    Spreads requests across several developer keys.
+
+    Each request is routed to the key with the most headroom. A key that answers 401/403 or keeps
+    answering 429 is taken out of rotation for a while, and returns automatically afterwards.
+    """
+
+    def __init__(self, keys, rate_per_key=None, session_length=12, throttle_threshold=3, throttle_cooldown=60,
+                 auth_cooldown=600):
+        """
+        :param keys: List of DeveloperKey instances, or dictionaries with secret_key, key_id and team_id and
+            optionally rate and session_length, which override rate_per_key and session_length for that key
+        :param rate_per_key: Requests per second each key may send, or None for no limit
+        :param session_length: Length tokens are valid, in hours
+        :param throttle_threshold: Consecutive 429 responses that take a key out of rotation
+        :param throttle_cooldown: Seconds a throttled key stays out of rotation
+        :param auth_cooldown: Seconds a key answering 401/403 stays out of rotation
+        """
+        self.keys = [k if isinstance(k, DeveloperKey) else
+                     DeveloperKey(**dict({'rate': rate_per_key, 'session_length': session_length}, **k))
+                     for k in keys]
+        if not self.keys:
+            raise ValueError('A key pool needs at least one key')
+        self.throttle_threshold = throttle_threshold
+        self.throttle_cooldown = throttle_cooldown
+        self.auth_cooldown = auth_cooldown
+        self._lock = threading.Lock()
+
+    def config(self):
+        """
+        Picklable configuration of this pool, used to rebuild it in another process. Counters, cooldowns and
+        tokens are not included.
+
+        :return: Dictionary of constructor arguments
+        """
+        return {
+            'keys': [{'secret_key': k._secret_key, 'key_id': k.key_id, 'team_id': k.team_id,
+                      'rate': k.bucket.rate if k.bucket is not None else None, 'session_length': k.session_length}
+                     for k in self.keys],
+            'throttle_threshold': self.throttle_threshold,
+            'throttle_cooldown': self.throttle_cooldown,
+            'auth_cooldown': self.auth_cooldown,
+        }
+
+    def acquire(self):
+        """
+        Pick the key with the most headroom, waiting if every key is cooling down or out of budget.
+        Raises DeadlineExceeded if the wait would pass the current deadline.
+
+        :return: DeveloperKey to send the request with, pass it to release afterwards
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                available = [k for k in self.keys if k.cooldown_until <= now]
+                if not available:
+                    wait = min(k.cooldown_until for k in self.keys) - now
+                else:
+                    key = max(available, key=lambda k: (*k.headroom(), -k.requests))  # ties go to the least used
+                    wait = key.bucket.take() if key.bucket is not None else 0
+                    if wait == 0:
+                        key.in_flight += 1
+                        key.requests += 1
+                        return key
+            wait_allowed(wait)
+            time.sleep(wait)
+
+    def available(self):
+        """
+        :return: Whether any key is in rotation right now
+        """
+        with self._lock:
+            now = time.monotonic()
+            return any(k.cooldown_until <= now for k in self.keys)
+
+    def release(self, key, status=None):
+        """
+        Report the outcome of a request sent with a key
+
+        :param key: DeveloperKey returned by acquire
+        :param status: HTTP status code of the response, or None if no response was received
+        """
+        with self._lock:
+            key.in_flight -= 1
+            if status in (401, 403):
+                key.cooldown_until = time.monotonic() + self.auth_cooldown
+            elif status == 429:
+                key.throttled += 1
+                key.consecutive_throttles += 1
+                if key.consecutive_throttles >= self.throttle_threshold:
+                    key.cooldown_until = time.monotonic() + self.throttle_cooldown
+                    key.consecutive_throttles = 0
+            elif status is not None:
+                key.consecutive_throttles = 0
+
+    def stats(self):
+        """
+        :return: Dictionary of key ID to request count, 429 count and seconds left out of rotation
+        """
+        with self._lock:
+            now = time.monotonic()
+            return {k.key_id: {'requests': k.requests, 'throttled': k.throttled,
+                               'cooldown': max(0, k.cooldown_until - now)} for k in self.keys}
@@ -0,0 +1,185 @@
+from collections import OrderedDict
+
+# Maximum number of IDs the API accepts in one multiple resource request
+MAX_IDS = {
+    'songs': 300,
+    'albums': 100,
+    'music-videos': 100,
+    'stations': 100,
+}
+DEFAULT_MAX_IDS = 25
+
+
+def normalize_shape(shape):
+    """
+    Normalize a shape description to nested dictionaries of relationship name to sub-shape
+
+    :param shape: Nested dictionary (e.g. {'tracks': {'artists': {}}}), a dotted path (e.g. 'tracks.artists')
+        or a list of either
+
+    :return: Nested dictionary
+    """
+    if shape is None:
+        return {}
+    if isinstance(shape, str):
+        shape = [shape]
+    if isinstance(shape, dict):
+        return {relationship: normalize_shape(sub_shape) for relationship, sub_shape in shape.items()}
+    normalized = {}
+    for item in shape:
+        if isinstance(item, dict):
+            for relationship, sub_shape in normalize_shape(item).items():
+                _merge_shape(normalized.setdefault(relationship, {}), sub_shape)
+            continue
+        node = normalized
+        for relationship in item.split('.'):
+            node = node.setdefault(relationship, {})
+    return normalized
+
+
+def _merge_shape(target, shape):
+    for relationship, sub_shape in shape.items():
+        _merge_shape(target.setdefault(relationship, {}), sub_shape)
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class QueryPlanner:
+    """
+    Fetches an object graph described by a shape (e.g. albums with their tracks and the tracks' artists)
+    with as few requests as possible.
+
+    Each level of the shape is one round: the resources of that level are requested with ids= batches
+    sized to the API maximum, with include= for their relationships, and the batches are sent concurrently.
+    Related resources that need no further relationships are taken from the included data, so only levels
+    that go deeper cost another round. Truncated relationships are completed with AppleMusic.fetch_all.
+    """
+
+    def __init__(self, client):
+        """
+        :param client: AppleMusic client used for the requests
+        """
+        self.client = client
+        self.incomplete = []
+
+    def fetch(self, resource_type, ids, shape, storefront='us', l=None, fields=None):
+        """
+        Fetch resources and the relationships described by shape, and link them into an object graph
+
+        :param resource_type: Resource type of the root resources (e.g. "albums")
+        :param ids: IDs of the root resources
+        :param shape: Relationships to fetch, see normalize_shape
+        :param storefront: Apple Music store front
+        :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+
+        :return: Dictionary with the root resources in data, in the order of ids. Relationship data lists hold
+            the fetched resources themselves, shared between parents. Resources that ran out of deadline are
+            listed in meta as incomplete
+        """
+        shape = normalize_shape(shape)
+        store = {}  # (type, id) -> resource
+        shapes = {}  # (type, id) -> shape the resource was fetched with
+        level = OrderedDict(((resource_type, str(i)), shape) for i in ids)
+
+        while level:
+            fetched = self._fetch_level(level, storefront, l, fields)
+            next_level = OrderedDict()
+            truncated = []
+            for key, resource in fetched.items():
+                self._store(store, key, resource)
+                shapes[key] = level.get(key, {})
+                for relationship, sub_shape in shapes[key].items():
+                    related = resource.get('relationships', {}).get(relationship)
+                    if related is None:
+                        continue
+                    if related.get('next'):
+                        truncated.append((key, relationship))
+                    for item in related.get('data', []):
+                        self._queue(store, shapes, next_level, item, sub_shape)
+            for key, relationship, data in self._complete(truncated, storefront, l, fields):
+                store[key]['relationships'][relationship] = {'data': data}
+                for item in data:
+                    self._queue(store, shapes, next_level, item, shapes[key][relationship])
+            level = next_level
+
+        for key, shape in shapes.items():
+            relationships = store[key].get('relationships', {})
+            for relationship in shape:
+                if relationship in relationships:
+                    relationships[relationship]['data'] = [store.get((item['type'], item['id']), item)
+                                                           for item in relationships[relationship].get('data', [])]
+        data = [store[(resource_type, str(i))] for i in ids if (resource_type, str(i)) in store]
+        if self.incomplete:
+            return {'data': data, 'meta': {'incomplete': self.incomplete}}
+        return {'data': data}
+
+    @staticmethod
+    def _store(store, key, resource):
+        # Relationships are linked in place, so the stored resource and its relationship objects are copies:
+        # the fetched ones may be shared with the response cache
+        relationships = {name: dict(related) for name, related in resource.get('relationships', {}).items()}
+        existing = store.get(key)
+        if existing is None:
+            resource = dict(resource)
+            if relationships:
+                resource['relationships'] = relationships
+            store[key] = resource
+            return
+        for name, value in resource.items():
+            if name == 'relationships':
+                existing.setdefault('relationships', {}).update(relationships)
+            else:
+                existing[name] = value
+
+    @staticmethod
+    def _queue(store, shapes, next_level, item, sub_shape):
+        key = (item['type'], item['id'])
+        if sub_shape:
+            if key not in shapes and key not in next_level:
+                next_level[key] = sub_shape
+        elif 'attributes' in item:
+            QueryPlanner._store(store, key, item)
+        elif key not in store and key not in next_level:
+            next_level[key] = {}  # included data had no attributes, fetch the resource itself
+
+    def _fetch_level(self, level, storefront, l, fields):
+        requests = []
+        by_type = OrderedDict()
+        for (resource_type, resource_id), shape in level.items():
+            include = ','.join(sorted(shape)) or None
+            by_type.setdefault((resource_type, include), []).append(resource_id)
+        for (resource_type, include), ids in by_type.items():
+            for chunk in _chunks(ids, MAX_IDS.get(resource_type, DEFAULT_MAX_IDS)):
+                requests.append((resource_type, include, chunk))
+
+        def fetch(request):
+            resource_type, include, chunk = request
+            return self.client._get_multiple_resources(chunk, resource_type, storefront=storefront, l=l,
+                                                       include=include, fields=fields)
+
+        fetched = OrderedDict()
+        results, incomplete = self.client._map_concurrent(fetch, requests, partial=True)
+        for resource_type, _, chunk in incomplete:
+            self.incomplete.extend({'id': resource_id, 'type': resource_type} for resource_id in chunk)
+        for result in results:
+            for resource in (result or {}).get('data', []):
+                fetched[(resource['type'], resource['id'])] = resource
+        return fetched
+
+    def _complete(self, truncated, storefront, l, fields):
+        def fetch(item):
+            (resource_type, resource_id), relationship = item
+            result = self.client.fetch_all(resource_type, resource_id, relationship, storefront=storefront, l=l,
+                                           fields=fields)
+            if 'incomplete_offsets' in result['meta'] or 'next' in result['meta']:
+                self.incomplete.append({'id': resource_id, 'type': resource_type, 'relationship': relationship})
+            return result['data']
+
+        pages, incomplete = self.client._map_concurrent(fetch, truncated, partial=True)
+        for (resource_type, resource_id), relationship in incomplete:
+            self.incomplete.append({'id': resource_id, 'type': resource_type, 'relationship': relationship})
+        return [(key, relationship, data) for (key, relationship), data in zip(truncated, pages) if data is not None]
@@ -0,0 +1,230 @@
+import json
+import os
+import threading
+import time
+
+from .scheduling import BULK, current_priority
+
+SNAPSHOT_VERSION = 1
+
+
+class _Index:
+    """
+    Lookup tables built from one snapshot. Never modified once built, so readers need no lock.
+    """
+
+    def __init__(self, snapshot):
+        self.fetched_at = snapshot['fetched_at']
+        self.storefronts = {storefront['id']: storefront for storefront in snapshot['storefronts']}
+        self.genres = {}
+        self.children = {}
+        for storefront, genres in snapshot['genres'].items():
+            self.genres[storefront] = {genre['id']: genre for genre in genres}
+            children = self.children[storefront] = {}
+            for genre in genres:
+                parent_id = genre.get('attributes', {}).get('parentId')
+                if parent_id is not None:
+                    children.setdefault(parent_id, []).append(genre['id'])
+
+
+class ReferenceData:
+    """
+    Indexed in-memory copy of the near-static reference data: all storefronts, and the genre tree of a set of
+    storefronts. Loaded from a snapshot file if there is one, refreshed from the API when the copy is older
+    than refresh_interval, and written back to the snapshot file after each refresh.
+
+    Lookups are dictionary reads on the current index, which a refresh replaces in one assignment.
+    """
+
+    def __init__(self, client, path=None, storefronts=('us',), refresh_interval=7 * 86400, retry_interval=600):
+        """
+        :param client: AppleMusic client used for refreshes
+        :param path: Snapshot file to load at startup and save after each refresh, or None to keep it in memory
+        :param storefronts: Storefronts whose genres are kept
+        :param refresh_interval: Seconds after which the copy is refreshed
+        :param retry_interval: Seconds to wait before retrying a failed background refresh
+        """
+        self.client = client
+        self.path = path
+        self.storefront_ids = list(storefronts)
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.last_error = None
+        self._index = None
+        self._snapshot = None
+        self._stop = threading.Event()
+        self._thread = None
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @property
+    def loaded(self):
+        return self._index is not None
+
+    @property
+    def age(self):
+        """
+        Seconds since the data was fetched from the API, or None if nothing is loaded
+        """
+        index = self._index
+        return None if index is None else time.time() - index.fetched_at
+
+    def load(self, path):
+        """
+        Load a snapshot file written by save
+        """
+        with open(path, encoding='utf-8') as f:
+            snapshot = json.load(f)
+        if snapshot.get('version') != SNAPSHOT_VERSION:
+            raise ValueError('Unsupported reference data snapshot version: {}'.format(snapshot.get('version')))
+        self._index = _Index(snapshot)
+        self._snapshot = snapshot
+
+    def save(self, path):
+        """
+        Write the current data to a snapshot file. The file is replaced in one rename, so a process
+        loading it at the same time never reads a partial snapshot.
+        """
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self._snapshot, f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(tmp, path)
+
+    def _fetch_pages(self, url):
+        data = []
+        offset = 0
+        while True:
+            page = self.client._get(url, limit=100, offset=offset or None)
+            data.extend(page.get('data', []))
+            if not page.get('next') or not page.get('data'):
+                return data
+            offset += len(page['data'])
+
+    def refresh(self):
+        """
+        Fetch all reference data from the API, swap it in, and save it to the snapshot file if there is one
+        """
+        root = self.client.root
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'fetched_at': time.time(),
+            'storefronts': self._fetch_pages(root + 'storefronts'),
+            'genres': {storefront: self._fetch_pages(root + 'catalog/{}/genres'.format(storefront))
+                       for storefront in self.storefront_ids},
+        }
+        self._index = _Index(snapshot)
+        self._snapshot = snapshot
+        if self.path is not None:
+            self.save(self.path)
+
+    def start(self):
+        """
+        Refresh in a background thread whenever the data is missing or older than refresh_interval
+        """
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='applemusicpy-reference-data', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        scheduler = self.client.scheduler
+        if scheduler is None or BULK in getattr(scheduler, 'weights', (BULK,)):
+            current_priority.set(BULK)  # this thread's own context, so callers' requests are unaffected
+        while not self._stop.is_set():
+            age = self.age
+            wait = 0 if age is None else self.refresh_interval - age
+            if self._stop.wait(max(0, wait)):
+                return
+            try:
+                self.refresh()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = e
+                if self._stop.wait(self.retry_interval):
+                    return
+
+    # Lookups, each returning None when the data is not loaded or has no such entry
+    def storefront(self, storefront_id):
+        """
+        :return: Storefront resource
+        """
+        index = self._index
+        return None if index is None else index.storefronts.get(storefront_id)
+
+    def storefronts(self):
+        """
+        :return: List of all storefront resources
+        """
+        index = self._index
+        return None if index is None else list(index.storefronts.values())
+
+    def languages(self, storefront_id):
+        """
+        :return: Language tags supported by a storefront, the default first
+        """
+        storefront = self.storefront(storefront_id)
+        if storefront is None:
+            return None
+        attributes = storefront.get('attributes', {})
+        default = attributes.get('defaultLanguageTag')
+        tags = [tag for tag in attributes.get('supportedLanguageTags', []) if tag != default]
+        return [default] + tags if default else tags
+
+    def default_language(self, storefront_id):
+        """
+        :return: Default language tag of a storefront
+        """
+        storefront = self.storefront(storefront_id)
+        return None if storefront is None else storefront.get('attributes', {}).get('defaultLanguageTag')
+
+    def genre(self, genre_id, storefront='us'):
+        """
+        :return: Genre resource
+        """
+        index = self._index
+        if index is None or storefront not in index.genres:
+            return None
+        return index.genres[storefront].get(str(genre_id))
+
+    def genres(self, storefront='us'):
+        """
+        :return: List of all genre resources of a storefront
+        """
+        index = self._index
+        if index is None or storefront not in index.genres:
+            return None
+        return list(index.genres[storefront].values())
+
+    def parent(self, genre_id, storefront='us'):
+        """
+        :return: Parent genre resource, None for a top level genre
+        """
+        genre = self.genre(genre_id, storefront)
+        if genre is None:
+            return None
+        parent_id = genre.get('attributes', {}).get('parentId')
+        return None if parent_id is None else self.genre(parent_id, storefront)
+
+    def children(self, genre_id, storefront='us'):
+        """
+        :return: List of the child genre resources
+        """
+        index = self._index
+        if index is None or storefront not in index.genres:
+            return None
+        genres = index.genres[storefront]
+        return [genres[child_id] for child_id in index.children[storefront].get(str(genre_id), [])]
+
+    def ancestors(self, genre_id, storefront='us'):
+        """
+        :return: List of genre resources from the parent up to the top level genre
+        """
+        ancestors = []
+        genre = self.parent(genre_id, storefront)
+        while genre is not None and genre not in ancestors:
+            ancestors.append(genre)
+            genre = self.parent(genre['id'], storefront)
+        return ancestors
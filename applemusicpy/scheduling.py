@@ -0,0 +1,133 @@
+from contextvars import ContextVar
+import heapq
+import itertools
+import threading
+import time
+
+from .deadlines import check, remaining, wait_allowed
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+DEFAULT_WEIGHTS = {INTERACTIVE: 10, BULK: 1}
+
+# Priority class of the API calls made in the current context, see AppleMusic.priority
+current_priority = ContextVar('applemusicpy_priority', default=INTERACTIVE)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Not thread-safe on its own, callers hold a lock.
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: Tokens added per second
+        :param burst: Maximum number of tokens the bucket holds, defaults to one second's worth
+        """
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self):
+        """
+        :return: Number of tokens currently in the bucket
+        """
+        self._refill()
+        return self._tokens
+
+    def take(self):
+        """
+        Take a token if one is available
+
+        :return: 0 if a token was taken, otherwise the number of seconds until one is available
+        """
+        self._refill()
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+
+class PriorityScheduler:
+    """
+    Shares one rate budget between priority classes using weighted fair queuing.
+
+    Every request takes a token from a shared bucket. When requests are waiting, tokens go to the waiter
+    with the smallest virtual finish time, so each class gets a share of the budget proportional to its
+    weight while it has a backlog, and a class with no backlog leaves its share to the others.
+    With the default weights an interactive request queued behind a long bulk backlog is served next.
+    """
+
+    def __init__(self, rate, burst=None, weights=None):
+        """
+        :param rate: Requests per second allowed across all classes
+        :param burst: Number of requests that may be sent back to back after an idle period
+        :param weights: Dictionary of priority class to weight, defaults to {'interactive': 10, 'bulk': 1}
+        """
+        self.rate = rate
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        for priority, weight in self.weights.items():
+            if weight <= 0:
+                raise ValueError('Weight for priority {} must be positive'.format(priority))
+        self._bucket = TokenBucket(rate, burst)
+        self._cond = threading.Condition()
+        self._waiting = []  # heap of (finish, seq, start)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {priority: 0.0 for priority in self.weights}
+        self._granted = {priority: 0 for priority in self.weights}
+
+    def validate(self, priority):
+        if priority not in self.weights:
+            raise ValueError('Unknown priority class: {}. Expected one of {}'.format(
+                priority, ', '.join(sorted(self.weights))))
+
+    def acquire(self, priority=INTERACTIVE):
+        """
+        Block until a request of the given priority class may be sent.
+        Raises DeadlineExceeded if the current deadline passes first.
+
+        :param priority: Priority class
+        """
+        self.validate(priority)
+        with self._cond:
+            start = max(self._virtual_time, self._last_finish[priority])
+            finish = start + 1.0 / self.weights[priority]
+            self._last_finish[priority] = finish
+            ticket = (finish, next(self._seq), start)
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if self._waiting[0] is ticket:
+                        wait = self._bucket.take()
+                        if wait == 0:
+                            heapq.heappop(self._waiting)
+                            self._virtual_time = start
+                            self._granted[priority] += 1
+                            self._cond.notify_all()
+                            return
+                        wait_allowed(wait)
+                        self._cond.wait(wait)
+                    else:
+                        check()
+                        self._cond.wait(remaining())
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                    self._cond.notify_all()
+                raise
+
+    def stats(self):
+        """
+        :return: Dictionary with the number of requests granted per class and the current queue depth
+        """
+        with self._cond:
+            return {'granted': dict(self._granted), 'waiting': len(self._waiting)}
@@ -0,0 +1,199 @@
+import bisect
+import hashlib
+import multiprocessing
+import os
+import queue as queue_module
+import time
+
+from .deadlines import wait_allowed
+
+_DONE = '__done__'
+_ERROR = '__error__'
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+class HashRing:
+    """
+    Consistent hash ring that assigns items to shards. Adding or removing a shard only moves the items
+    that hashed to it, so the same IDs keep landing on the same worker between runs.
+    """
+
+    def __init__(self, shards, replicas=64):
+        """
+        :param shards: List of shard names
+        :param replicas: Virtual nodes per shard, more gives a more even split
+        """
+        self._ring = sorted((_hash('{}-{}'.format(shard, n)), shard) for shard in shards for n in range(replicas))
+        self._keys = [h for h, _ in self._ring]
+
+    def shard_for(self, item):
+        """
+        :param item: Item to place, usually an ID
+
+        :return: Name of the shard the item belongs to
+        """
+        index = bisect.bisect(self._keys, _hash(item)) % len(self._ring)
+        return self._ring[index][1]
+
+    def split(self, items):
+        """
+        :param items: Iterable of items
+
+        :return: Dictionary of shard name to the list of its items, in input order
+        """
+        shards = {shard: [] for _, shard in self._ring}
+        for item in items:
+            shards[self.shard_for(item)].append(item)
+        return shards
+
+
+class SharedRateLimiter:
+    """
+    Token bucket shared by every process it is handed to, so a sharded crawl stays within one rate limit.
+    Can be passed as rate_limit to AppleMusic.
+    """
+
+    def __init__(self, rate, burst=None, context=None):
+        """
+        :param rate: Requests per second allowed across all processes
+        :param burst: Number of requests that may be sent back to back after an idle period
+        :param context: multiprocessing context the workers are started from
+        """
+        context = context or multiprocessing
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1, rate))
+        self._state = context.Array('d', [self.capacity, time.time()])  # tokens, last refill
+
+    def validate(self, priority):
+        pass  # priority classes are not distinguished across processes
+
+    def acquire(self, priority=None):
+        """
+        Block until a request may be sent
+
+        :param priority: Ignored, accepted for compatibility with PriorityScheduler
+        """
+        while True:
+            with self._state.get_lock():
+                now = time.time()
+                tokens = min(self.capacity, self._state[0] + (now - self._state[1]) * self.rate)
+                self._state[1] = now
+                if tokens >= 1:
+                    self._state[0] = tokens - 1
+                    return
+                self._state[0] = tokens
+                wait = (1 - tokens) / self.rate
+            wait_allowed(wait)
+            time.sleep(wait)
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _shard_worker(config, rate_limiter, method, items, batch_size, postprocess, kwargs, queue):
+    from .client import AppleMusic
+
+    if rate_limiter is not None:
+        am = AppleMusic.from_config(config, rate_limit=rate_limiter)
+    else:
+        am = AppleMusic.from_config(config)
+    call = getattr(am, method)
+    for batch in _batches(items, batch_size):
+        try:
+            result = call(batch if batch_size > 1 else batch[0], **kwargs)
+            if postprocess is not None:
+                result = postprocess(result)
+            queue.put((batch, result))
+        except Exception as e:
+            queue.put((_ERROR, batch, '{}: {}'.format(type(e).__name__, e)))
+    queue.put((_DONE, os.getpid()))
+
+
+class ShardedExecutor:
+    """
+    Runs a client method over a large set of IDs in several worker processes.
+
+    IDs are split between workers by consistent hash. Every worker builds its own client from a picklable
+    config, reuses the token the parent already signed and shares one rate limit with the other workers.
+    Decoding and post-processing happen in the workers, and results are streamed back to the parent as
+    they are produced.
+    """
+
+    def __init__(self, client, processes=None, rate_limit=None, start_method=None, queue_size=1000):
+        """
+        :param client: AppleMusic client, or a config dictionary from AppleMusic.config()
+        :param processes: Number of worker processes, defaults to the CPU count
+        :param rate_limit: Requests per second shared by all workers. Defaults to the client's own rate limit,
+            so the workers together stay within it
+        :param start_method: multiprocessing start method ('fork', 'spawn' or 'forkserver')
+        :param queue_size: Maximum number of results waiting for the parent before workers block
+        """
+        self.config = client if isinstance(client, dict) else client.config()
+        self.processes = processes or os.cpu_count() or 1
+        self._context = multiprocessing.get_context(start_method)
+        if rate_limit is None and isinstance(self.config.get('rate_limit'), (int, float)):
+            rate_limit = self.config['rate_limit']
+        self.rate_limiter = SharedRateLimiter(rate_limit, context=self._context) if rate_limit else None
+        self.queue_size = queue_size
+        self.errors = []
+
+    def map(self, method, ids, batch_size=1, postprocess=None, **kwargs):
+        """
+        Call a client method for every ID, e.g. executor.map('songs', song_ids, batch_size=300)
+
+        :param method: Name of the AppleMusic method to call
+        :param ids: IDs to call it with
+        :param batch_size: Number of IDs passed per call. 1 calls the method with a single ID,
+            larger values pass a list to multi-ID methods such as songs or albums
+        :param postprocess: Picklable function applied to each result inside the worker
+        :param kwargs: Additional arguments for the method (e.g. storefront, fields)
+
+        :return: Generator of (IDs, result) tuples in completion order. Failed batches are recorded in
+            self.errors as (IDs, error message) tuples instead, as are the IDs of a worker that exited
+            before finishing its shard
+        """
+        ring = HashRing(['shard-{}'.format(n) for n in range(self.processes)])
+        shards = [items for items in ring.split(ids).values() if items]
+        queue = self._context.Queue(maxsize=self.queue_size)
+        workers = [self._context.Process(target=_shard_worker,
+                                         args=(self.config, self.rate_limiter, method, items, batch_size,
+                                               postprocess, kwargs, queue),
+                                         daemon=True)
+                   for items in shards]
+        for worker in workers:
+            worker.start()
+        finished = set()
+        handled = set()
+        try:
+            while len(finished) < len(workers):
+                try:
+                    message = queue.get(timeout=1)
+                except queue_module.Empty:
+                    if not any(worker.is_alive() for worker in workers):
+                        break  # a worker died without reporting
+                    continue
+                if message[0] == _DONE:
+                    finished.add(message[1])
+                elif message[0] == _ERROR:
+                    handled.update(message[1])
+                    self.errors.append((message[1], message[2]))
+                else:
+                    handled.update(message[0])
+                    yield message
+            for worker, items in zip(workers, shards):
+                if worker.pid not in finished:
+                    worker.join()
+                    unfinished = [item for item in items if item not in handled]
+                    if unfinished:
+                        self.errors.append((unfinished, 'Worker exited with code {} before finishing its shard'
+                                            .format(worker.exitcode)))
+        finally:
+            for worker in workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
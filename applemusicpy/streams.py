@@ -0,0 +1,144 @@
+import contextvars
+import queue
+import threading
+
+_ITEM = 0
+_END = 1
+_ERROR = 2
+
+
+class ResultStream:
+    """
+    Bounded stream of results, consumed as a sync or an async iterator. A background thread pulls results from
+    a source iterator (e.g. AppleMusic.iter_resources) into a queue of at most maxsize items and blocks while
+    the queue is full, so a slow consumer throttles how fast pages and batches are fetched instead of letting
+    them pile up in memory. The thread runs in a copy of the creating context, so the priority class and
+    deadline carry over to its requests. Errors of the source are raised to the consumer.
+
+        with am.stream_resources('songs', song_ids, maxsize=500) as stream:
+            for song in stream:
+                db.write(song)
+
+        async with am.stream_relationship('playlists', playlist_id, 'tracks') as stream:
+            async for track in stream:
+                await db.write(track)
+    """
+
+    def __init__(self, source, maxsize=1000):
+        """
+        :param source: Iterable of results, consumed in the background thread
+        :param maxsize: Maximum number of results buffered ahead of the consumer
+        """
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.produced = 0
+        self.consumed = 0
+        self._queue = queue.Queue(maxsize)
+        self._closed = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=contextvars.copy_context().run, args=(self._produce, source),
+                                        name='applemusicpy-stream', daemon=True)
+        self._thread.start()
+
+    def _put(self, entry):
+        while not self._closed.is_set():
+            try:
+                self._queue.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self, source):
+        iterator = iter(source)
+        try:
+            for item in iterator:
+                self.produced += 1
+                if not self._put((_ITEM, item)):
+                    return
+            self._put((_END, None))
+        except BaseException as e:
+            self._put((_ERROR, e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def _next(self):
+        # (kind, value) of the next entry, blocking until the producer has one
+        if self._done:
+            return _END, None
+        kind, value = self._queue.get()
+        if kind == _ITEM:
+            self.consumed += 1
+        else:
+            self._done = True
+            self._closed.set()
+        return kind, value
+
+    @property
+    def buffered(self):
+        """
+        Number of results fetched and waiting for the consumer
+        """
+        return self._queue.qsize()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        kind, value = self._next()
+        if kind == _ERROR:
+            raise value
+        if kind == _END:
+            raise StopIteration
+        return value
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        import asyncio
+
+        if not self._done and self._queue.empty():
+            kind, value = await asyncio.get_running_loop().run_in_executor(None, self._next)
+        else:  # an entry is ready, take it without a round trip through the executor
+            kind, value = self._next()
+        if kind == _ERROR:
+            raise value
+        if kind == _END:
+            raise StopAsyncIteration
+        return value
+
+    def close(self):
+        """
+        Stop fetching and drop the buffered results. The source is closed by the background thread once its
+        current request returns.
+        """
+        self._closed.set()
+        self._done = True
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        try:
+            self._queue.put_nowait((_END, None))  # wakes a consumer blocked in another thread
+        except queue.Full:
+            pass
+
+    async def aclose(self):
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
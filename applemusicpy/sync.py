@@ -0,0 +1,238 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+from .planner import DEFAULT_MAX_IDS, MAX_IDS, _chunks
+
+NEW = 'new'
+CHANGED = 'changed'
+REMOVED = 'removed'
+
+
+def fingerprint(resource, ignore=()):
+    """
+    Content hash of a resource, over its attributes and the IDs its relationships point to
+
+    :param resource: Resource as returned by the API
+    :param ignore: Attribute names left out of the hash (e.g. ones that change on every fetch)
+
+    :return: 16 byte digest
+    """
+    attributes = {name: value for name, value in resource.get('attributes', {}).items() if name not in ignore}
+    relationships = {name: [(item.get('type'), item.get('id')) for item in related.get('data', [])]
+                     for name, related in resource.get('relationships', {}).items()}
+    normalized = json.dumps([attributes, relationships], sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+
+
+class FingerprintStore:
+    """
+    SQLite table of the resources being synced: one row per storefront, type and ID with the content hash
+    of the last fetch, when it was fetched and last changed, and a popularity score used for scheduling.
+    A removed resource keeps its row with no hash, so it is reported as new if it comes back.
+    """
+
+    def __init__(self, path=':memory:'):
+        """
+        :param path: SQLite database file, or ':memory:'
+        """
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS fingerprints ('
+                             'storefront TEXT NOT NULL, type TEXT NOT NULL, id TEXT NOT NULL, hash BLOB, '
+                             'fetched_at REAL, changed_at REAL, popularity REAL NOT NULL DEFAULT 0, '
+                             'PRIMARY KEY (storefront, type, id)) WITHOUT ROWID')
+
+    def track(self, storefront, resource_type, ids, popularity=None):
+        """
+        Add resources to the sync, or update their popularity
+
+        :param storefront: Apple Music storefront
+        :param resource_type: Resource type (e.g. "songs")
+        :param ids: Resource IDs
+        :param popularity: Score from 0 to 1 for all IDs, or a dictionary of ID to score. Higher scores are
+            refreshed more often
+        """
+        rows = []
+        for resource_id in ids:
+            score = popularity.get(resource_id, 0) if isinstance(popularity, dict) else popularity or 0
+            rows.append((storefront, resource_type, str(resource_id), min(1.0, max(0.0, float(score)))))
+        with self._lock, self._db:
+            self._db.executemany('INSERT INTO fingerprints (storefront, type, id, popularity) VALUES (?, ?, ?, ?) '
+                                 'ON CONFLICT (storefront, type, id) DO UPDATE SET popularity = excluded.popularity',
+                                 rows)
+
+    def untrack(self, storefront, resource_type, ids):
+        with self._lock, self._db:
+            self._db.executemany('DELETE FROM fingerprints WHERE storefront = ? AND type = ? AND id = ?',
+                                 [(storefront, resource_type, str(resource_id)) for resource_id in ids])
+
+    def hashes(self, storefront, resource_type, ids):
+        """
+        :return: Dictionary of ID to the stored hash, None for resources not fetched yet or removed
+        """
+        result = {}
+        with self._lock:
+            for chunk in _chunks([str(resource_id) for resource_id in ids], 500):
+                rows = self._db.execute('SELECT id, hash FROM fingerprints WHERE storefront = ? AND type = ? '
+                                        'AND id IN ({})'.format(','.join('?' * len(chunk))),
+                                        [storefront, resource_type] + chunk)
+                result.update(rows)
+        return result
+
+    def due(self, storefront, resource_type, now, min_age, max_age):
+        """
+        IDs due for a refresh, most overdue first. A resource's refresh interval goes from max_age at
+        popularity 0 down to min_age at popularity 1, and resources never fetched come first.
+
+        :return: List of IDs
+        """
+        query = ('SELECT id FROM fingerprints WHERE storefront = ? AND type = ? AND (fetched_at IS NULL OR '
+                 '? - fetched_at >= ? - (? - ?) * popularity) '
+                 'ORDER BY fetched_at IS NOT NULL, (? - fetched_at) / (? - (? - ?) * popularity) DESC')
+        params = [storefront, resource_type, now, max_age, max_age, min_age, now, max_age, max_age, min_age]
+        with self._lock:
+            return [row[0] for row in self._db.execute(query, params)]
+
+    def record(self, storefront, resource_type, fetched, now):
+        """
+        Store the outcome of a refresh
+
+        :param fetched: Dictionary of ID to its new hash (None if the resource is gone) and whether it changed
+        """
+        rows = [(digest, now, now if changed else None, storefront, resource_type, resource_id)
+                for resource_id, (digest, changed) in fetched.items()]
+        with self._lock, self._db:
+            self._db.executemany('UPDATE fingerprints SET hash = ?, fetched_at = ?, '
+                                 'changed_at = COALESCE(?, changed_at) '
+                                 'WHERE storefront = ? AND type = ? AND id = ?', rows)
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM fingerprints').fetchone()[0]
+
+    def close(self):
+        self._db.close()
+
+
+class CatalogSync:
+    """
+    Keeps a local mirror of catalog resources up to date without re-downloading all of it.
+
+    Each run refreshes the tracked resources that are due, in multiple resource requests sized to the API
+    maximum, and compares the content hash of each one with the stored fingerprint. Only new, changed and
+    removed resources are emitted, and max_requests bounds what a run costs: whatever is not reached stays
+    due and is picked up, most overdue first, by the next run.
+    """
+
+    def __init__(self, client, store=None, min_age=86400, max_age=30 * 86400, ignore=()):
+        """
+        :param client: AppleMusic client used for the requests
+        :param store: FingerprintStore, or the path of its database file. Defaults to an in-memory store
+        :param min_age: Seconds between refreshes of the most popular resources
+        :param max_age: Seconds between refreshes of resources with popularity 0
+        :param ignore: Attribute names that are not hashed, so changes to them are not reported
+        """
+        self.client = client
+        self.store = store if isinstance(store, FingerprintStore) else FingerprintStore(store or ':memory:')
+        self.min_age = min_age
+        self.max_age = max_age
+        self.ignore = frozenset(ignore)
+        self.stats = {}
+
+    def track(self, resource_type, ids, storefront='us', popularity=None):
+        """
+        Add resources to the sync, see FingerprintStore.track
+        """
+        self.store.track(storefront, resource_type, ids, popularity)
+
+    def run(self, resource_type, storefront='us', max_requests=None, l=None, include=None, fields=None):
+        """
+        Refresh the due resources of one type and yield the changes, e.g.
+        for change in sync.run('songs', max_requests=1000): index(change)
+
+        A changed resource's fingerprint is stored only once its change has been consumed, so stopping or
+        closing the generator part way through loses nothing: the changes not consumed are yielded again by
+        the next run.
+        Counts of the run are kept in self.stats.
+
+        :param resource_type: Resource type (e.g. "songs")
+        :param storefront: Apple Music storefront
+        :param max_requests: Maximum number of API requests to make, or None to refresh everything due
+        :param l: The localization to use, specified by a language tag. Check API documentation.
+        :param include: Relationships to fetch with each resource; their IDs are part of the fingerprint
+        :param fields: Sparse fieldsets, a dictionary mapping resource types to the attributes to return
+
+        :return: Generator of dictionaries with change ('new', 'changed' or 'removed'), type, id and resource
+            (None for removed resources)
+        """
+        batch_size = MAX_IDS.get(resource_type, DEFAULT_MAX_IDS)
+        due = self.store.due(storefront, resource_type, time.time(), self.min_age, self.max_age)
+        self.stats = {'requests': 0, 'checked': 0, NEW: 0, CHANGED: 0, REMOVED: 0, 'unchanged': 0,
+                      'remaining': len(due)}
+        if max_requests is not None:
+            due = due[:max_requests * batch_size]
+        batches = list(_chunks(due, batch_size))
+
+        def fetch(chunk):
+            return self.client._get_multiple_resources(chunk, resource_type, storefront=storefront, l=l,
+                                                       include=include, fields=fields)
+
+        # Requests go out concurrently a window of batches at a time, so a consumer that stops early
+        # doesn't pay for the whole run
+        window = max(1, self.client.max_workers)
+        for start in range(0, len(batches), window):
+            chunks = batches[start:start + window]
+            results, _ = self.client._map_concurrent(fetch, chunks, partial=True)
+            for chunk, result in zip(chunks, results):
+                if result is None:
+                    continue  # failed or ran out of deadline, stays due
+                self.stats['requests'] += 1
+                now = time.time()
+                changes, fetched = self._compare(storefront, resource_type, chunk, result)
+                self.store.record(storefront, resource_type, {resource_id: fetched[resource_id] for resource_id
+                                                              in fetched if not fetched[resource_id][1]}, now)
+                # A change counts as consumed once the consumer asks for the next one, so a change it was
+                # handed but may not have processed is yielded again by the next run
+                consumed = 0
+                try:
+                    for change in changes:
+                        yield change
+                        consumed += 1
+                finally:
+                    self.store.record(storefront, resource_type,
+                                      {change['id']: fetched[change['id']] for change in changes[:consumed]}, now)
+                    for change in changes[:consumed]:
+                        self.stats[change['change']] += 1
+
+    def _compare(self, storefront, resource_type, chunk, result):
+        """
+        :return: List of changes, and dictionary of ID to the new hash and whether it changed
+        """
+        previous = self.store.hashes(storefront, resource_type, chunk)
+        found = {str(resource['id']): resource for resource in result.get('data', [])
+                 if resource.get('type') == resource_type}
+        fetched = {}
+        changes = []
+        for resource_id in chunk:
+            old = previous.get(resource_id)
+            resource = found.get(resource_id)
+            if resource is None:
+                fetched[resource_id] = (None, old is not None)
+                if old is not None:
+                    changes.append({'change': REMOVED, 'type': resource_type, 'id': resource_id, 'resource': None})
+                continue
+            digest = fingerprint(resource, self.ignore)
+            fetched[resource_id] = (digest, digest != old)
+            if old is None:
+                changes.append({'change': NEW, 'type': resource_type, 'id': resource_id, 'resource': resource})
+            elif digest != old:
+                changes.append({'change': CHANGED, 'type': resource_type, 'id': resource_id, 'resource': resource})
+            else:
+                self.stats['unchanged'] += 1
+        self.stats['checked'] += len(chunk)
+        self.stats['remaining'] -= len(chunk)
+        return changes, fetched
@@ -0,0 +1,181 @@
+from contextvars import ContextVar
+
+from .exceptions import StreamInterrupted
+
+# (stream_to, chunk_size) while inside AppleMusic.raw, None otherwise
+raw_mode = ContextVar('applemusicpy_raw_mode', default=None)
+
+# Describe the encoded body, which raw responses no longer are
+_ENCODING_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding')
+
+
+def _accept_encoding():
+    """
+    Content codings this process can decode, best first
+
+    :return: Value for the Accept-Encoding header
+    """
+    encodings = ['gzip', 'deflate']
+    try:
+        import brotli  # noqa: F401
+        encodings.insert(0, 'br')
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+            encodings.insert(0, 'br')
+        except ImportError:
+            pass
+    return ', '.join(encodings)
+
+
+class RawResponse:
+    """
+    Undecoded response of a call made in raw mode. The body is the JSON text as the API sent it, after
+    any content encoding such as gzip was undone
+    """
+
+    def __init__(self, status_code, headers, content, bytes_written=None):
+        """
+        :param status_code: HTTP status code
+        :param headers: Response headers, without the ones describing the content encoding
+        :param content: Response body, None if it was streamed
+        :param bytes_written: Number of bytes streamed, None if the body was not streamed
+        """
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.bytes_written = bytes_written
+
+
+def read_raw(response, stream_to=None, chunk_size=65536):
+    """
+    Take the body of a response without decoding it
+
+    :param response: requests or HTTP2Response response, opened with stream=True if stream_to is given
+    :param stream_to: Writable to stream the body to in chunks, or None to keep it in memory
+    :param chunk_size: Bytes per chunk written to stream_to
+
+    :return: RawResponse
+    """
+    headers = {name: value for name, value in response.headers.items() if name.lower() not in _ENCODING_HEADERS}
+    if stream_to is None:
+        return RawResponse(response.status_code, headers, response.content)
+    written = 0
+    try:
+        if hasattr(response, 'iter_content'):
+            chunks = response.iter_content(chunk_size)
+        else:
+            content = memoryview(response.content)
+            chunks = (content[start:start + chunk_size] for start in range(0, len(content), chunk_size))
+        for chunk in chunks:
+            stream_to.write(chunk)
+            written += len(chunk)
+    except Exception as e:
+        raise StreamInterrupted(written, e) from e
+    finally:
+        if hasattr(response, 'close'):
+            response.close()
+    return RawResponse(response.status_code, headers, None, written)
+
+
+class HTTP2Response:
+    """
+    Wraps an httpx response so it behaves like the requests responses the client expects
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.url = str(response.url)
+        self.http_version = response.http_version
+
+    @property
+    def content(self):
+        return self._response.content
+
+    @property
+    def text(self):
+        return self._response.text
+
+    @property
+    def extensions(self):
+        """
+        httpx response extensions, e.g. network_stream to tell which connection answered
+        """
+        return self._response.extensions
+
+    @property
+    def num_bytes_downloaded(self):
+        """
+        Number of body bytes received on the wire, before decompression
+        """
+        return self._response.num_bytes_downloaded
+
+    def json(self):
+        return self._response.json()
+
+    def iter_content(self, chunk_size):
+        """
+        Decoded body in chunks as it arrives, for responses of requests sent with stream=True
+        """
+        return self._response.iter_bytes(chunk_size)
+
+    def raise_for_status(self):
+        from requests.exceptions import HTTPError
+
+        if 400 <= self.status_code < 600:
+            kind = 'Client' if self.status_code < 500 else 'Server'
+            raise HTTPError('{} {} Error: {} for url: {}'.format(self.status_code, kind,
+                                                                 self._response.reason_phrase, self.url),
+                            response=self)
+
+    def close(self):
+        self._response.close()
+
+
+class HTTP2Session:
+    """
+    A drop-in replacement for requests.Session that sends API calls over HTTP/2 using httpx.
+    Requests made concurrently from several threads are multiplexed over a few connections
+    instead of opening one TCP+TLS connection each.
+    """
+
+    def __init__(self, proxies=None, max_connections=4, transport=None):
+        """
+        :param proxies: A dictionary of proxies, in the same format requests uses
+        :param max_connections: Maximum number of connections kept to the API host
+        :param transport: httpx transport to send requests with instead of opening connections (e.g. an
+            httpx.MockTransport in tests). Proxies and max_connections don't apply to it
+        """
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError('HTTP/2 support requires httpx with the http2 extra: '
+                              'pip install apple-music-python[http2]')
+
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        mounts = None
+        if proxies:
+            mounts = {scheme + '://': httpx.HTTPTransport(http2=True, limits=limits, proxy=httpx.Proxy(proxy))
+                      for scheme, proxy in proxies.items()}
+        self._client = httpx.Client(http2=True, limits=limits, mounts=mounts, transport=transport,
+                                    headers={'Accept-Encoding': _accept_encoding()})
+
+    def request(self, method, url, headers=None, proxies=None, params=None, timeout=None, **kwargs):
+        """
+        Send a request, using the same signature as requests.Session.request
+
+        :param proxies: Ignored, proxies are configured when the session is created
+        :param stream: Return as soon as the headers arrive and read the body through iter_content
+
+        :return: HTTP2Response
+        """
+        if isinstance(params, dict):
+            params = {k: v for k, v in params.items() if v is not None}  # requests drops None values
+        stream = kwargs.pop('stream', False)
+        request = self._client.build_request(method, url, headers=headers, params=params, timeout=timeout, **kwargs)
+        return HTTP2Response(self._client.send(request, stream=stream))
+
+    def close(self):
+        self._client.close()
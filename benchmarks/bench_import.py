@@ -0,0 +1,56 @@
+"""
+Measure how long `import applemusicpy` and creating a client take in a fresh interpreter.
+
+Exits non-zero if a heavy dependency is imported eagerly or the median time exceeds --max-ms,
+so it can be used as a regression guard in CI.
+
+    python benchmarks/bench_import.py --runs 20 --max-ms 50
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+HEAVY_MODULES = ('requests', 'jwt', 'cryptography', 'httpx', 'datetime')
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+import applemusicpy
+am = applemusicpy.AppleMusic(secret_key='x', key_id='y', team_id='z')
+elapsed = time.perf_counter() - start
+loaded = [m for m in {heavy!r} if m in sys.modules]
+print(elapsed, ','.join(loaded))
+'''.format(heavy=HEAVY_MODULES)
+
+
+def probe():
+    out = subprocess.check_output([sys.executable, '-c', PROBE], universal_newlines=True).split()
+    return float(out[0]), out[1].split(',') if len(out) > 1 else []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=20, help='number of fresh interpreters to time')
+    parser.add_argument('--max-ms', type=float, default=None, help='fail if the median exceeds this many ms')
+    args = parser.parse_args()
+
+    times = []
+    loaded = set()
+    for _ in range(args.runs):
+        elapsed, modules = probe()
+        times.append(elapsed * 1000)
+        loaded.update(modules)
+
+    median = statistics.median(times)
+    print('import + construct: median {:.2f} ms, min {:.2f} ms, max {:.2f} ms over {} runs'.format(
+        median, min(times), max(times), args.runs))
+
+    failed = False
+    if loaded:
+        print('FAIL: heavy modules imported eagerly: {}'.format(', '.join(sorted(loaded))))
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print('FAIL: median {:.2f} ms exceeds {:.2f} ms'.format(median, args.max_ms))
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,85 @@
+"""
+Compare full song resources against a sparse fieldset on real API responses: body bytes received on the wire,
+decoded body size, request latency and JSON decode time. Each round requests the same songs once without and
+once with fields[songs], alternating so both see the same network conditions.
+
+Requires API keys in the same private_key.p8 and keys.txt files as tests.py.
+
+    python benchmarks/bench_sparse_fields.py
+    python benchmarks/bench_sparse_fields.py --rounds 50 1274153124 1436530704
+"""
+import argparse
+import json
+import statistics
+import time
+
+from applemusicpy.client import AppleMusic
+
+SONG_IDS = ['1274153124', '1436530704', '1440841363', '1440818584', '1445887536', '1451901307']
+SPARSE_FIELDS = {'songs': ['name', 'artistName', 'isrc', 'durationInMillis']}
+
+
+class Recorder:
+    """
+    Wraps a session's request method to record latency and wire bytes of the last response
+    """
+
+    def __init__(self, session):
+        self._request = session.request
+        self.latency = None
+        self.wire_bytes = None
+        session.request = self.request
+
+    def request(self, *args, **kwargs):
+        start = time.perf_counter()
+        r = self._request(*args, **kwargs)
+        _ = r.content
+        self.latency = time.perf_counter() - start
+        self.wire_bytes = r.raw.tell()  # urllib3 counts bytes read from the socket, before decoding
+        return r
+
+
+def client():
+    keys = {}
+    with open('private_key.p8', 'r') as f:
+        keys['secret'] = f.read()
+    with open('keys.txt') as f:
+        for line in f:
+            name, val = line.partition('=')[::2]
+            keys[name.strip()] = val.strip()
+    return AppleMusic(secret_key=keys['secret'], key_id=keys['keyID'], team_id=keys['teamID'])
+
+
+def measure(am, recorder, song_ids, fields):
+    with am.raw():
+        response = am.songs(song_ids, fields=fields)
+    start = time.perf_counter()
+    json.loads(response.content)
+    return recorder.wire_bytes, len(response.content), recorder.latency, time.perf_counter() - start
+
+
+def run(song_ids, rounds):
+    am = client()
+    recorder = Recorder(am._session)
+    samples = {'full': [], 'sparse': []}
+    for _ in range(rounds):
+        samples['full'].append(measure(am, recorder, song_ids, None))
+        samples['sparse'].append(measure(am, recorder, song_ids, SPARSE_FIELDS))
+
+    medians = {label: [statistics.median(sample[i] for sample in runs) for i in range(4)]
+               for label, runs in samples.items()}
+    print('{} songs, {} rounds, medians'.format(len(song_ids), rounds))
+    for label, (wire, body, latency, decode) in medians.items():
+        print('  {:<7} {:>8,} wire bytes  {:>8,} body bytes  {:>8.1f} ms latency  {:>7.3f} ms decode'.format(
+            label + ':', int(wire), int(body), latency * 1000, decode * 1000))
+    full, sparse = medians['full'], medians['sparse']
+    print('  reduction: {:.1%} wire bytes, {:.1%} body bytes, {:.1%} latency, {:.1%} decode time'.format(
+        *(1 - s / f if f else 0 for f, s in zip(full, sparse))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('song_ids', nargs='*', default=SONG_IDS, help='song IDs to request')
+    parser.add_argument('--rounds', type=int, default=20, help='requests per variant')
+    args = parser.parse_args()
+    run(args.song_ids, args.rounds)
@@ -0,0 +1,93 @@
+"""
+Compare the requests session transport with the HTTP/2 transport under concurrent catalog requests.
+
+Reports connections opened, body bytes received on the wire and request latency for each backend.
+Requires API keys in the same private_key.p8 and keys.txt files as tests.py, and the http2 extra.
+
+    python benchmarks/bench_transport.py --requests 200 --threads 32
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from applemusicpy.client import AppleMusic
+
+SONG_IDS = ['1274153124', '1436530704', '1440841363', '1440818584', '1445887536', '1451901307']
+
+
+class Recorder:
+    """
+    Wraps a session's request method to record latency and wire bytes per response
+    """
+
+    def __init__(self, session):
+        self._request = session.request
+        self._lock = threading.Lock()
+        self.latencies = []
+        self.wire_bytes = 0
+        self.streams = set()  # network streams (connections) that answered, for HTTP/2
+        session.request = self.request
+
+    def request(self, *args, **kwargs):
+        start = time.perf_counter()
+        r = self._request(*args, **kwargs)
+        _ = r.content
+        elapsed = time.perf_counter() - start
+        stream = None
+        if hasattr(r, 'num_bytes_downloaded'):
+            received = r.num_bytes_downloaded
+            stream = r.extensions.get('network_stream')
+        else:
+            received = r.raw.tell()  # urllib3 counts bytes read from the socket, before decoding
+        with self._lock:
+            self.latencies.append(elapsed)
+            self.wire_bytes += received
+            if stream is not None:
+                self.streams.add(stream)
+        return r
+
+
+def connection_count(session, recorder):
+    if recorder.streams:
+        return len(recorder.streams)
+    total = 0
+    for adapter in session.adapters.values():
+        for key in adapter.poolmanager.pools.keys():
+            total += adapter.poolmanager.pools[key].num_connections
+    return total
+
+
+def run(label, am, total, threads):
+    recorder = Recorder(am._session)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(lambda n: am.song(SONG_IDS[n % len(SONG_IDS)]), range(total)))
+    wall = time.perf_counter() - start
+    latencies = sorted(recorder.latencies)
+    print(label)
+    print('  connections opened: {}'.format(connection_count(am._session, recorder)))
+    print('  wire bytes:         {:,}'.format(recorder.wire_bytes))
+    print('  wall time:          {:.2f} s'.format(wall))
+    print('  latency p50/p99:    {:.1f} / {:.1f} ms'.format(statistics.median(latencies) * 1000,
+                                                           latencies[int(len(latencies) * 0.99) - 1] * 1000))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help='number of song lookups per backend')
+    parser.add_argument('--threads', type=int, default=32, help='concurrent callers')
+    args = parser.parse_args()
+
+    keys = {}
+    with open('private_key.p8', 'r') as f:
+        keys['secret'] = f.read()
+    with open('keys.txt') as f:
+        for line in f:
+            name, val = line.partition('=')[::2]
+            keys[name.strip()] = val.strip()
+
+    for label, http2 in (('requests session (HTTP/1.1)', False), ('httpx (HTTP/2)', True)):
+        am = AppleMusic(secret_key=keys['secret'], key_id=keys['keyID'], team_id=keys['teamID'], http2=http2)
+        run(label, am, args.requests, args.threads)
@@ -19,4 +19,11 @@ setup(
         'pyjwt>=1.7.1',
         'cryptography>=3.2'
     ],
+    extras_require={
+        'http2': ['httpx[http2]>=0.23'],
+        'parquet': ['pyarrow>=7'],
+    },
+    entry_points={
+        'console_scripts': ['applemusicpy=applemusicpy.cli:main'],
+    },
 )
@@ -1,5 +1,125 @@
 from applemusicpy import AppleMusic
+from datetime import datetime, timedelta
+from applemusicpy.cache import FileCache, NegativeCache, ResponseCache, cache_key
+from applemusicpy.cli import main as cli_main
+from applemusicpy.breaker import CircuitBreaker, CircuitBreakers, endpoint_family, CLOSED, OPEN, HALF_OPEN
+from applemusicpy.exceptions import AppleMusicError, CircuitOpenError, DeadlineExceeded, StreamInterrupted
+from applemusicpy.export import NDJSONSink, ParquetSink
+from applemusicpy.concurrency import AdaptiveLimiter
+from applemusicpy.discography import group_editions, normalize_title
+from applemusicpy.hedging import HedgePolicy
+from applemusicpy.keypool import KeyPool
+from applemusicpy.reference import ReferenceData
+from applemusicpy.scheduling import PriorityScheduler
+from applemusicpy.sharding import HashRing, ShardedExecutor
+from applemusicpy.streams import ResultStream
+from applemusicpy.sync import CatalogSync
+import asyncio
+import gzip
+import json
+import os
+import pickle
+import requests
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
+import unittest.mock
+from urllib.parse import urlsplit
+
+# The catalog tests run against recorded responses unless APPLE_MUSIC_LIVE=1 (or --live) is set.
+# Live runs read the API keys from private_key.p8 and keys.txt, and with APPLE_MUSIC_RECORD=1 (or --record)
+# write the responses they get back to the fixture file.
+LIVE = os.environ.get('APPLE_MUSIC_LIVE') == '1'
+RECORD = os.environ.get('APPLE_MUSIC_RECORD') == '1'
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'catalog.json')
+
+
+def fixture_key(method, url, params):
+    parts = urlsplit(url)
+    query = [tuple(item.split('=', 1)) for item in parts.query.split('&') if item]
+    query += [(k, str(v)) for k, v in (params or {}).items() if v is not None]
+    key = '{} {}'.format(method, parts.path)
+    if query:
+        key += '?' + '&'.join('{}={}'.format(k, v) for k, v in sorted(query))
+    return key
+
+
+class FixtureSession:
+    """
+    Stands in for requests.Session, answering with the responses recorded in the fixture file
+    and 404 for requests that were not recorded
+    """
+
+    def __init__(self, fixtures):
+        self.fixtures = fixtures
+
+    def request(self, method, url, headers=None, proxies=None, params=None, timeout=None, **kwargs):
+        body = self.fixtures.get(fixture_key(method, url, params))
+        r = requests.models.Response()
+        r.status_code = 404 if body is None else 200
+        r.url = url
+        r._content = json.dumps(body if body is not None else {'errors': []}).encode()
+        return r
+
+
+class RecordingSession(requests.Session):
+    """
+    requests.Session that keeps the successful responses it receives, keyed like FixtureSession looks them up
+    """
+
+    def __init__(self, fixtures):
+        super().__init__()
+        self.fixtures = fixtures
+
+    def request(self, method, url, params=None, **kwargs):
+        r = super().request(method, url, params=params, **kwargs)
+        if r.status_code == 200:
+            self.fixtures[fixture_key(method, url, params)] = r.json()
+        return r
+
+
+def live_client():
+    keys = {}
+
+    with open('private_key.p8', 'r') as f:
+        keys['secret'] = f.read()
+
+    with open('keys.txt') as f:
+        for line in f:
+            name, val = line.partition('=')[::2]
+            keys[name.strip()] = val.strip()
+
+    return AppleMusic(secret_key=keys['secret'], key_id=keys['keyID'], team_id=keys['teamID'])
+
+
+am = None
+fixtures = {}
+
+
+def setUpModule():
+    global am
+    if os.path.exists(FIXTURES):
+        with open(FIXTURES) as f:
+            fixtures.update(json.load(f))
+    if LIVE:
+        am = live_client()
+        if RECORD:
+            am._http_session = RecordingSession(fixtures)
+    else:
+        am = AppleMusic('x', 'y', 'z', max_retries=1)
+        am.token_str, am.token_valid_until = 'token', datetime.now() + timedelta(hours=1)
+        am._http_session = FixtureSession(fixtures)
+
+
+def tearDownModule():
+    if LIVE and RECORD:
+        os.makedirs(os.path.dirname(FIXTURES), exist_ok=True)
+        with open(FIXTURES, 'w') as f:
+            json.dump(fixtures, f, indent=1, sort_keys=True)
+            f.write('\n')
 
 
 class TestApple(unittest.TestCase):
@@ -102,6 +222,14 @@ class TestApple(unittest.TestCase):
         results = am.songs_by_isrc([self.gods_plan_isrc])
         self.assertTrue(results['data'][0]['attributes']['name'] == 'God\'s Plan')
 
+    def test_songs_fields(self):
+        results = am.songs([self.xo_tour_life, self.new_patek], fields={'songs': ['name', 'isrc']})
+        self.assertTrue(set(results['data'][0]['attributes']) <= {'name', 'isrc'})
+
+    def test_song_fields_invalid_type(self):
+        with self.assertRaises(ValueError):
+            am.song(self.xo_tour_life, fields={'song': ['name']})
+
     def test_artist(self):
         results = am.artist(self.lil_pump)
         self.assertTrue(results['data'][0]['attributes']['name'] == 'Lil Pump')
@@ -202,18 +330,1080 @@ class TestApple(unittest.TestCase):
         self.assertTrue(results['results']['songs'][0]['name'] == 'Top Songs')
 
 
-if __name__ == '__main__':
-    # These tests require API authorization, so need to read in keys
-    keys = {}
+class TestImport(unittest.TestCase):
 
-    with open('private_key.p8', 'r') as f:
-        keys['secret'] = f.read()
+    def test_import_is_lazy(self):
+        code = ('import sys, applemusicpy; applemusicpy.AppleMusic("x", "y", "z"); '
+                'print(",".join(m for m in ("requests", "jwt", "cryptography") if m in sys.modules))')
+        output = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True)
+        self.assertTrue(output.strip() == '')
 
-    with open('keys.txt') as f:
-        for line in f:
-            name, val = line.partition('=')[::2]
-            keys[name.strip()] = val.strip()
 
-    am = AppleMusic(secret_key=keys['secret'], key_id=keys['keyID'], team_id=keys['teamID'])
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow_request())
+        breaker.record_failure()
+        self.assertTrue(breaker.state == OPEN)
+        self.assertFalse(breaker.allow_request())
+
+    def test_half_open_recovery(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0)
+        breaker.record_failure()
+        self.assertTrue(breaker.state == HALF_OPEN)
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())  # only one trial request
+        breaker.record_success()
+        self.assertTrue(breaker.state == CLOSED)
+
+    def test_endpoint_family(self):
+        root = 'https://api.music.apple.com/v1/'
+        self.assertTrue(endpoint_family(root + 'catalog/us/search?term=x') == 'search')
+        self.assertTrue(endpoint_family(root + 'catalog/us/charts') == 'charts')
+        self.assertTrue(endpoint_family(root + 'catalog/us/songs/1') == 'resources')
+        self.assertTrue(endpoint_family(root + 'catalog/us/songs') == 'resources')
+        self.assertTrue(endpoint_family(root + 'catalog/us/albums/1/tracks') == 'relationships')
+        self.assertTrue(endpoint_family(root + 'catalog/us/albums/1/view/related-albums') == 'relationships')
+
+    def test_client_serves_stale_while_open(self):
+        self.failing = False
+
+        def handler(url, params):
+            if self.failing:
+                return 503, {'errors': []}
+            return 200, {'data': [{'id': url.rsplit('/', 1)[-1], 'type': 'songs'}]}
+
+        client = offline_client(handler, cache=ResponseCache(ttl=60), max_retries=3,
+                                circuit_breaker=CircuitBreakers(failure_threshold=2, recovery_timeout=600))
+        cached = client.song('1')
+        self.failing = True
+        with unittest.mock.patch('time.monotonic', return_value=time.monotonic() + 61), \
+                unittest.mock.patch('time.sleep'), unittest.mock.patch('builtins.print'):
+            with self.assertRaises(CircuitOpenError):
+                client.song('2')  # two 503s open the circuit, the third attempt fails fast
+            calls = len(client._session.calls)
+            self.assertTrue(calls == 3)
+            self.assertTrue(client.song('1') == cached)  # expired, served stale instead of failing
+            with self.assertRaises(CircuitOpenError):
+                client.song('3')
+        self.assertTrue(len(client._session.calls) == calls)
+
+
+class TestPriorityScheduler(unittest.TestCase):
+
+    def test_interactive_jumps_bulk_backlog(self):
+        scheduler = PriorityScheduler(rate=100, burst=1)
+        order = []
+
+        def worker(priority):
+            scheduler.acquire(priority)
+            order.append(priority)
+
+        bulk = [threading.Thread(target=worker, args=('bulk',)) for _ in range(20)]
+        for t in bulk:
+            t.start()
+        time.sleep(0.05)
+        interactive = threading.Thread(target=worker, args=('interactive',))
+        interactive.start()
+        for t in bulk + [interactive]:
+            t.join()
+        self.assertTrue(order.index('interactive') < 12)
+
+    def test_unknown_priority(self):
+        with self.assertRaises(ValueError):
+            PriorityScheduler(rate=1).acquire('urgent')
+
+
+class TestKeyPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = KeyPool([{'secret_key': 'x', 'key_id': 'A', 'team_id': 'T'},
+                             {'secret_key': 'x', 'key_id': 'B', 'team_id': 'T'}],
+                            throttle_threshold=2, throttle_cooldown=60)
+
+    def test_spreads_requests(self):
+        for _ in range(10):
+            self.pool.release(self.pool.acquire(), 200)
+        stats = self.pool.stats()
+        self.assertTrue(stats['A']['requests'] == 5 and stats['B']['requests'] == 5)
+
+    def test_key_with_tokens_is_preferred(self):
+        pool = KeyPool([{'secret_key': 'x', 'key_id': 'A', 'team_id': 'T'},
+                        {'secret_key': 'x', 'key_id': 'B', 'team_id': 'T'}], rate_per_key=5)
+        pool.keys[0].in_flight = 3  # busy, but with a token left
+        pool.keys[0].bucket._tokens = 1.5
+        pool.keys[1].bucket._tokens = 0.5  # idle, but has to wait for a refill
+        self.assertTrue(pool.acquire().key_id == 'A')
+
+    def test_throttled_key_leaves_rotation(self):
+        for _ in range(2):
+            key = self.pool.keys[0]
+            key.in_flight += 1
+            self.pool.release(key, 429)
+        for _ in range(5):
+            key = self.pool.acquire()
+            self.assertTrue(key.key_id == 'B')
+            self.pool.release(key, 200)
+
+    def test_unauthorized_key_leaves_rotation(self):
+        key = self.pool.keys[1]
+        key.in_flight += 1
+        self.pool.release(key, 401)
+        self.assertTrue(self.pool.acquire().key_id == 'A')
+
+    def test_request_rejected_by_a_key_is_retried_on_another(self):
+        rejected = {'B'}
+
+        def handler(url, params):
+            key_id = client._session.request_headers[-1]['Authorization'][len('Bearer token-'):]
+            return (401, {'errors': []}) if key_id in rejected else (200, {'data': []})
+
+        client = offline_client(handler, key_pool=[{'secret_key': 'x', 'key_id': key_id, 'team_id': 'T'}
+                                                   for key_id in ('A', 'B')])
+        for key in client.key_pool.keys:
+            key.token_str, key.token_valid_until = 'token-' + key.key_id, datetime.now() + timedelta(hours=1)
+        client.key_pool.keys[0].requests = 1  # B is picked first
+        self.assertTrue(client._call('GET', 'catalog/us/songs/1', {}) == {'data': []})
+        self.assertTrue(len(client._session.calls) == 2)
+        self.assertTrue(client.key_pool.stats()['B']['cooldown'] > 0)
+
+        rejected.add('A')  # with no healthy key left, the error reaches the caller
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client._call('GET', 'catalog/us/songs/1', {})
+        self.assertTrue(len(client._session.calls) == 3)
+
+def _song_id_and_pid(result):
+    return result['data'][0]['id'], os.getpid()
+
+
+class TestSharding(unittest.TestCase):
+
+    def test_hash_ring_is_stable(self):
+        ids = [str(n) for n in range(1000)]
+        three = HashRing(['a', 'b', 'c']).split(ids)
+        four = HashRing(['a', 'b', 'c', 'd']).split(ids)
+        self.assertTrue(sum(len(items) for items in three.values()) == 1000)
+        moved = [i for shard in ('a', 'b', 'c') for i in three[shard] if i not in four[shard]]
+        self.assertTrue(set(moved) <= set(four['d']))
+
+    def test_workers_share_the_client_rate_limit(self):
+        self.assertTrue(ShardedExecutor(offline_client(None, rate_limit=20), processes=2).rate_limiter.rate == 20)
+        self.assertTrue(ShardedExecutor(offline_client(None, rate_limit=20), rate_limit=5).rate_limiter.rate == 5)
+        self.assertTrue(ShardedExecutor(offline_client(None), processes=2).rate_limiter is None)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_map_in_worker_processes(self):
+        def request(session, method, url, **kwargs):
+            song_id = url.rsplit('/', 1)[-1]
+            if song_id == victim:
+                os._exit(3)  # the worker dies without reporting
+            r = requests.models.Response()
+            r.status_code, r.url = 200, url
+            r._content = json.dumps({'data': [{'id': song_id, 'type': 'songs'}]}).encode()
+            return r
+
+        client = offline_client(None, max_retries=1)
+        executor = ShardedExecutor(client, processes=2, start_method='fork')
+        ids = [str(n) for n in range(40)]
+        victim = HashRing(['shard-0', 'shard-1']).split(ids)['shard-0'][-1]  # the last ID of a shard
+        with unittest.mock.patch('requests.Session.request', request):
+            results = list(executor.map('song', ids, postprocess=_song_id_and_pid))
+        pids = {pid for _, (_, pid) in results}
+        self.assertTrue(pids and os.getpid() not in pids)
+        self.assertTrue(all(batch == [song_id] for batch, (song_id, _) in results))
+        # results the dead worker had not flushed yet are reported with the rest of its shard
+        self.assertTrue(len(executor.errors) == 1 and victim in executor.errors[0][0])
+        self.assertTrue(executor.errors[0][1] == 'Worker exited with code 3 before finishing its shard')
+        returned = [batch[0] for batch, _ in results] + executor.errors[0][0]
+        self.assertTrue(sorted(returned) == sorted(ids))
+
+    def test_config_round_trip(self):
+        client = AppleMusic('x', 'y', 'z', max_retries=3, default_fields={'songs': ['name']})
+        client.token_str, client.token_valid_until = 'signed', datetime.now() + timedelta(hours=1)
+        rebuilt = AppleMusic.from_config(pickle.loads(pickle.dumps(client.config())))
+        self.assertTrue(rebuilt.token_str == 'signed')
+        self.assertTrue(rebuilt.max_retries == 3)
+        self.assertTrue(rebuilt.default_fields == {'songs': ['name']})
+
+
+class FakeSession:
+    """
+    Stands in for requests.Session, answering every request with handler(url, params),
+    which returns (status, body) or (status, body, delay in seconds). A body of None is sent as an empty body,
+    with the headers in response_headers
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.calls = []
+        self.writes = []
+        self.request_headers = []
+        self.response_headers = {}
+        self.lock = threading.Lock()
+
+    def request(self, method, url, headers=None, proxies=None, params=None, timeout=None, **kwargs):
+        with self.lock:
+            self.calls.append((url, dict(params or {})))
+            self.request_headers.append(dict(headers or {}))
+            if method != 'GET':
+                self.writes.append((method, url, headers, kwargs.get('json')))
+        status, body, *delay = self.handler(url, params or {})
+        if delay:  # simulate a slow response, timing out like requests would
+            if timeout is not None and delay[0] > timeout:
+                time.sleep(timeout)
+                raise requests.exceptions.ReadTimeout('read timed out')
+            time.sleep(delay[0])
+        r = requests.models.Response()
+        r.status_code = status
+        r.url = url
+        r._content = b'' if body is None else json.dumps(body).encode()
+        r._content_consumed = True
+        r.headers['Content-Type'] = 'application/json'
+        r.headers.update(self.response_headers)
+        return r
+
+
+def offline_client(handler, **kwargs):
+    client = AppleMusic('x', 'y', 'z', **kwargs)
+    client.token_str, client.token_valid_until = 'token', datetime.now() + timedelta(hours=1)
+    client._http_session = FakeSession(handler)
+    return client
+
+
+def paged_tracks(count, with_total=True):
+    def handler(url, params):
+        offset = int(params.get('offset') or 0)
+        limit = min(int(params.get('limit') or 100), 100)
+        body = {'data': [{'id': str(n), 'type': 'songs'} for n in range(offset, min(offset + limit, count))]}
+        if with_total:
+            body['meta'] = {'total': count}
+        elif offset + limit < count:
+            body['next'] = '/v1/catalog/us/playlists/pl.1/tracks?offset={}'.format(offset + limit)
+        return 200, body
+    return handler
+
+
+class TestFetchAll(unittest.TestCase):
+
+    def test_offset_pages_in_order(self):
+        client = offline_client(paged_tracks(950))
+        results = client.fetch_all('playlists', 'pl.1', 'tracks', page_size=300)
+        self.assertTrue([item['id'] for item in results['data']] == [str(n) for n in range(950)])
+        self.assertTrue(len(client._session.calls) == 10)
+
+    def test_follows_next_without_total(self):
+        client = offline_client(paged_tracks(250, with_total=False))
+        results = client.fetch_all('playlists', 'pl.1', 'tracks')
+        self.assertTrue([item['id'] for item in results['data']] == [str(n) for n in range(250)])
+        self.assertTrue(results['meta']['total'] == 250)
+
+    def test_raises_once_retries_run_out(self):
+        client = offline_client(lambda url, params: (503, {}), max_retries=2)
+        with unittest.mock.patch('time.sleep'):
+            with self.assertRaises(requests.HTTPError):
+                client.fetch_all('playlists', 'pl.1', 'tracks')
+        self.assertTrue(len(client._session.calls) == 2)
+
+
+class TestFetchGraph(unittest.TestCase):
+
+    def setUp(self):
+        tracks = {'1': ['t1', 't2'], '2': ['t2', 't3']}
+        artists = {'t1': ['a1'], 't2': ['a1', 'a2'], 't3': ['a2']}
+
+        def resource(resource_type, resource_id, relationship, related_type, related_ids):
+            related = [{'id': i, 'type': related_type, 'attributes': {'name': i}} for i in related_ids]
+            return {'id': resource_id, 'type': resource_type, 'attributes': {'name': resource_id},
+                    'relationships': {relationship: {'data': related}}}
+
+        def handler(url, params):
+            ids = params['ids'].split(',')
+            if url.endswith('/albums'):
+                return 200, {'data': [resource('albums', i, 'tracks', 'songs', tracks[i]) for i in ids]}
+            return 200, {'data': [resource('songs', i, 'artists', 'artists', artists[i]) for i in ids]}
+
+        self.client = offline_client(handler)
+
+    def test_one_request_per_level(self):
+        results = self.client.fetch_graph('albums', ['1', '2'], 'tracks.artists')
+        self.assertTrue(len(self.client._session.calls) == 2)
+        self.assertTrue(self.client._session.calls[1][1]['ids'] == 't1,t2,t3')
+        track = results['data'][0]['relationships']['tracks']['data'][1]
+        self.assertTrue([a['id'] for a in track['relationships']['artists']['data']] == ['a1', 'a2'])
+        self.assertTrue(track is results['data'][1]['relationships']['tracks']['data'][0])
+
+    def test_cached_responses_are_not_linked(self):
+        def handler(url, params):
+            if url.endswith('/albums'):
+                return 200, {'data': [{'id': '1', 'type': 'albums', 'attributes': {'name': 'A'},
+                                       'relationships': {'tracks': {'data': [{'id': 't1', 'type': 'songs'}]}}}]}
+            return 200, {'data': [{'id': 't1', 'type': 'songs', 'attributes': {'name': 'T'},
+                                   'relationships': {'albums': {'data': [{'id': '1', 'type': 'albums'}]}}}]}
+
+        client = offline_client(handler, cache=True)
+        graph = client.fetch_graph('albums', ['1'], 'tracks.albums')
+        track = graph['data'][0]['relationships']['tracks']['data'][0]
+        self.assertTrue(track['relationships']['albums']['data'][0] is graph['data'][0])
+        album = client.albums(['1'], include='tracks')  # served from the cache
+        self.assertTrue(len(client._session.calls) == 2)
+        self.assertTrue(json.loads(json.dumps(album)) == handler('/albums', {})[1])
+
+
+class TestDeadline(unittest.TestCase):
+
+    def test_retries_stop_at_deadline(self):
+        client = offline_client(lambda url, params: (503, {}))
+        start = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            with client.deadline(0.5):
+                client.song('1')
+        self.assertTrue(time.monotonic() - start < 0.5)
+        self.assertTrue(len(client._session.calls) == 1)  # the 2 sec backoff would not fit
+
+    def test_fetch_all_partial_results(self):
+        pages = paged_tracks(500)
+
+        def slow_tail(url, params):
+            status, body = pages(url, params)
+            return status, body, 0.5 if int(params.get('offset') or 0) >= 300 else 0
+
+        client = offline_client(slow_tail)
+        results = client.fetch_all('playlists', 'pl.1', 'tracks', deadline=0.2)
+        self.assertTrue(len(results['data']) == 300)
+        self.assertTrue(results['meta']['incomplete_offsets'] == [300, 400])
+
+
+class TestHedging(unittest.TestCase):
+
+    def test_slow_request_is_hedged(self):
+        attempts = []
+
+        def first_is_slow(url, params):
+            attempts.append(url)
+            return 200, {'data': [{'id': '1'}]}, 1.0 if len(attempts) == 1 else 0
+
+        policy = HedgePolicy(initial_delay=0.05, max_extra=1)
+        client = offline_client(first_is_slow, hedging=policy)
+        start = time.monotonic()
+        self.assertTrue(client.song('1')['data'][0]['id'] == '1')
+        self.assertTrue(time.monotonic() - start < 0.5)
+        self.assertTrue(policy.stats() == {'requests': 1, 'hedged': 1, 'hedge_wins': 1})
+
+    def test_hedging_does_not_cap_concurrency(self):
+        client = offline_client(lambda url, params: (200, {'data': []}, 0.2), hedging=HedgePolicy(initial_delay=5))
+        start = time.monotonic()
+        threads = [threading.Thread(target=client.song, args=(str(n),)) for n in range(64)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(time.monotonic() - start < 0.6)
+        self.assertTrue(len(client._session.calls) == 64)
+
+    def test_attempt_threads_are_reused(self):
+        policy = HedgePolicy(initial_delay=0.05, max_extra=1)
+        client = offline_client(lambda url, params: (200, {'data': []}, 0.2 if params.get('l') == 'slow' else 0),
+                                hedging=policy)
+        for n in range(20):
+            client.song(str(n))
+        self.assertTrue(client._attempt_pool.threads < 5)  # not one per request
+        client.song('slow', l='slow')  # both attempts are slow, the first one wins
+        time.sleep(0.3)
+        self.assertTrue(len(policy._latencies) == 22)  # the hedge's latency is recorded too
+
+    def test_first_attempt_latency_is_recorded_when_the_hedge_wins(self):
+        attempts = []
+
+        def first_is_slow(url, params):
+            attempts.append(url)
+            return 200, {'data': []}, 0.3 if len(attempts) == 1 else 0
+
+        policy = HedgePolicy(initial_delay=0.05, max_extra=1)
+        client = offline_client(first_is_slow, hedging=policy)
+        client.song('1')
+        self.assertTrue(len(policy._latencies) == 1 and policy._latencies[0] < 0.3)
+        time.sleep(0.4)
+        self.assertTrue(sorted(policy._latencies)[-1] >= 0.3)
+
+    def test_winning_attempt_revalidates(self):
+        def handler(url, params):
+            if len(client._session.calls) == 2:
+                return 200, {'data': [{'id': 'new'}]}, 1.0
+            if client._session.request_headers[-1].get('If-None-Match') == '"v1"':
+                return 304, None  # the hedge
+            return 200, {'data': [{'id': 'old'}]}
+
+        policy = HedgePolicy(initial_delay=0.05, max_extra=1)
+        client = offline_client(handler, cache=ResponseCache(ttl=60), hedging=policy)
+        client._session.response_headers = {'ETag': '"v1"'}
+        client.song('1')
+        with unittest.mock.patch('time.monotonic', side_effect=lambda real=time.monotonic: real() + 61):
+            self.assertTrue(client.song('1') == {'data': [{'id': 'old'}]})
+        self.assertTrue(policy.stats()['hedge_wins'] == 1)
+        self.assertTrue(client.cache.stats()['not_modified'] == 1)
+
+    def test_hedge_budget(self):
+        policy = HedgePolicy(max_extra=0.1)
+        for _ in range(10):
+            policy.record_request()
+        self.assertTrue(policy.try_hedge())
+        self.assertFalse(policy.try_hedge())
+
+
+class TestAdaptiveConcurrency(unittest.TestCase):
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = AdaptiveLimiter(initial=4, max_limit=8)
+        for _ in range(40):
+            limiter.on_success(0.1)
+        self.assertTrue(limiter.limit == 8)
+        limiter.on_throttle()
+        self.assertTrue(limiter.limit == 4)
+
+    def test_rising_latency_backs_off(self):
+        limiter = AdaptiveLimiter(initial=4)
+        limiter.on_success(0.1)
+        limiter.on_success(0.5)
+        self.assertTrue(limiter.limit == 2)
+
+    def test_throttling_lowers_client_limit(self):
+        pages = paged_tracks(1000)
+        throttled = set()
+
+        def throttle_once(url, params):
+            offset = params.get('offset')
+            if offset and offset not in throttled:
+                throttled.add(offset)
+                return 429, {}
+            return pages(url, params)
+
+        client = offline_client(throttle_once, adaptive_concurrency=AdaptiveLimiter(initial=8))
+        with unittest.mock.patch('time.sleep'):
+            results = client.fetch_all('playlists', 'pl.1', 'tracks')
+        self.assertTrue(len(results['data']) == 1000)
+        self.assertTrue(client.concurrency_limit < 8)
+
+
+class TestNegativeCache(unittest.TestCase):
+
+    def test_missing_song_is_not_requested_again(self):
+        client = offline_client(lambda url, params: (404, {'errors': []}), negative_cache=True)
+        for _ in range(2):
+            with self.assertRaises(requests.exceptions.HTTPError) as cm:
+                client.song('1')
+            self.assertTrue(cm.exception.response.status_code == 404)
+        self.assertTrue(len(client._session.calls) == 1)
+
+    def test_batch_strips_known_missing_ids(self):
+        def handler(url, params):
+            return 200, {'data': [{'id': i, 'type': 'songs'} for i in params['ids'].split(',') if i != '2']}
+
+        client = offline_client(handler, negative_cache=True)
+        client.songs(['1', '2', '3'])
+        client.songs(['1', '2', '3'])
+        self.assertTrue(client._session.calls[1][1]['ids'] == '1,3')
+        self.assertTrue(client.songs(['2']) == {'data': []})
+        self.assertTrue(len(client._session.calls) == 2)
+
+    def test_missing_isrcs(self):
+        def handler(url, params):
+            return 200, {'data': [{'id': '1', 'type': 'songs', 'attributes': {'isrc': 'USAAA0000001'}}]}
+
+        client = offline_client(handler, negative_cache=True)
+        client.songs_by_isrc(['USAAA0000001', 'USAAA0000002'])
+        client.songs_by_isrc(['USAAA0000001', 'USAAA0000002'])
+        self.assertTrue(client._session.calls[1][1]['filter[isrc]'] == 'USAAA0000001')
+        self.assertTrue(client.songs_by_isrc(['usaaa0000002']) == {'data': []})
+        self.assertTrue(len(client._session.calls) == 2)
+
+    def test_entries_expire(self):
+        cache = NegativeCache(ttl=60)
+        cache.add('us', 'songs', '1')
+        self.assertTrue(cache.contains('us', 'songs', '1'))
+        self.assertFalse(cache.contains('gb', 'songs', '1'))
+        with unittest.mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertFalse(cache.contains('us', 'songs', '1'))
+
+
+class TestCatalogSync(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = {str(n): {'name': 'Song {}'.format(n)} for n in range(400)}
+
+        def handler(url, params):
+            return 200, {'data': [{'id': i, 'type': 'songs', 'attributes': self.catalog[i]}
+                                  for i in params['ids'].split(',') if i in self.catalog]}
+
+        self.client = offline_client(handler)
+        self.sync = CatalogSync(self.client, min_age=0, max_age=0)
+        self.sync.track('songs', list(self.catalog))
+
+    def test_only_changes_are_emitted(self):
+        self.assertTrue(len(list(self.sync.run('songs'))) == 400)
+        self.catalog['5'] = {'name': 'Song 5 (Remastered)'}
+        del self.catalog['6']
+        changes = {(change['change'], change['id']) for change in self.sync.run('songs')}
+        self.assertTrue(changes == {('changed', '5'), ('removed', '6')})
+        self.assertTrue(self.sync.stats['unchanged'] == 398)
+
+    def test_changes_not_consumed_come_back(self):
+        run = self.sync.run('songs')
+        first = [next(run) for _ in range(3)]
+        run.close()
+        rest = list(self.sync.run('songs'))
+        self.assertTrue(len(rest) == 398)  # the third change was handed out but not confirmed by a next()
+        self.assertTrue({change['id'] for change in first + rest} == set(self.catalog))
+        self.assertTrue(list(self.sync.run('songs')) == [])
+
+    def test_max_requests_bounds_a_run(self):
+        changes = list(self.sync.run('songs', max_requests=1))
+        self.assertTrue(len(changes) == 300 and len(self.client._session.calls) == 1)
+        self.assertTrue(self.sync.stats['remaining'] == 100)
+
+
+class TestExport(unittest.TestCase):
+
+    def setUp(self):
+        def handler(url, params):
+            ids = params['ids'].split(',')
+            return 200, {'data': [{'id': i, 'type': 'songs', 'attributes': {'name': 'Song ' + i, 'trackNumber': 1}}
+                                  for i in ids]}
+
+        self.client = offline_client(handler)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_ndjson_streams_resources(self):
+        ids = (str(n) for n in range(700))
+        path = self.tmp.name + '/songs.ndjson.gz'
+        with NDJSONSink(path, compress='gzip') as sink:
+            self.assertTrue(sink.write_all(self.client.iter_resources('songs', ids, max_workers=2)) == 700)
+        self.assertTrue(len(self.client._session.calls) == 3)
+        with gzip.open(path, 'rt') as f:
+            rows = [json.loads(line) for line in f]
+        self.assertTrue([row['id'] for row in rows] == [str(n) for n in range(700)])
+
+    def test_parquet_schema_is_stable(self):
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        path = self.tmp.name + '/songs.parquet'
+        with ParquetSink(path, 'songs', batch_size=100) as sink:
+            sink.write_all(self.client.iter_resources('songs', [str(n) for n in range(250)]))
+        table = pyarrow.parquet.read_table(path)
+        self.assertTrue(table.num_rows == 250)
+        self.assertTrue(table.schema.field('isrc').type == pyarrow.string())
+        self.assertTrue(table.column('track_number').to_pylist()[0] == 1)
+
+    def test_failed_batches_are_raised(self):
+        client = offline_client(lambda url, params: (503, {}), max_retries=2)
+        with unittest.mock.patch('time.sleep'):
+            with self.assertRaises(requests.HTTPError):
+                list(client.iter_resources('songs', ['1', '2']))
+            with self.assertRaises(requests.HTTPError):
+                list(client.iter_relationship('playlists', 'p.1', 'tracks'))
+            with self.assertRaises(requests.HTTPError):
+                list(client.stream_relationship('playlists', 'p.1', 'tracks'))
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_bulk_lookup(self):
+        def handler(url, params):
+            if params['ids'] == 'bad':
+                return 400, {}
+            return 200, {'data': [{'id': i, 'type': 'songs'} for i in params['ids'].split(',') if i != '2']}
+
+        client = offline_client(handler)
+        with open(self.tmp.name + '/ids.txt', 'w') as f:
+            f.write('\n'.join(str(n) for n in range(400)))
+        output = self.tmp.name + '/songs.ndjson'
+        with unittest.mock.patch('sys.stderr'):
+            status = cli_main(['songs', '-i', f.name, '-o', output, '-s', 'us', '-s', 'gb', '-q'], am=client)
+        self.assertTrue(status == 0)
+        with open(output) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertTrue(len(rows) == 800 and len(client._session.calls) == 4)
+        self.assertTrue([row['input'] for row in rows[:3]] == ['0', '1', '2'])
+        self.assertTrue(rows[2]['result'] is None and rows[3]['result']['id'] == '3')
+
+    def test_failed_lookups_are_reported(self):
+        client = offline_client(lambda url, params: (503, {}), max_retries=2)
+        with open(self.tmp.name + '/ids.txt', 'w') as f:
+            f.write('1\n2\n')
+        output = self.tmp.name + '/songs.ndjson'
+        with unittest.mock.patch('sys.stderr'), unittest.mock.patch('time.sleep'):
+            status = cli_main(['songs', '-i', f.name, '-o', output, '-q'], am=client)
+        self.assertTrue(status == 1)
+        with open(output) as f:
+            rows = [json.loads(line) for line in f]
+        self.assertTrue([row['error'].split(':')[0] for row in rows] == ['HTTPError', 'HTTPError'])
+
+    def test_file_cache(self):
+        cache = FileCache(self.tmp.name, ttl=60)
+        key = cache_key('https://api.music.apple.com/v1/catalog/us/songs/1', {'l': None})
+        cache.set(key, {'data': [{'id': '1'}]})
+        self.assertTrue(FileCache(self.tmp.name).get(key) == {'data': [{'id': '1'}]})
+        with unittest.mock.patch('time.time', return_value=time.time() + 61):
+            self.assertTrue(cache.get(key) is None and cache.get(key, allow_stale=True) is not None)
+
+
+class TestReferenceData(unittest.TestCase):
+
+    def setUp(self):
+        genres = [{'id': '34', 'type': 'genres', 'attributes': {'name': 'Music'}},
+                  {'id': '14', 'type': 'genres', 'attributes': {'name': 'Pop', 'parentId': '34'}},
+                  {'id': '1133', 'type': 'genres', 'attributes': {'name': 'K-Pop', 'parentId': '14'}}]
+        storefronts = [{'id': sf, 'type': 'storefronts',
+                        'attributes': {'defaultLanguageTag': 'en-US', 'supportedLanguageTags': ['es-MX', 'en-US']}}
+                       for sf in ('us', 'gb', 'jp')]
+
+        def handler(url, params):
+            data = genres if url.endswith('/genres') else storefronts
+            offset = int(params.get('offset') or 0)
+            page = {'data': data[offset:offset + 2]}
+            if offset + 2 < len(data):
+                page['next'] = '?offset={}'.format(offset + 2)
+            return 200, page
+
+        self.client = offline_client(handler)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def test_refresh_and_snapshot(self):
+        path = self.tmp.name + '/reference.json'
+        ReferenceData(self.client, path=path).refresh()
+        calls = len(self.client._session.calls)
+        self.assertTrue(calls == 4)
+        self.client.reference_data = ReferenceData(self.client, path=path)
+        reference = self.client.reference_data
+        self.assertTrue([genre['id'] for genre in reference.ancestors('1133')] == ['14', '34'])
+        self.assertTrue([genre['id'] for genre in reference.children('34')] == ['14'])
+        self.assertTrue(reference.languages('gb') == ['en-US', 'es-MX'])
+        self.assertTrue(self.client.genre('14')['data'][0]['attributes']['name'] == 'Pop')
+        self.assertTrue(len(self.client.storefronts_all(limit=2)['data']) == 2)
+        self.assertTrue(len(self.client._session.calls) == calls)
+        self.client.genre('14', l='es-MX')  # localized lookups still go to the API
+        self.assertTrue(len(self.client._session.calls) == calls + 1)
+
+
+class TestLibraryWrites(unittest.TestCase):
+
+    def test_add_to_library_in_chunks(self):
+        client = offline_client(lambda url, params: (202, {}), user_token='user')
+        results = client.add_to_library({'songs': [str(n) for n in range(250)], 'albums': ['1']})
+        self.assertTrue([len(result['items'][1]) for result in results] == [100, 100, 50, 1])
+        self.assertTrue(all(result['ok'] for result in results))
+        self.assertTrue(client._session.writes[0][2]['Music-User-Token'] == 'user')
+
+    def test_requires_user_token(self):
+        client = offline_client(lambda url, params: (202, {}))
+        with self.assertRaises(ValueError):
+            client.add_to_library(['1'])
+        with self.assertRaises(ValueError):
+            client.create_library_playlists([{'name': 'Mix', 'tracks': ['1']}])
+        self.assertTrue(client._session.calls == [])
+        self.assertTrue(client._session.writes == [])
+
+    def test_created_playlist_without_id(self):
+        client = offline_client(lambda url, params: (201, {}), user_token='user')
+        with self.assertRaises(AppleMusicError):
+            client.create_library_playlist('Mix', tracks=[str(n) for n in range(150)])
+        self.assertTrue(len(client._session.writes) == 1)
+        self.assertTrue(client.create_library_playlist('Mix', tracks=['1'])['data'] == [])
+
+    def test_appends_are_not_retried_after_server_errors(self):
+        def handler(url, params):
+            if url.endswith('/me/library/playlists'):
+                return 201, {'data': [{'id': 'p.1', 'type': 'library-playlists'}]}
+            return (500, {}) if len(client._session.writes) == 3 else (204, {})
+
+        client = offline_client(handler, user_token='user')
+        result = client.create_library_playlist('Mix', tracks=[str(n) for n in range(450)])
+        self.assertTrue(result['data'][0]['id'] == 'p.1')
+        self.assertTrue([chunk['ok'] for chunk in result['chunks']] == [True, False, False, False])
+        self.assertTrue(len(client._session.writes) == 3)
+        self.assertTrue(client._session.writes[0][3]['relationships']['tracks']['data'][0] == {'id': '0',
+                                                                                               'type': 'songs'})
+
+    def test_throttled_writes_are_retried(self):
+        statuses = [429, 204]
+        client = offline_client(lambda url, params: (statuses.pop(0), {}), user_token='user')
+        with unittest.mock.patch('time.sleep'):
+            results = client.add_tracks_to_library_playlist('p.1', ['i.1'])
+        self.assertTrue(results[0]['ok'] and results[0]['items'] == [{'id': 'i.1', 'type': 'library-songs'}])
+
+
+class TestRetries(unittest.TestCase):
+
+    def setUp(self):
+        patcher = unittest.mock.patch('time.sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def failing(self, handler, failures, status=503):
+        """
+        Wrap a handler so the first request for each of the given offsets or IDs fails
+        """
+        failed = set()
+
+        def wrapped(url, params):
+            key = params.get('offset') or params.get('ids')
+            if key in failures and key not in failed:
+                failed.add(key)
+                if status is None:
+                    raise requests.exceptions.ConnectionError('connection reset')
+                return status, {}
+            return handler(url, params)
+        return wrapped
+
+    def test_transient_errors_are_retried(self):
+        statuses = [503, 429, 200]
+        client = offline_client(lambda url, params: (statuses.pop(0), {'data': [{'id': '1', 'type': 'songs'}]}))
+        self.assertTrue(client.song('1')['data'][0]['id'] == '1')
+        self.assertTrue(len(client._session.calls) == 3)
+
+    def test_client_errors_are_not_retried(self):
+        client = offline_client(lambda url, params: (404, {}))
+        with self.assertRaises(requests.exceptions.HTTPError):
+            client.song('1')
+        self.assertTrue(len(client._session.calls) == 1)
+
+    def test_pagination_survives_failed_pages(self):
+        client = offline_client(self.failing(paged_tracks(1000), {200, 700}))
+        results = client.fetch_all('playlists', 'pl.1', 'tracks')
+        self.assertTrue([item['id'] for item in results['data']] == [str(n) for n in range(1000)])
+        self.assertTrue(len(client._session.calls) == 12)
+
+    def test_batches_survive_dropped_connections(self):
+        def handler(url, params):
+            return 200, {'data': [{'id': i, 'type': 'songs'} for i in params['ids'].split(',')]}
+
+        ids = [str(n) for n in range(1000)]
+        client = offline_client(self.failing(handler, {','.join(ids[300:600])}, status=None))
+        with unittest.mock.patch('builtins.print'):
+            resources = list(client.iter_resources('songs', ids))
+        self.assertTrue([resource['id'] for resource in resources] == ids)
+        self.assertTrue(len(client._session.calls) == 5)
+
+
+class TestPickleAndFork(unittest.TestCase):
+
+    def setUp(self):
+        self.client = offline_client(lambda url, params: (200, {'data': []}), cache=True, circuit_breaker=True,
+                                     rate_limit=50, hedging=True, adaptive_concurrency=True, user_token='user')
+        self.client.song('1')
+
+    def test_pickles_configuration_not_sockets(self):
+        clone = pickle.loads(pickle.dumps(self.client))
+        self.assertTrue(clone._http_session is None)
+        self.assertTrue(clone.token_str == 'token' and clone.user_token == 'user')
+        self.assertTrue(clone.scheduler.rate == 50 and clone.hedging is not None and len(clone.cache) == 0)
+
+    def test_key_pool_tokens_are_shared(self):
+        client = AppleMusic(key_pool=[{'secret_key': 'x', 'key_id': 'A', 'team_id': 'T'}])
+        client.key_pool.keys[0].token_str = 'signed'
+        client.key_pool.keys[0].token_valid_until = datetime.now() + timedelta(hours=1)
+        clone = pickle.loads(pickle.dumps(client))
+        self.assertTrue(clone.key_pool.keys[0].token_str == 'signed')
+
+    def test_key_pool_settings_are_kept(self):
+        pool = KeyPool([{'secret_key': 'x', 'key_id': 'A', 'team_id': 'T'},
+                        {'secret_key': 'x', 'key_id': 'B', 'team_id': 'T', 'rate': 2}],
+                       rate_per_key=5, throttle_threshold=9, throttle_cooldown=30, auth_cooldown=1)
+        for key in pool.keys:
+            key.token_str, key.token_valid_until = 'signed', datetime.now() + timedelta(hours=1)
+        clone = pickle.loads(pickle.dumps(AppleMusic(key_pool=pool)))
+        self.assertTrue([k.bucket.rate for k in clone.key_pool.keys] == [5, 2])
+        self.assertTrue((clone.key_pool.throttle_threshold, clone.key_pool.throttle_cooldown,
+                         clone.key_pool.auth_cooldown) == (9, 30, 1))
+        self.assertTrue(clone.key_pool.config() == pool.config())
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_fork_drops_session(self):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            ok = self.client._http_session is None and self.client.token_str == 'token'
+            os.write(write, b'1' if ok else b'0')
+            os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertTrue(os.read(read, 1) == b'1')
+        self.assertTrue(self.client._http_session is not None)
+
+
+class TestRawMode(unittest.TestCase):
+
+    def setUp(self):
+        self.body = {'data': [{'id': '1', 'type': 'albums', 'attributes': {'name': 'Born To Run'}}]}
+        self.client = offline_client(lambda url, params: (200, self.body), cache=True, hedging=True)
+
+    def test_returns_undecoded_bytes(self):
+        with self.client.raw():
+            response = self.client.album('1')
+        self.assertTrue(json.loads(response.content) == self.body)
+        self.assertTrue(response.headers['Content-Type'] == 'application/json')
+        self.assertTrue(self.client.album('1') == self.body)  # decoded again outside the block
+        self.assertTrue(len(self.client._session.calls) == 2)
+
+    def test_streams_to_writable(self):
+        import io
+
+        out = io.BytesIO()
+        with self.client.raw(stream_to=out, chunk_size=8):
+            response = self.client.album('1')
+        self.assertTrue(response.content is None and response.bytes_written == len(out.getvalue()))
+        self.assertTrue(json.loads(out.getvalue()) == self.body)
+        self.assertTrue(self.client.hedging.requests == 0)
+
+    def test_interrupted_stream_is_not_retried(self):
+        class Broken:
+            def write(self, chunk):
+                raise BrokenPipeError()
+
+        with self.assertRaises(StreamInterrupted):
+            with self.client.raw(stream_to=Broken()):
+                self.client.album('1')
+        self.assertTrue(len(self.client._session.calls) == 1)
+
+    def test_streamed_error_responses_are_closed(self):
+        import io
+
+        client = offline_client(lambda url, params: (503, {}), max_retries=2)
+        with unittest.mock.patch.object(requests.models.Response, 'close', autospec=True) as close:
+            with unittest.mock.patch('time.sleep'), self.assertRaises(requests.HTTPError):
+                with client.raw(stream_to=io.BytesIO()):
+                    client.album('1')
+        self.assertTrue(close.call_count == 2)
+
+    def test_paginating_methods_reject_raw_mode(self):
+        with self.client.raw():
+            with self.assertRaises(ValueError):
+                self.client.fetch_all('playlists', 'p.1', 'tracks')
+            with self.assertRaises(ValueError):
+                list(self.client.iter_resources('songs', ['1']))
+            with self.assertRaises(ValueError):
+                self.client.stream_relationship('playlists', 'p.1', 'tracks')
+        self.assertTrue(self.client._session.calls == [])
+
+
+class TestRevalidation(unittest.TestCase):
+
+    def setUp(self):
+        def handler(url, params):
+            if self.session.request_headers[-1].get('If-None-Match') == '"v1"':
+                return 304, None
+            return 200, {'data': [{'id': '1', 'type': 'albums'}]}
+
+        self.client = offline_client(handler, cache=ResponseCache(ttl=60))
+        self.session = self.client._session
+        self.session.response_headers = {'ETag': '"v1"', 'Last-Modified': 'Mon, 19 Oct 2026 00:00:00 GMT'}
+
+    def test_expired_entry_is_revalidated(self):
+        first = self.client.album('1')
+        self.assertFalse('If-None-Match' in self.session.request_headers[0])
+        with unittest.mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertTrue(self.client.album('1') == first)
+            self.assertTrue(self.client.album('1') == first)  # fresh again after the 304
+        self.assertTrue(len(self.session.calls) == 2)
+        self.assertTrue(self.session.request_headers[1]['If-Modified-Since'] == 'Mon, 19 Oct 2026 00:00:00 GMT')
+        stats = self.client.cache.stats()
+        self.assertTrue(stats['revalidations'] == 1 and stats['not_modified'] == 1)
+        self.assertTrue(stats['revalidation_hit_rate'] == 1)
+
+    def test_changed_entry_is_replaced(self):
+        self.client.album('1')
+        self.session.response_headers = {'ETag': '"v2"'}
+        self.client.cache.set(next(iter(self.client.cache._entries)), {'data': []}, {'etag': '"v0"'})
+        with unittest.mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+            self.assertTrue(self.client.album('1')['data'][0]['id'] == '1')
+        key = next(iter(self.client.cache._entries))
+        self.assertTrue(self.client.cache.validators(key) == {'etag': '"v2"'})
+        self.assertTrue(self.client.cache.stats()['not_modified'] == 0)
+
+    def test_file_cache_keeps_validators(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileCache(directory, ttl=60)
+            cache.set('key', {'data': []}, {'etag': '"v1"'})
+            self.assertTrue(FileCache(directory).validators('key') == {'etag': '"v1"'})
+            with unittest.mock.patch('time.time', return_value=time.time() + 61):
+                self.assertTrue(cache.get('key') is None)
+                self.assertTrue(cache.refresh('key') == {'data': []})
+                self.assertTrue(cache.get('key') == {'data': []})
+            self.assertTrue(pickle.loads(pickle.dumps(cache)).validators('key') == {'etag': '"v1"'})
+
+
+class TestDiscography(unittest.TestCase):
+
+    def test_normalize_title(self):
+        self.assertTrue(normalize_title('Abbey Road (Remastered 2019)') == 'abbey road')
+        self.assertTrue(normalize_title('Folklore - Deluxe Edition') == 'folklore')
+        self.assertTrue(normalize_title('Café Tacvba [Explicit] - EP') == 'cafe tacvba')
+        self.assertTrue(normalize_title('Songs (Live at Wembley)') == 'songs live at wembley')
+        self.assertTrue(normalize_title('Stories (Monologues)') == 'stories monologues')
+        self.assertTrue(normalize_title('Too Much Too Young - The Specials') == 'too much too young the specials')
+        albums = [{'id': str(n), 'type': 'albums', 'attributes': {'name': name, 'releaseDate': date}}
+                  for n, (name, date) in enumerate([('Monologues (Deluxe Edition)', '2000'), ('Monologues', '2001')])]
+        self.assertTrue([album['id'] for album in group_editions(albums)[0]] == ['1', '0'])
+
+    def test_editions_are_grouped(self):
+        def track(track_id, name, isrc):
+            return {'id': track_id, 'type': 'songs', 'attributes': {'name': name, 'isrc': isrc}}
+
+        def album(album_id, name, tracks, date, **attributes):
+            attributes.update(name=name, releaseDate=date)
+            return {'id': album_id, 'type': 'albums', 'attributes': attributes,
+                    'relationships': {'tracks': {'data': tracks}}}
+
+        albums = {
+            '1': album('1', 'Album', [track('11', 'One', 'A1'), track('12', 'Two', 'A2')], '2001-01-01',
+                       contentRating='explicit'),
+            '2': album('2', 'Album (Deluxe Edition)', [track('21', 'One', 'A1'), track('22', 'Two', 'A2'),
+                                                       track('23', 'Three', 'A3')], '2002-01-01'),
+            '3': album('3', 'Album', [track('31', 'One', 'C1'), track('32', 'Two', 'C2')], '2001-01-01',
+                       contentRating='clean'),
+            '4': album('4', 'Hits', [track('41', 'One', 'A1'), track('42', 'Two (Remastered)', 'A2')], '2010-01-01',
+                       isCompilation=True),
+            '5': album('5', 'One - Single', [track('51', 'One', 'A1')], '2000-06-01', isSingle=True),
+        }
+
+        def handler(url, params):
+            if url.endswith('/artists/7/albums'):
+                return 200, {'data': [{'id': i, 'type': 'albums'} for i in sorted(albums)], 'meta': {'total': 5}}
+            self.assertTrue(params['include'] == 'tracks')
+            return 200, {'data': [albums[i] for i in params['ids'].split(',')]}
+
+        client = offline_client(handler)
+        result = client.artist_discography('7')
+        self.assertTrue(len(client._session.calls) == 2)
+        self.assertTrue([release['id'] for release in result['data']] == ['5', '1', '4'])
+        self.assertTrue(result['meta'] == {'albums': 5, 'releases': 3})
+        release = result['data'][1]
+        self.assertTrue(release['kind'] == 'album' and release['title'] == 'album')
+        self.assertTrue([edition['id'] for edition in release['editions']] == ['1', '2', '3'])
+        self.assertTrue([t['id'] for t in release['tracks']] == ['11', '12'])
+        self.assertTrue(release['bonus_tracks'] == [{'id': '23', 'name': 'Three', 'isrc': 'A3', 'duration_ms': None,
+                                                     'disc_number': None, 'track_number': None,
+                                                     'album_id': '2'}])
+        self.assertTrue(result['data'][2]['kind'] == 'compilation')
+        self.assertTrue([edition['id'] for edition in result['data'][2]['editions']] == ['4'])
+
+
+class TestResultStream(unittest.TestCase):
+
+    def test_slow_consumer_throttles_fetching(self):
+        client = offline_client(paged_tracks(1000, with_total=False))
+        stream = client.stream_relationship('playlists', 'p.1', 'tracks', maxsize=150)
+        self.assertTrue(next(stream)['id'] == '0')
+        time.sleep(0.2)
+        self.assertTrue(len(client._session.calls) <= 3)  # one page buffered, one blocked on a full queue
+        self.assertTrue(stream.produced - stream.consumed <= 151)
+        self.assertTrue([track['id'] for track in stream] == [str(n) for n in range(1, 1000)])
+        self.assertTrue(len(client._session.calls) == 10)
+
+    def test_async_iteration(self):
+        client = offline_client(lambda url, params: (200, {'data': [{'id': i, 'type': 'songs'}
+                                                                     for i in params['ids'].split(',')]}))
+
+        async def consume():
+            async with client.stream_resources('songs', (str(n) for n in range(700)), maxsize=10) as stream:
+                return [song['id'] async for song in stream]
+
+        self.assertTrue(asyncio.run(consume()) == [str(n) for n in range(700)])
+        self.assertTrue(len(client._session.calls) == 3)
+
+    def test_errors_and_close(self):
+        def source():
+            yield 1
+            raise ValueError('bad page')
+
+        stream = ResultStream(source())
+        self.assertTrue(next(stream) == 1)
+        with self.assertRaises(ValueError):
+            next(stream)
+
+        closed = threading.Event()
+
+        def endless():
+            try:
+                while True:
+                    yield 0
+            finally:
+                closed.set()
+
+        with ResultStream(endless(), maxsize=5) as stream:
+            next(stream)
+        self.assertTrue(closed.wait(1))
+        self.assertTrue(list(stream) == [])
+
+
+class TestHTTP2Transport(unittest.TestCase):
+
+    def setUp(self):
+        try:
+            import httpx
+        except ImportError:
+            self.skipTest('httpx is not installed')
+        from applemusicpy.transport import HTTP2Session
+
+        self.requests = []
+
+        def handler(request):
+            self.requests.append(request)
+            if request.url.path.endswith('/songs/404'):
+                return httpx.Response(404, json={'errors': []})
+            if request.url.path.endswith('/songs/503'):
+                return httpx.Response(503, json={'errors': []})
+            body = json.dumps({'data': [{'id': '1', 'type': 'songs'}] * 50}).encode()
+            return httpx.Response(200, headers={'Content-Type': 'application/json'},
+                                  content=iter([body[:100], body[100:]]))
+
+        self.client = offline_client(None, http2=True, max_retries=1)
+        self.client._http_session = HTTP2Session(transport=httpx.MockTransport(handler))
+
+    def test_params_and_headers(self):
+        self.assertTrue(self.client.song('1', l='en-GB')['data'][0]['id'] == '1')
+        request = self.requests[0]
+        self.assertTrue(dict(request.url.params) == {'l': 'en-GB'})  # None values are dropped
+        self.assertTrue(request.headers['Authorization'] == 'Bearer token')
+        self.assertTrue('gzip' in request.headers['Accept-Encoding'])
+
+    def test_errors_raise_requests_http_error(self):
+        for song_id, status in (('404', 404), ('503', 503)):
+            with self.assertRaises(requests.exceptions.HTTPError) as cm:
+                self.client._call('GET', 'catalog/us/songs/' + song_id, {})
+            self.assertTrue(cm.exception.response.status_code == status)
+
+    def test_raw_streams_in_chunks(self):
+        class Recorder:
+            def __init__(self):
+                self.chunks = []
+
+            def write(self, chunk):
+                self.chunks.append(bytes(chunk))
+
+        out = Recorder()
+        with self.client.raw(stream_to=out, chunk_size=64):
+            response = self.client.song('1')
+        body = b''.join(out.chunks)
+        self.assertTrue(response.bytes_written == len(body) and len(out.chunks) > 1)
+        self.assertTrue(max(len(chunk) for chunk in out.chunks) <= 64)
+        self.assertTrue(json.loads(body)['data'][0]['id'] == '1')
+
+
+if __name__ == '__main__':
+    if '--live' in sys.argv:
+        sys.argv.remove('--live')
+        LIVE = True
+    if '--record' in sys.argv:
+        sys.argv.remove('--record')
+        LIVE = RECORD = True
 
     unittest.main()